@@ -46,7 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sales.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'sales.middleware.MaintenanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,9 +84,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests so the PRAGMAs below and
+        # the page cache are not rebuilt every time.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Applied to every new SQLite connection (see sales.db_profile). WAL lets
+# readers proceed while settlement writes; cache_size is in KiB when
+# negative, mmap_size in bytes, busy_timeout in milliseconds.
+
+SALES_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -125,3 +144,96 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
+
+
+# Request metrics are served at /metrics (Prometheus text format); requests
+# slower than this many seconds are logged with a time breakdown.
+
+SALES_SLOW_REQUEST_SECONDS = 1.0
+
+
+# Dashboard and list data is cached per data version (see sales.view_cache).
+# The local-memory backend evicts least recently used entries past
+# MAX_ENTRIES; set SALES_VIEW_CACHE_TIMEOUT to 0 to disable the cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sales-views',
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    }
+}
+
+SALES_VIEW_CACHE_ALIAS = 'default'
+
+SALES_VIEW_CACHE_TIMEOUT = 3600
+
+
+# The dashboard chart is bucketed by day, week or month, whichever is the
+# finest that stays within this many points.
+
+SALES_CHART_MAX_POINTS = 120
+
+
+# Items Sold / Money Received lists are paginated with keyset cursors.
+# `?per_page=` accepts only the sizes listed here.
+
+SALES_PAGE_SIZES = [25, 50, 100, 200]
+
+SALES_DEFAULT_PAGE_SIZE = 50
+
+
+# PDF reports are rendered by a background thread pool and cached on disk,
+# keyed on the data version and report parameters.
+
+SALES_REPORT_DIR = BASE_DIR / 'reports'
+
+SALES_REPORT_WORKERS = 2
+
+SALES_REPORT_CACHE_SIZE = 20
+
+# Default PDF engine: 'html' (xhtml2pdf template) or 'native' (reportlab
+# canvas, much faster on large ledgers). ?engine= overrides it per request.
+
+SALES_REPORT_ENGINE = 'html'
+
+# manage.py archive_history moves closed and settled months older than this
+# many days (or --before) out of the live tables; see sales.archive.
+
+SALES_ARCHIVE_KEEP_DAYS = 365
+
+# Entry form posts and deletes leave settlement to a background pass that
+# runs this many seconds after the first write, so a burst of entries is
+# settled once (see sales.scheduler). 0 settles on every write.
+
+SALES_SETTLEMENT_DEBOUNCE = 2.0
+
+# Party/amount-filtered totals and charts are answered from an in-process,
+# array-backed snapshot of the ledgers, rebuilt once per data version (see
+# sales.snapshot). Costs 32-64 bytes per row in every worker.
+
+SALES_LEDGER_SNAPSHOT = True
+
+
+# Online backups copy this many SQLite pages per step and pause between
+# steps so live requests are not starved of the database lock.
+
+SALES_BACKUP_PAGES_PER_STEP = 256
+
+SALES_BACKUP_STEP_PAUSE = 0.005
+
+# Quick Backup writes deduplicated, compressed snapshots here; the database
+# is split into chunks of this many bytes (a multiple of the page size).
+
+SALES_BACKUP_STORE = BASE_DIR / 'backup' / 'store'
+
+SALES_BACKUP_CHUNK_SIZE = 64 * 1024
+
+# Restores swap the database file inside a short maintenance window; requests
+# arriving meanwhile wait up to SALES_MAINTENANCE_WAIT seconds (then get a
+# 503). A flag older than SALES_MAINTENANCE_STALE_AFTER is treated as left
+# over from a crash.
+
+SALES_MAINTENANCE_WAIT = 5
+
+SALES_MAINTENANCE_STALE_AFTER = 60
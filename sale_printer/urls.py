@@ -19,5 +19,7 @@ from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Async (ASGI) versions of the dashboard, lists and PDF report.
+    path('async/', include('sales.async_urls')),
     path('', include('sales.urls')),
 ]
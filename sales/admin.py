@@ -1,15 +1,22 @@
 from django.contrib import admin
-from .models import MoneyReceived, ItemSold
+from .models import MoneyReceived, ItemSold, Party
+
+@admin.register(Party)
+class PartyAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name',)
 
 @admin.register(MoneyReceived)
 class MoneyReceivedAdmin(admin.ModelAdmin):
-    list_display = ('id', 'date', 'amount')
-    list_filter = ('date',)
+    list_display = ('id', 'party', 'date', 'amount')
+    list_filter = ('party', 'date')
+    list_select_related = ('party',)
     ordering = ('-date',)
 
 @admin.register(ItemSold)
 class ItemSoldAdmin(admin.ModelAdmin):
-    list_display = ('id', 'date', 'weight', 'price', 'total')
-    list_filter = ('date',)
+    list_display = ('id', 'party', 'date', 'weight', 'price', 'total')
+    list_filter = ('party', 'date')
+    list_select_related = ('party',)
     ordering = ('-date',)
     readonly_fields = ('total',)
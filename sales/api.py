@@ -0,0 +1,88 @@
+"""
+Read-only JSON API for the dashboard.
+
+Every endpoint takes the FilterForm parameters and answers with compact,
+columnar JSON (one array per field instead of one object per row). The
+ETag is derived from the cache key, i.e. the endpoint, the normalized
+filters and the data version, so a client revalidating with
+If-None-Match gets a 304 for the cost of the version lookup.
+"""
+import datetime
+import hashlib
+
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+
+from . import dashboard, export, ledger, rollup, scheduler, settlement, view_cache
+from .forms import FilterForm
+from .pagination import PAGE_PARAMS, page_query, paginate
+
+PERIODS = (rollup.DAY, rollup.WEEK, rollup.MONTH)
+
+ITEM_COLUMNS = ('id', 'date', 'weight', 'price', 'total', 'is_closed')
+
+
+def _filters(request):
+    filter_form = FilterForm(request.GET or None)
+    return filter_form.cleaned_data if filter_form.is_valid() else {}
+
+
+def _respond(request, name, params, build):
+    state = settlement.get_state()
+    key = view_cache.cache_key(name, params, state.data_version)
+    etag = quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        payload = view_cache.cached(name, params, state.data_version, lambda: build(state))
+        response = JsonResponse(payload)
+    response['ETag'] = etag
+    # Always revalidate; the ETag makes that cheap.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def chart(request):
+    cleaned_data = _filters(request)
+    period = request.GET.get('period')
+    period = period if period in PERIODS else None
+
+    def build(state):
+        period_used, labels, received, sold = dashboard.chart_series(cleaned_data, period, state.data_version)
+        return {'period': period_used, 'labels': labels, 'received': received, 'sold': sold}
+
+    return _respond(request, 'api_chart', dict(cleaned_data, period=period), build)
+
+
+def summary(request):
+    cleaned_data = _filters(request)
+
+    def build(state):
+        cards = dashboard.build_summary(cleaned_data, state.data_version)
+        due_items = cards.pop('filtered_items')
+        cards['due_items'] = len(due_items) if due_items is not None else 0
+        return cards
+
+    return _respond(request, 'api_summary', dict(cleaned_data, today=datetime.date.today()), build)
+
+
+def items(request):
+    cleaned_data = _filters(request)
+    # is_closed is part of the payload; catch up deferred writes first.
+    scheduler.flush()
+
+    def build(state):
+        # Same rows as the item list, archived ones included when needed.
+        page = paginate(export.filtered(ledger.ITEM, cleaned_data), ('-date', 'id'),
+                        page_query(cleaned_data, request.GET))
+        payload = {column: [getattr(row, column) for row in page] for column in ITEM_COLUMNS}
+        payload['next'] = page.next_query if page.has_next else None
+        payload['previous'] = page.previous_query if page.has_previous else None
+        return payload
+
+    params = dict(cleaned_data, today=datetime.date.today())
+    params.update({name: request.GET.get(name) for name in PAGE_PARAMS})
+    return _respond(request, 'api_items', params, build)
@@ -0,0 +1,150 @@
+"""
+Archive of closed and settled history.
+
+Old rows are closed and settled and never change again, yet every list,
+aggregate and settlement pass used to scan them. ``archive`` moves whole
+months of them out of ItemSold/MoneyReceived into ArchivedItemSold and
+ArchivedMoneyReceived (same columns and ids) and leaves one ArchivedPeriod
+row per ledger and month behind. Only months before every ledger's first
+open item and first unsettled payment qualify, so archived rows are a
+prefix of their ledger in (date, id) order: settlement carries on from the
+archived totals kept on each ledger's state, and "Net Due" and the value of
+the closed items stay exact. The daily rollups of archived dates are kept
+as they are.
+
+Rows dated before ``cutoff()`` are archived. Pages whose date filter
+reaches back past it read the archive tables too (``needed``); the entry
+forms refuse dates in the archived range.
+"""
+import datetime
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncMonth
+
+from . import ledger, settlement
+from .models import (ArchivedItemSold, ArchivedMoneyReceived, ArchivedPeriod, ItemSold, MoneyReceived,
+                     SettlementState)
+
+# live model -> archive model
+TABLES = {
+    ItemSold: ArchivedItemSold,
+    MoneyReceived: ArchivedMoneyReceived,
+}
+
+
+@dataclass
+class ArchiveStats:
+    before: datetime.date = None
+    items: int = 0
+    money: int = 0
+    periods: int = 0
+
+    def __str__(self):
+        if self.before is None:
+            return 'nothing to archive'
+        return f"{self.items} items, {self.money} receipts in {self.periods} period(s) before {self.before}"
+
+
+def cutoff():
+    """Rows dated before this have been archived (None if nothing has)."""
+    return SettlementState.archive_cutoff()
+
+
+def needed(cleaned_data):
+    """Whether the FilterForm date range reaches into the archive."""
+    before = cutoff()
+    start_date = cleaned_data.get('start_date')
+    return before is not None and (start_date is None or start_date < before)
+
+
+def archivable_before(before=None):
+    """
+    First day of the month the live tables must start from: no later than
+    ``before`` (default: SALES_ARCHIVE_KEEP_DAYS ago) and no later than any
+    ledger's first open item or unsettled payment.
+    """
+    limits = [before or datetime.date.today() - datetime.timedelta(days=settings.SALES_ARCHIVE_KEEP_DAYS)]
+    for model, flag in ((ItemSold, 'is_closed'), (MoneyReceived, 'is_settled')):
+        first = model.objects.filter(**{flag: False}).aggregate(first=Min('date'))['first']
+        if first is not None:
+            limits.append(first)
+    return min(limits).replace(day=1)
+
+
+def _periods(before):
+    # (party_id, month) -> ArchivedPeriod for the rows about to be moved.
+    periods = {}
+
+    def period(row):
+        key = (row['party_id'], row['month'])
+        if key not in periods:
+            periods[key] = ArchivedPeriod(party_id=key[0], month=key[1])
+        return periods[key]
+
+    items = (ItemSold.objects.filter(date__lt=before).annotate(month=TruncMonth('date'))
+             .values('party_id', 'month')
+             .annotate(item_count=Count('id'), weight=Sum('weight'), sold=Sum('total')).order_by())
+    for row in items:
+        entry = period(row)
+        entry.item_count, entry.weight, entry.sold = row['item_count'], row['weight'], row['sold']
+    money = (MoneyReceived.objects.filter(date__lt=before).annotate(month=TruncMonth('date'))
+             .values('party_id', 'month').annotate(payment_count=Count('id'), received=Sum('amount')).order_by())
+    for row in money:
+        entry = period(row)
+        entry.payment_count, entry.received = row['payment_count'], row['received']
+    return list(periods.values())
+
+
+def _move(model, before):
+    # INSERT ... SELECT and DELETE in SQL: no rows are loaded and no
+    # per-row delete signals run (the ledger is trimmed separately).
+    target = TABLES[model]
+    columns = [field.column for field in target._meta.concrete_fields]
+    quote = connection.ops.quote_name
+    rows = model.objects.filter(date__lt=before)
+    select, params = rows.values_list(*columns).query.sql_with_params()
+    ids, id_params = rows.values_list('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {quote(target._meta.db_table)} ({', '.join(map(quote, columns))}) {select}",
+                       params)
+        cursor.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE id IN ({ids})", id_params)
+        return cursor.rowcount
+
+
+@transaction.atomic
+def archive(before=None):
+    """Move the closed and settled months before ``before`` into the archive."""
+    # The flags decide what may move; catch up with pending writes first.
+    settlement.settle_dirty()
+    before = archivable_before(before)
+    current = cutoff()
+    if current is not None and before <= current:
+        return ArchiveStats()
+
+    stats = ArchiveStats(before=before)
+    periods = _periods(before)
+    stats.periods = len(ArchivedPeriod.objects.bulk_create(periods))
+    stats.items = _move(ItemSold, before)
+    stats.money = _move(MoneyReceived, before)
+    ledger.drop_before(before)
+
+    # Each ledger's settlement now starts from its archived totals.
+    moved = {}
+    for period in periods:
+        sold, received = moved.get(period.party_id, (0, 0))
+        moved[period.party_id] = (sold + (period.sold or 0), received + (period.received or 0))
+    for party_id, (sold, received) in moved.items():
+        state = settlement.get_state(party_id)
+        state.archived_items_value += sold
+        state.archived_received += received
+        state.revision += 1
+        state.save(update_fields=['archived_items_value', 'archived_received', 'revision'])
+
+    general = settlement.get_state()
+    general.archived_before = before
+    general.save(update_fields=['archived_before'])
+    settlement.bump_version()
+    return stats
@@ -0,0 +1,11 @@
+from django.urls import path
+from . import async_views
+
+app_name = 'sales_async'
+
+urlpatterns = [
+    path('', async_views.index, name='index'),
+    path('money-received/', async_views.money_received, name='money_received'),
+    path('item-sold/', async_views.item_sold, name='item_sold'),
+    path('pdf-report/', async_views.pdf_report, name='pdf_report'),
+]
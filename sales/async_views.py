@@ -0,0 +1,105 @@
+"""
+Async versions of the read-heavy pages, served under /async/.
+
+These use Django's async ORM (``aaggregate``, ``async for``) and await
+independent queries together, so under an ASGI server (``uvicorn
+sale_printer.asgi:application``) a waiting request does not hold a worker.
+Blocking work (settlement state, pagination, PDF jobs) is offloaded with
+``sync_to_async``, as are form validation and template rendering, which
+look up the party choices. With SQLite the async ORM still runs each query on
+Django's sync thread, so queries are serialized; the win is that the event
+loop keeps accepting and answering other requests meanwhile.
+"""
+import asyncio
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import redirect, render
+
+from . import dashboard, export, jobs, ledger, scheduler, settlement, view_cache
+from .forms import FilterForm, ItemSoldForm, MoneyReceivedForm
+from .pagination import page_query, paginate
+from .views import _listing_params, _report_file, chart_url, list_totals
+
+
+@sync_to_async
+def _cleaned(filter_form):
+    return filter_form.cleaned_data if filter_form.is_valid() else {}
+
+
+@sync_to_async
+def _save(form):
+    # Saving runs the ledger signal handlers; keep them off the loop. The
+    # settlement itself is left to the scheduler, as in the sync views.
+    if form.is_valid():
+        with scheduler.deferred():
+            form.save()
+        return True
+    return False
+
+
+async def _with_pending(summary):
+    return dict(await summary, settlement_pending=await sync_to_async(scheduler.pending)())
+
+
+async def index(request):
+    filter_form = FilterForm(request.GET or None)
+    cleaned_data = await _cleaned(filter_form)
+    state = await sync_to_async(settlement.get_state)()
+    summary = await view_cache.acached(
+        'index', dict(cleaned_data, today=datetime.date.today()), state.data_version,
+        lambda: _with_pending(dashboard.abuild_summary(cleaned_data, state.data_version)),
+    )
+    context = dict(summary)
+    context['filter_form'] = filter_form
+    context['chart_url'] = chart_url(request)
+    return await sync_to_async(render)(request, 'sales/index.html', context)
+
+
+async def _listing(request, kind, form_class, template, names, ordering):
+    if request.method == 'POST':
+        form = form_class(request.POST)
+        if await _save(form):
+            return redirect(request.path)
+    else:
+        form = form_class(initial={'date': datetime.date.today()})
+
+    filter_form = FilterForm(request.GET or None)
+    cleaned_data = await _cleaned(filter_form)
+    total_name, open_name, rows_name = names
+    version = await sync_to_async(settlement.data_version)()
+
+    async def build():
+        # The totals (see views.list_totals) and the page are independent.
+        segments = await sync_to_async(export.filtered)(kind, cleaned_data)
+        (total, still_open), page = await asyncio.gather(
+            sync_to_async(list_totals)(kind, cleaned_data, segments, version),
+            sync_to_async(paginate)(segments, ordering, page_query(cleaned_data, request.GET)),
+        )
+        return {total_name: total, open_name: still_open, 'page': page,
+                'settlement_pending': await sync_to_async(scheduler.pending)()}
+
+    listing = await view_cache.acached(f'async_{kind}', _listing_params(filter_form, request.GET), version, build)
+    context = dict(listing)
+    context.update({'form': form, rows_name: listing['page'], 'filter_form': filter_form})
+    return await sync_to_async(render)(request, template, context)
+
+
+async def money_received(request):
+    return await _listing(request, ledger.MONEY, MoneyReceivedForm, 'sales/money_received.html',
+                          ('total_received', 'unsettled_money', 'entries'), ('-date', '-id'))
+
+
+async def item_sold(request):
+    return await _listing(request, ledger.ITEM, ItemSoldForm, 'sales/item_sold.html',
+                          ('total_sold', 'open_sales', 'items'), ('-date', 'id'))
+
+
+async def pdf_report(request):
+    # Rendering already runs on the report pool; the bookkeeping (version
+    # lookup, cache check), opening the file and the pending page run on a
+    # worker thread.
+    job = await sync_to_async(jobs.submit)({'engine': request.GET.get('engine')})
+    if job.status == jobs.DONE:
+        return await sync_to_async(_report_file)(job)
+    return await sync_to_async(render)(request, 'sales/report_pending.html', {'job': job})
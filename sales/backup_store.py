@@ -0,0 +1,193 @@
+"""
+Deduplicated, compressed backup store.
+
+A snapshot is an online copy of the database split into fixed-size chunks.
+Each chunk is stored once under its SHA-256, compressed with zstd when the
+``zstandard`` package is installed and zlib otherwise, and a JSON manifest
+lists the chunks in order. Unchanged pages of a large database therefore
+cost nothing in later snapshots.
+
+Layout under SALES_BACKUP_STORE::
+
+    chunks/ab/ab12....zst      one file per distinct chunk
+    snapshots/<name>.json      manifest per snapshot
+"""
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+
+from django.conf import settings
+
+from . import backup
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+SNAPSHOT_SUFFIX = '.snapshot'
+
+# Chunks younger than this are never swept, so a snapshot that is still
+# being written (chunks on disk, manifest not yet) survives a concurrent GC.
+GC_GRACE_SECONDS = 3600
+
+
+def _store():
+    return str(settings.SALES_BACKUP_STORE)
+
+
+def _chunk_path(digest, codec):
+    return os.path.join(_store(), 'chunks', digest[:2], f'{digest}.{codec}')
+
+
+def _manifest_path(name):
+    return os.path.join(_store(), 'snapshots', f'{name}.json')
+
+
+def _compress(data):
+    if zstandard is not None:
+        return 'zst', zstandard.ZstdCompressor(level=3).compress(data)
+    return 'z', zlib.compress(data, 6)
+
+
+def _decompress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise backup.BackupError(f"{path} needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _existing_chunk(digest):
+    for codec in ('zst', 'z'):
+        path = _chunk_path(digest, codec)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def create_snapshot(name, source_path=None):
+    """Snapshot the live database (or ``source_path``) and return its manifest."""
+    source_path = source_path or backup.live_database_path()
+    os.makedirs(_store(), exist_ok=True)
+    fd, copy_path = tempfile.mkstemp(dir=_store(), suffix='.sqlite3')
+    os.close(fd)
+    try:
+        stats = backup.online_backup(source_path, copy_path)
+        chunks = []
+        stored_bytes = 0
+        whole = hashlib.sha256()
+        with open(copy_path, 'rb') as f:
+            while True:
+                data = f.read(settings.SALES_BACKUP_CHUNK_SIZE)
+                if not data:
+                    break
+                whole.update(data)
+                digest = hashlib.sha256(data).hexdigest()
+                chunks.append(digest)
+                existing = _existing_chunk(digest)
+                if existing is None:
+                    codec, packed = _compress(data)
+                    _write_atomic(_chunk_path(digest, codec), packed)
+                    stored_bytes += len(packed)
+                else:
+                    # Refresh so the GC grace period covers reused chunks too.
+                    os.utime(existing)
+    finally:
+        os.remove(copy_path)
+
+    manifest = {
+        'name': name,
+        'created': datetime.datetime.now().isoformat(),
+        'size': stats.bytes,
+        'sha256': whole.hexdigest(),
+        'chunk_size': settings.SALES_BACKUP_CHUNK_SIZE,
+        'stored_bytes': stored_bytes,
+        'seconds': round(stats.seconds, 3),
+        'chunks': chunks,
+    }
+    _write_atomic(_manifest_path(name), json.dumps(manifest).encode())
+    return manifest
+
+
+def load_manifest(name):
+    with open(_manifest_path(name)) as f:
+        return json.load(f)
+
+
+def list_snapshots():
+    directory = os.path.join(_store(), 'snapshots')
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for f in os.listdir(directory):
+        if f.endswith('.json'):
+            manifest = load_manifest(f[:-len('.json')])
+            manifest.pop('chunks')
+            manifests.append(manifest)
+    manifests.sort(key=lambda m: m['created'], reverse=True)
+    return manifests
+
+
+def materialize(name, dest_path):
+    """Rebuild snapshot ``name`` into ``dest_path`` and verify it."""
+    manifest = load_manifest(name)
+    whole = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        for digest in manifest['chunks']:
+            path = _existing_chunk(digest)
+            if path is None:
+                raise backup.BackupError(f"Snapshot {name} is missing chunk {digest}")
+            data = _decompress(path)
+            whole.update(data)
+            out.write(data)
+    if whole.hexdigest() != manifest['sha256']:
+        os.remove(dest_path)
+        raise backup.BackupError(f"Snapshot {name} failed its checksum")
+    return dest_path
+
+
+def prune(keep, keep_days=None):
+    """
+    Drop all but the newest ``keep`` snapshots (and, with ``keep_days``,
+    anything older than that), then delete chunks no manifest references.
+    Returns (snapshots_removed, chunks_removed).
+    """
+    snapshots = list_snapshots()
+    cutoff = None
+    if keep_days is not None:
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=keep_days)).isoformat()
+    removed = 0
+    for index, manifest in enumerate(snapshots):
+        if index >= keep or (cutoff and manifest['created'] < cutoff):
+            os.remove(_manifest_path(manifest['name']))
+            removed += 1
+
+    live = set()
+    for manifest in list_snapshots():
+        live.update(load_manifest(manifest['name'])['chunks'])
+
+    swept = 0
+    grace = time.time() - GC_GRACE_SECONDS
+    chunk_root = os.path.join(_store(), 'chunks')
+    for directory, _, files in os.walk(chunk_root):
+        for f in files:
+            path = os.path.join(directory, f)
+            if f.split('.')[0] not in live and os.path.getmtime(path) < grace:
+                os.remove(path)
+                swept += 1
+    return removed, swept
@@ -0,0 +1,198 @@
+"""
+Benchmark harness (driven by ``manage.py bench``).
+
+``generate`` fills the database with a synthetic ledger: sales spread over
+a date range that grows with the row count (busier on weekdays, quiet on
+Sundays) and receipts that arrive in lumps a few days behind the sales
+they pay for, covering most but not all of them, so there is always an
+open tail to settle.
+
+``measure`` runs one step and records its wall time, SQL query count and
+peak Python memory (tracemalloc). Steps are repeatable (a second append or
+restore does the same work as the first), which lets memory be traced on
+a separate run from the one that is timed.
+"""
+import datetime
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (backup, backup_store, ledger, maintenance, pdf_canvas, reports, rollup, settlement, snapshot,
+               view_cache)
+from .models import ItemSold, MoneyReceived
+
+BATCH_SIZE = 5000
+
+# Share of rows that are sales; the rest are receipts.
+ITEM_SHARE = 0.75
+
+# Receipts cover this share of sales value; the rest stays open.
+PAID_SHARE = 0.95
+
+STEPS = ('settle_full', 'settle_append', 'settle_backdate', 'dashboard', 'dashboard_cached',
+         'chart_api', 'item_list', 'item_list_deep', 'item_list_amount', 'pdf', 'pdf_native', 'backup', 'restore')
+
+
+def parse_size(value):
+    """'1k' -> 1000, '100k' -> 100000, '1M' -> 1000000, '2500' -> 2500."""
+    multipliers = {'k': 1000, 'm': 1000000}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def measure(step, trace_memory=True):
+    """
+    Run ``step()`` and return {'seconds', 'queries', 'peak_kb'}.
+
+    Time and queries come from a plain run. tracemalloc slows Python-heavy
+    code several times over, so the memory peak comes from a second, traced
+    run of the same step (``peak_kb`` is None without ``trace_memory``).
+    """
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        step()
+    result = {'seconds': round(time.perf_counter() - started, 4), 'queries': len(queries), 'peak_kb': None}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            step()
+            result['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def reset():
+    # flush issues plain DELETEs; no per-row signal handlers.
+    call_command('flush', interactive=False, verbosity=0)
+    view_cache.clear()
+    snapshot.invalidate()
+
+
+def generate(rows, seed=0):
+    """
+    Insert ``rows`` synthetic ItemSold/MoneyReceived rows and derive the
+    ledger and rollups (but not the settlement flags, see ``settle_full``).
+    """
+    rng = random.Random(seed)
+    item_rows = int(rows * ITEM_SHARE)
+    money_rows = rows - item_rows
+    days = max(30, rows // 40)
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=days - 1)
+    # Weekdays are busiest, Sundays nearly empty.
+    weekday_weight = [1.2, 1.2, 1.1, 1.1, 1.3, 0.8, 0.2]
+    calendar = [start + datetime.timedelta(days=n) for n in range(days)]
+    weights = [weekday_weight[d.weekday()] for d in calendar]
+
+    sold_by_day = {}
+    batch = []
+    for date in sorted(rng.choices(calendar, weights=weights, k=item_rows)):
+        weight = Decimal(rng.lognormvariate(1.5, 0.6)).quantize(Decimal('0.001'))
+        price = Decimal(rng.choice([45, 50, 55, 60, 75, 90, 120]))
+        total = (weight * price).quantize(Decimal('0.01'))
+        sold_by_day[date] = sold_by_day.get(date, Decimal(0)) + total
+        batch.append(ItemSold(date=date, weight=weight, price=price, total=total))
+        if len(batch) >= BATCH_SIZE:
+            ItemSold.objects.bulk_create(batch)
+            batch = []
+    ItemSold.objects.bulk_create(batch)
+
+    # Receipts: lumps paid a few days after the sales, spread so that the
+    # running total of money tracks PAID_SHARE of the running sales.
+    pay_days = sorted(rng.choices(calendar, weights=weights, k=money_rows))
+    cumulative_sold = Decimal(0)
+    paid = Decimal(0)
+    sold_iter = iter(sorted(sold_by_day.items()))
+    pending = next(sold_iter, None)
+    batch = []
+    for index, date in enumerate(pay_days):
+        lag = datetime.timedelta(days=rng.randint(2, 10))
+        while pending is not None and pending[0] + lag <= date:
+            cumulative_sold += pending[1]
+            pending = next(sold_iter, None)
+        due = cumulative_sold * Decimal(PAID_SHARE) - paid
+        remaining = money_rows - index
+        amount = max(Decimal('1.000'), due / remaining * Decimal(rng.uniform(0.5, 1.5))).quantize(Decimal('0.001'))
+        paid += amount
+        batch.append(MoneyReceived(date=date, amount=amount))
+        if len(batch) >= BATCH_SIZE:
+            MoneyReceived.objects.bulk_create(batch)
+            batch = []
+    MoneyReceived.objects.bulk_create(batch)
+
+    ledger.rebuild()
+    rollup.refresh_range()
+    snapshot.invalidate()
+
+
+def run(rows, steps=STEPS, seed=0, trace_memory=True, log=print):
+    """Generate a ledger of ``rows`` rows and measure ``steps`` on it."""
+    reset()
+    results = {'generate': measure(lambda: generate(rows, seed), trace_memory=False)}
+    log(f"  generate: {results['generate']['seconds']:.2f}s")
+
+    client = Client()
+    oldest = ItemSold.objects.order_by('date').values_list('date', flat=True).first()
+    middle = ItemSold.objects.order_by('-date', 'id')[ItemSold.objects.count() // 2]
+    work = tempfile.mkdtemp(prefix='sales-bench-')
+    saved = {}
+
+    def dashboard():
+        client.get(reverse('sales:index'), {'due_days': 15})
+
+    def restore():
+        rebuilt = os.path.join(work, 'restore.sqlite3')
+        backup_store.materialize(saved['name'], rebuilt)
+        maintenance.atomic_restore(rebuilt, backup.live_database_path())
+        snapshot.invalidate()
+        settlement.settle_all(full=True)
+
+    def make_backup():
+        saved['name'] = 'bench'
+        backup_store.create_snapshot('bench')
+
+    actions = {
+        'settle_full': lambda: settlement.settle(full=True),
+        'settle_append': lambda: ItemSold.objects.create(date=datetime.date.today(), weight=1, price=10),
+        'settle_backdate': lambda: ItemSold.objects.create(date=oldest, weight=1, price=10),
+        'dashboard': lambda: (view_cache.clear(), dashboard()),
+        'dashboard_cached': dashboard,
+        'chart_api': lambda: (view_cache.clear(), client.get(reverse('sales:api_chart'))),
+        'item_list': lambda: (view_cache.clear(), client.get(reverse('sales:item_sold'))),
+        'item_list_deep': lambda: (view_cache.clear(), client.get(
+            reverse('sales:item_sold'), {'after': f'{middle.date.isoformat()}_{middle.pk}'})),
+        # Totals under an amount filter (see sales.snapshot); the page cache
+        # is cleared, the snapshot of the unchanged data is not.
+        'item_list_amount': lambda: (view_cache.clear(), client.get(
+            reverse('sales:item_sold'), {'min_amount': 100})),
+        'pdf': lambda: reports.write_pdf(io.BytesIO()),
+        'pdf_native': lambda: pdf_canvas.write_pdf(io.BytesIO()),
+        'backup': make_backup,
+        'restore': restore,
+    }
+
+    try:
+        with override_settings(SALES_BACKUP_STORE=os.path.join(work, 'store'), SALES_BACKUP_STEP_PAUSE=0):
+            for step in steps:
+                if step == 'restore' and 'name' not in saved:
+                    make_backup()
+                result = results[step] = measure(actions[step], trace_memory)
+                peak = f", {result['peak_kb']:.0f} KB peak" if result['peak_kb'] is not None else ''
+                log(f"  {step}: {result['seconds']:.3f}s, {result['queries']} queries{peak}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return results
@@ -0,0 +1,365 @@
+"""
+Dashboard summary service.
+
+Builds everything the dashboard shows in a fixed number of queries. With
+date-only filters the cards and chart come from the daily rollups (one
+aggregate and one series query); amount and party filters need the raw
+rows, so they fall back to one conditional aggregate per table and one
+UNION ALL pass for the chart. Both paths add the settlement watermarks
+and, when the due filter is active, the due-items list.
+
+The chart is served separately (``chart_series``) and bucketed by day, week
+or month so that it never has more than SALES_CHART_MAX_POINTS points.
+
+The rollups keep the archived dates (see ``sales.archive``). The raw-row
+paths read the archive tables as well when the date range reaches back
+past the archive cutoff; ``segmented_querysets`` gives the archived part
+first, then the live one. With SALES_LEDGER_SNAPSHOT the raw-row totals
+and chart come from the in-process ledger snapshot (``sales.snapshot``)
+instead of SQL.
+"""
+import asyncio
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import DecimalField, F, Max, Min, Q, Sum, Value
+
+from . import archive, ledger, rollup, snapshot
+from .models import ArchivedItemSold, ArchivedMoneyReceived, DailySummary, ItemSold, MoneyReceived, SettlementState
+
+
+def filtered_querysets(cleaned_data, archived=False):
+    """Apply the FilterForm party/date/amount filters to both tables (or both archive tables)."""
+    money_qs = (ArchivedMoneyReceived if archived else MoneyReceived).objects.all()
+    sold_qs = (ArchivedItemSold if archived else ItemSold).objects.all()
+
+    party = cleaned_data.get('party')
+    if party:
+        money_qs = money_qs.filter(party=party)
+        sold_qs = sold_qs.filter(party=party)
+
+    start_date = cleaned_data.get('start_date')
+    end_date = cleaned_data.get('end_date')
+    min_amount = cleaned_data.get('min_amount')
+    max_amount = cleaned_data.get('max_amount')
+
+    if start_date:
+        money_qs = money_qs.filter(date__gte=start_date)
+        sold_qs = sold_qs.filter(date__gte=start_date)
+    if end_date:
+        money_qs = money_qs.filter(date__lte=end_date)
+        sold_qs = sold_qs.filter(date__lte=end_date)
+    # For Money the range applies to 'amount', for Sold to 'total'.
+    if min_amount:
+        money_qs = money_qs.filter(amount__gte=min_amount)
+        sold_qs = sold_qs.filter(total__gte=min_amount)
+    if max_amount:
+        money_qs = money_qs.filter(amount__lte=max_amount)
+        sold_qs = sold_qs.filter(total__lte=max_amount)
+    return money_qs, sold_qs
+
+
+def segmented_querysets(cleaned_data):
+    """
+    ``filtered_querysets`` as ([money...], [sold...]): the archived rows
+    first when the date range reaches into the archive, then the live ones.
+    """
+    money_qs, sold_qs = filtered_querysets(cleaned_data)
+    if not archive.needed(cleaned_data):
+        return [money_qs], [sold_qs]
+    old_money, old_sold = filtered_querysets(cleaned_data, archived=True)
+    return [old_money, money_qs], [old_sold, sold_qs]
+
+
+def _segments(querysets):
+    return querysets if isinstance(querysets, (list, tuple)) else [querysets]
+
+
+def daily_rows(money_qs, sold_qs):
+    """
+    Return [(date, received, sold), ...] per date, merged in SQL.
+
+    Both filtered querysets (or lists of them, see ``segmented_querysets``)
+    are projected to (date, received, sold) and combined with UNION ALL,
+    then grouped once by date.
+    """
+    zero = Value(0, output_field=DecimalField())
+    parts = [queryset.order_by().annotate(received=F('amount'), sold=zero).values_list('date', 'received', 'sold')
+             for queryset in _segments(money_qs)]
+    parts += [queryset.order_by().annotate(received=zero, sold=F('total')).values_list('date', 'received', 'sold')
+              for queryset in _segments(sold_qs)]
+    sql, params = parts[0].union(*parts[1:], all=True).query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT u.date, SUM(u.received), SUM(u.sold) FROM ({sql}) u GROUP BY u.date ORDER BY u.date',
+            params,
+        )
+        rows = cursor.fetchall()
+    # SQLite hands back the UNION's dates as text.
+    return [(datetime.date.fromisoformat(date) if isinstance(date, str) else date, received, sold)
+            for date, received, sold in rows]
+
+
+def daily_series(money_qs, sold_qs):
+    """Return (labels, received, sold) per date for the filtered querysets."""
+    return _format_series(daily_rows(money_qs, sold_qs))
+
+
+def _bucket_start(date, period):
+    if period == rollup.WEEK:
+        return date - datetime.timedelta(days=date.weekday())
+    return date.replace(day=1)
+
+
+def _bucket(rows, period):
+    # Same buckets as rollup.series: ISO weeks starting Monday, calendar months.
+    buckets = {}
+    for date, received, sold in rows:
+        start = _bucket_start(date, period)
+        total_received, total_sold = buckets.get(start, (0, 0))
+        buckets[start] = (total_received + (received or 0), total_sold + (sold or 0))
+    return [(start, received, sold) for start, (received, sold) in sorted(buckets.items())]
+
+
+def choose_period(start_date, end_date):
+    """Finest of day/week/month that keeps the chart within SALES_CHART_MAX_POINTS."""
+    if start_date is None or end_date is None:
+        extent = DailySummary.objects.aggregate(first=Min('date'), last=Max('date'))
+        start_date = start_date or extent['first']
+        end_date = end_date or extent['last']
+        if start_date is None or end_date is None:
+            return rollup.DAY
+    days = (end_date - start_date).days + 1
+    limit = settings.SALES_CHART_MAX_POINTS
+    if days <= limit:
+        return rollup.DAY
+    if days / 7 <= limit:
+        return rollup.WEEK
+    return rollup.MONTH
+
+
+def chart_series(cleaned_data, period=None, version=None):
+    """
+    Return (period, labels, received, sold) for the dashboard chart.
+
+    ``period`` is one of rollup.DAY/WEEK/MONTH; by default it is chosen from
+    the filtered date range. ``version`` is the data version, if the caller
+    has already looked it up.
+    """
+    start_date = cleaned_data.get('start_date')
+    end_date = cleaned_data.get('end_date')
+    period = period or choose_period(start_date, end_date)
+    if not _rollup_applies(cleaned_data):
+        if snapshot.enabled():
+            rows = snapshot.current(version).daily_rows(cleaned_data)
+        else:
+            rows = daily_rows(*segmented_querysets(cleaned_data))
+        if period != rollup.DAY:
+            rows = _bucket(rows, period)
+    else:
+        rows = rollup.series(start_date, end_date, period)
+    return (period,) + _format_series(rows)
+
+
+def _format_series(rows):
+    labels, chart_received, chart_sold = [], [], []
+    for date, day_received, day_sold in rows:
+        labels.append(date.strftime('%Y-%m-%d') if isinstance(date, datetime.date) else str(date))
+        chart_received.append(float(day_received or 0))
+        chart_sold.append(float(day_sold or 0))
+    return labels, chart_received, chart_sold
+
+
+def _due_filters(cutoff_date, show_closed):
+    # (rows the due list shows, open rows that count towards Net Due)
+    due = Q(date__lte=cutoff_date)
+    open_due = due & Q(is_closed=False)
+    return (due if show_closed else open_due), open_due
+
+
+def _sold_sums(cutoff_date, show_closed):
+    sums = {'total_sold': Sum('total')}
+    if cutoff_date:
+        shown, open_due = _due_filters(cutoff_date, show_closed)
+        sums['filtered_total'] = Sum('total', filter=shown)
+        # Net Due always uses the open items, whatever the list shows.
+        sums['outstanding_items_total'] = Sum('total', filter=open_due)
+    return sums
+
+
+def _add_up(parts):
+    # One aggregate dict per segment -> their sums.
+    totals = {}
+    for part in parts:
+        for key, value in part.items():
+            totals[key] = totals.get(key, 0) + (value or 0)
+    return totals
+
+
+def _totals_from_rows(money_parts, sold_parts, cutoff_date, show_closed):
+    sums = _sold_sums(cutoff_date, show_closed)
+    totals = _add_up(sold_qs.aggregate(**sums) for sold_qs in sold_parts)
+    totals.update(_add_up(money_qs.aggregate(total_received=Sum('amount')) for money_qs in money_parts))
+    return totals
+
+
+async def _atotals_from_rows(money_parts, sold_parts, cutoff_date, show_closed):
+    sums = _sold_sums(cutoff_date, show_closed)
+    sold, received = await asyncio.gather(
+        asyncio.gather(*(sold_qs.aaggregate(**sums) for sold_qs in sold_parts)),
+        asyncio.gather(*(money_qs.aaggregate(total_received=Sum('amount')) for money_qs in money_parts)),
+    )
+    totals = _add_up(sold)
+    totals.update(_add_up(received))
+    return totals
+
+
+def _totals_from_snapshot(cleaned_data, cutoff_date, show_closed, version=None):
+    current = snapshot.current(version)
+    totals = {'total_sold': current.sums(ledger.ITEM, cleaned_data)[0],
+              'total_received': current.sums(ledger.MONEY, cleaned_data)[0]}
+    if cutoff_date:
+        due, due_open = current.sums(ledger.ITEM, cleaned_data, until=cutoff_date)
+        totals['filtered_total'] = due if show_closed else due_open
+        totals['outstanding_items_total'] = due_open
+    return totals
+
+
+def _totals_from_rollup(start_date, end_date, cutoff_date, show_closed):
+    sums = rollup.totals(start_date, end_date, due_before=cutoff_date)
+    totals = {'total_received': sums['total_received'], 'total_sold': sums['total_sold']}
+    if cutoff_date:
+        totals['filtered_total'] = sums['due_sold'] if show_closed else sums['due_open']
+        totals['outstanding_items_total'] = sums['due_open']
+    return totals
+
+
+def row_filtered(cleaned_data):
+    """
+    Whether the filters include an amount or party, which apply to
+    individual rows rather than the indexed date range.
+    """
+    return bool(cleaned_data.get('min_amount') or cleaned_data.get('max_amount') or cleaned_data.get('party'))
+
+
+def _rollup_applies(cleaned_data):
+    # Date-only filters can be answered from the daily rollups, which span
+    # every ledger.
+    return not row_filtered(cleaned_data)
+
+
+def _options(cleaned_data):
+    due_days = cleaned_data.get('due_days')
+    cutoff_date = None
+    if due_days:
+        cutoff_date = datetime.date.today() - datetime.timedelta(days=due_days)
+    return cutoff_date, cleaned_data.get('show_closed'), _rollup_applies(cleaned_data)
+
+
+def unused_money(party=None):
+    """
+    Money received but not used up by closed items, for ``party``'s ledger
+    or, with no party, summed over every ledger.
+    """
+    states = SettlementState.objects.all()
+    if party:
+        states = states.filter(party=party)
+    sums = states.aggregate(received=Sum('total_received'), closed=Sum('closed_items_value'))
+    return (sums['received'] or 0) - (sums['closed'] or 0)
+
+
+def _assemble(totals, unused, cutoff_date, due_items):
+    summary = {
+        'total_received': totals['total_received'],
+        'total_sold': totals['total_sold'],
+        'balance': totals['total_sold'] - totals['total_received'],
+        'filtered_items': None,
+        'filtered_total': 0,
+        'filtered_balance': 0,
+        'unused_money': 0,
+    }
+
+    if cutoff_date:
+        # Unused Money = Money Received - Value of Closed Items (per ledger);
+        # this is the advance available to pay off the open items.
+        summary.update({
+            'filtered_items': due_items,
+            'filtered_total': totals['filtered_total'],
+            'filtered_balance': totals['outstanding_items_total'] - unused,
+            'unused_money': unused,
+        })
+    return summary
+
+
+def _due_segments(cleaned_data, sold_parts, show_closed):
+    # Archived items are closed, so only a list that shows closed items
+    # needs them. The rollup path has no row querysets yet.
+    if sold_parts is None:
+        if not show_closed:
+            return [filtered_querysets(cleaned_data)[1]]
+        return segmented_querysets(cleaned_data)[1]
+    return sold_parts if show_closed else sold_parts[-1:]
+
+
+def build_summary(cleaned_data, version=None):
+    """
+    Compute the dashboard cards and the due-items block. ``version`` is the
+    data version, if the caller has already looked it up.
+    """
+    cutoff_date, show_closed, use_rollup = _options(cleaned_data)
+    sold_parts = None
+
+    if use_rollup:
+        totals = _totals_from_rollup(cleaned_data.get('start_date'), cleaned_data.get('end_date'),
+                                     cutoff_date, show_closed)
+    elif snapshot.enabled():
+        totals = _totals_from_snapshot(cleaned_data, cutoff_date, show_closed, version)
+    else:
+        money_parts, sold_parts = segmented_querysets(cleaned_data)
+        totals = _totals_from_rows(money_parts, sold_parts, cutoff_date, show_closed)
+
+    due_items = None
+    unused = 0
+    if cutoff_date:
+        shown, _ = _due_filters(cutoff_date, show_closed)
+        due_items = []
+        for sold_qs in _due_segments(cleaned_data, sold_parts, show_closed):
+            due_items.extend(sold_qs.filter(shown).order_by('date'))
+        unused = unused_money(cleaned_data.get('party'))
+    return _assemble(totals, unused, cutoff_date, due_items)
+
+
+async def abuild_summary(cleaned_data, version=None):
+    """
+    Async ``build_summary``: the totals, the due-items list and the unused
+    money are independent, so they are awaited together.
+    """
+    cutoff_date, show_closed, use_rollup = _options(cleaned_data)
+    sold_parts = None
+
+    if use_rollup:
+        totals = sync_to_async(_totals_from_rollup)(cleaned_data.get('start_date'), cleaned_data.get('end_date'),
+                                                    cutoff_date, show_closed)
+    elif snapshot.enabled():
+        totals = sync_to_async(_totals_from_snapshot)(cleaned_data, cutoff_date, show_closed, version)
+    else:
+        money_parts, sold_parts = await sync_to_async(segmented_querysets)(cleaned_data)
+        totals = _atotals_from_rows(money_parts, sold_parts, cutoff_date, show_closed)
+
+    async def due_items():
+        if not cutoff_date:
+            return None
+        shown, _ = _due_filters(cutoff_date, show_closed)
+        segments = await sync_to_async(_due_segments)(cleaned_data, sold_parts, show_closed)
+        return [item for sold_qs in segments async for item in sold_qs.filter(shown).order_by('date')]
+
+    async def unused():
+        if not cutoff_date:
+            return 0
+        return await sync_to_async(unused_money)(cleaned_data.get('party'))
+
+    totals, items, unused = await asyncio.gather(totals, due_items(), unused())
+    return _assemble(totals, unused, cutoff_date, items)
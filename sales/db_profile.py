@@ -0,0 +1,56 @@
+"""
+SQLite performance profile.
+
+Applied to every new SQLite connection from the ``connection_created``
+signal (see ``sales.signals``). The PRAGMAs come from SALES_SQLITE_PRAGMAS;
+the defaults put the database in WAL mode so readers no longer block behind
+the settlement writes, relax fsyncs to ``synchronous=NORMAL`` (safe with
+WAL), and enlarge the page cache and memory map.
+
+WAL keeps recent commits in ``<db>-wal`` until a checkpoint copies them
+into the main file, so file-level operations have to account for it:
+backups checkpoint first, and a restore removes the old database's WAL
+and shared-memory files along with the file itself (``sidecar_paths``).
+"""
+import logging
+import os
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WAL_SUFFIXES = ('-wal', '-shm')
+
+
+def apply_profile(connection):
+    """Run the configured PRAGMAs on a Django SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SALES_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def checkpoint(conn, mode='PASSIVE'):
+    """
+    Copy WAL frames into the main database file on a raw sqlite3 connection.
+
+    PASSIVE never waits for readers or writers, so it is safe to call on a
+    live database; returns (busy, wal_frames, checkpointed_frames).
+    """
+    return conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+
+def sidecar_paths(path):
+    return [str(path) + suffix for suffix in WAL_SUFFIXES]
+
+
+def remove_sidecars(path):
+    """Delete ``path``'s -wal/-shm files (only valid once ``path`` has been replaced)."""
+    for sidecar in sidecar_paths(path):
+        try:
+            os.remove(sidecar)
+        except FileNotFoundError:
+            pass
+        else:
+            logger.info('Removed stale %s', sidecar)
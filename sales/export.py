@@ -0,0 +1,110 @@
+"""
+Streaming CSV/XLSX export of the filtered ledgers.
+
+CSV is generated row by row from ``values_list().iterator()`` and handed
+to a StreamingHttpResponse, so memory stays flat and the download starts
+with the first chunk. XLSX needs the optional ``openpyxl`` package; it is
+written in write-only mode (rows are not kept in memory) to a temporary
+file, which is then streamed back. The zip container cannot be emitted
+before it is complete, so an XLSX download starts once the file is built.
+
+Like the list pages, an export whose date range reaches back past the
+archive cutoff also streams the archived rows (see ``sales.archive``).
+"""
+import csv
+import datetime
+import itertools
+import tempfile
+
+from django.http import FileResponse, Http404, StreamingHttpResponse
+
+from . import dashboard, ledger, scheduler
+
+try:
+    import openpyxl
+except ImportError:  # optional dependency
+    openpyxl = None
+
+CSV = 'csv'
+XLSX = 'xlsx'
+
+CHUNK_SIZE = 2000
+
+# kind -> (file name, [(field, header), ...])
+COLUMNS = {
+    ledger.ITEM: ('items_sold', [('date', 'Date'), ('weight', 'Weight (kg)'), ('price', 'Price (per unit)'),
+                                 ('total', 'Total (Rupees)'), ('is_closed', 'Closed')]),
+    ledger.MONEY: ('money_received', [('date', 'Date'), ('amount', 'Money Received'), ('is_settled', 'Settled')]),
+}
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def due_before(cleaned_data):
+    """Latest date the due_days filter lets through (None without one)."""
+    due_days = cleaned_data.get('due_days')
+    return datetime.date.today() - datetime.timedelta(days=due_days) if due_days else None
+
+
+def filtered(kind, cleaned_data):
+    """
+    The rows the matching list page shows for these FilterForm values, as
+    a list of querysets, archived rows first (see ``segmented_querysets``).
+    """
+    money_parts, sold_parts = dashboard.segmented_querysets(cleaned_data)
+    if kind == ledger.MONEY:
+        return money_parts
+    due = due_before(cleaned_data)
+    if due:
+        sold_parts = [sold_qs.filter(date__lte=due) for sold_qs in sold_parts]
+    return sold_parts
+
+
+def _rows(segments, fields):
+    return itertools.chain.from_iterable(
+        queryset.order_by('date', 'id').values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+        for queryset in segments
+    )
+
+
+def csv_lines(segments, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for _, header in columns])
+    for row in _rows(segments, [name for name, _ in columns]):
+        yield writer.writerow(row)
+
+
+def write_xlsx(segments, columns, dest, title):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append([header for _, header in columns])
+    for row in _rows(segments, [name for name, _ in columns]):
+        sheet.append(row)
+    workbook.save(dest)
+
+
+def response(kind, cleaned_data, fmt=CSV):
+    name, columns = COLUMNS[kind]
+    # The closed/settled columns must not lag behind deferred writes.
+    scheduler.flush()
+    segments = filtered(kind, cleaned_data)
+    filename = f"{name}_{datetime.date.today():%Y-%m-%d}.{fmt}"
+
+    if fmt == XLSX:
+        if openpyxl is None:
+            raise Http404('XLSX export needs the openpyxl package')
+        # Deleted as soon as FileResponse closes it.
+        output = tempfile.TemporaryFile()
+        write_xlsx(segments, columns, output, name)
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename=filename,
+                            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    streaming = StreamingHttpResponse(csv_lines(segments, columns), content_type='text/csv')
+    streaming['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return streaming
@@ -1,29 +1,55 @@
 from django import forms
-from .models import MoneyReceived, ItemSold
+from . import archive
+from .models import MoneyReceived, ItemSold, Party
 
-class MoneyReceivedForm(forms.ModelForm):
+_UNKNOWN = object()
+
+class LiveDateMixin:
+    # Dates before the archive cutoff belong to archived, fully settled
+    # history (see sales.archive). The importer looks the cutoff up once and
+    # passes it in instead of each row's form querying it.
+    def __init__(self, *args, archive_cutoff=_UNKNOWN, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.archive_cutoff = archive_cutoff
+
+    def clean_date(self):
+        date = self.cleaned_data['date']
+        cutoff = archive.cutoff() if self.archive_cutoff is _UNKNOWN else self.archive_cutoff
+        if cutoff is not None and date < cutoff:
+            raise forms.ValidationError(f"Entries before {cutoff:%Y-%m-%d} are archived and can no longer change.")
+        return date
+
+class MoneyReceivedForm(LiveDateMixin, forms.ModelForm):
     class Meta:
         model = MoneyReceived
-        fields = ['date', 'amount']
+        fields = ['party', 'date', 'amount']
         widgets = {
+            'party': forms.Select(attrs={'class': 'form-select'}),
             'date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001'}),
         }
 
-class ItemSoldForm(forms.ModelForm):
+class ItemSoldForm(LiveDateMixin, forms.ModelForm):
     class Meta:
         model = ItemSold
-        fields = ['date', 'weight', 'price']
+        fields = ['party', 'date', 'weight', 'price']
         widgets = {
+            'party': forms.Select(attrs={'class': 'form-select'}),
             'date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'weight': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001'}),
             'price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
         }
 
 class FilterForm(forms.Form):
+    party = forms.ModelChoiceField(queryset=Party.objects.all(), required=False, empty_label="All ledgers", widget=forms.Select(attrs={'class': 'form-select'}))
     start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control', 'placeholder': 'Start Date'}))
     end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control', 'placeholder': 'End Date'}))
     min_amount = forms.DecimalField(required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Min Amount'}))
     max_amount = forms.DecimalField(required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Max Amount'}))
     due_days = forms.IntegerField(required=False, initial=15, label="Due Days (> X Days)", widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Days'}))
     show_closed = forms.BooleanField(required=False, initial=False, label="Show Closed/Settled", widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label="CSV or JSONL file", widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl,.ndjson'}))
+    kind = forms.ChoiceField(required=False, choices=[('', 'Per row ("kind" column)'), ('item', 'Item Sold'), ('money', 'Money Received')], widget=forms.Select(attrs={'class': 'form-select'}))
+    skip_invalid = forms.BooleanField(required=False, initial=False, label="Skip invalid rows", widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
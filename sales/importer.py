@@ -0,0 +1,168 @@
+"""
+Bulk import of historical sales and receipts.
+
+Rows are read lazily from CSV (with a header row) or JSONL, one record per
+line, and each carries a ``kind`` of ``item`` or ``money`` (or one is given
+for the whole file). Every row goes through ItemSoldForm/MoneyReceivedForm
+so the rules match the entry forms, and valid rows are inserted with
+``bulk_create`` in batches inside a single transaction. An optional
+``party`` column holds the id of the party whose ledger a row belongs to.
+
+``bulk_create`` skips ``save()`` and the post_save handlers, so totals are
+computed per batch here and the derived data (ledger, rollups, settlement
+flags, data version) is brought up to date once at the end instead of once
+per row. Each touched ledger is rewritten from its earliest imported date
+on, so an import of recent rows costs about as much as the rows themselves.
+"""
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import archive, ledger, rollup, settlement
+from .forms import ItemSoldForm, MoneyReceivedForm
+from .models import ItemSold, MoneyReceived
+
+CSV = 'csv'
+JSONL = 'jsonl'
+
+BATCH_SIZE = 2000
+
+# kind -> (form, model, settlement ledger)
+KINDS = {
+    ledger.ITEM: (ItemSoldForm, ItemSold, settlement.ITEMS),
+    ledger.MONEY: (MoneyReceivedForm, MoneyReceived, settlement.MONEY),
+}
+
+
+class ImportFailed(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid row(s); first: {errors[0]}")
+
+
+@dataclass
+class ImportStats:
+    items: int = 0
+    money: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows(self):
+        return self.items + self.money
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.items} items, {self.money} receipts, {self.skipped} skipped "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)")
+
+
+def detect_format(filename):
+    return JSONL if filename.lower().endswith(('.jsonl', '.ndjson')) else CSV
+
+
+def read_rows(stream, fmt=CSV):
+    """Yield (line_number, dict) from a text stream without loading it all."""
+    if fmt == JSONL:
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, {'_error': f"invalid JSON: {e}"}
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def open_upload(upload):
+    """Text stream over an uploaded file (BOM-tolerant UTF-8)."""
+    return io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+
+
+def _validate(number, row, default_kind, archive_cutoff):
+    if '_error' in row:
+        return None, None, f"line {number}: {row['_error']}"
+    kind = (row.get('kind') or default_kind or '').strip().lower()
+    if kind not in KINDS:
+        return None, None, f"line {number}: unknown kind {kind!r}"
+    form = KINDS[kind][0](data=row, archive_cutoff=archive_cutoff)
+    if not form.is_valid():
+        problems = '; '.join(f"{name}: {' '.join(messages)}" for name, messages in form.errors.items())
+        return None, None, f"line {number}: {problems}"
+    return kind, form.save(commit=False), None
+
+
+def _flush(kind, batch, batch_size):
+    model = KINDS[kind][1]
+    if model is ItemSold:
+        # ItemSold.save() is bypassed; compute the totals for the whole batch.
+        for item in batch:
+            item.total = item.compute_total()
+    model.objects.bulk_create(batch, batch_size=batch_size)
+
+
+@transaction.atomic
+def import_rows(rows, kind=None, batch_size=BATCH_SIZE, skip_invalid=False):
+    """
+    Insert ``rows`` (as yielded by ``read_rows``) and re-derive the ledger,
+    rollups and settlement once. Raises ImportFailed, with nothing written,
+    if a row is invalid and ``skip_invalid`` is False.
+    """
+    started = time.perf_counter()
+    stats = ImportStats()
+    batches = {name: [] for name in KINDS}
+    # (kind, party_id) -> earliest imported date
+    first_date = {}
+    last_date = None
+    # Rows may not land in archived history (see LiveDateMixin).
+    archive_cutoff = archive.cutoff()
+
+    for number, row in rows:
+        row_kind, instance, error = _validate(number, row, kind, archive_cutoff)
+        if error:
+            if not skip_invalid:
+                raise ImportFailed([error])
+            stats.skipped += 1
+            stats.errors.append(error)
+            continue
+        batch = batches[row_kind]
+        batch.append(instance)
+        touched = (row_kind, instance.party_id)
+        if touched not in first_date or instance.date < first_date[touched]:
+            first_date[touched] = instance.date
+        if last_date is None or instance.date > last_date:
+            last_date = instance.date
+        if len(batch) >= batch_size:
+            _flush(row_kind, batch, batch_size)
+            batches[row_kind] = []
+        if row_kind == ledger.ITEM:
+            stats.items += 1
+        else:
+            stats.money += 1
+
+    for row_kind, batch in batches.items():
+        if batch:
+            _flush(row_kind, batch, batch_size)
+
+    # One pass over the derived data for the whole import; each touched
+    # ledger is rewritten only from its earliest imported date.
+    for (row_kind, party_id), date in first_date.items():
+        ledger.rebuild_from(row_kind, date, party_id)
+        settlement.mark_dirty(KINDS[row_kind][2], date, party_id)
+    if first_date:
+        settlement.settle_dirty()
+        rollup.refresh_range(min(first_date.values()), last_date)
+
+    stats.seconds = time.perf_counter() - started
+    return stats
@@ -0,0 +1,159 @@
+"""
+Background PDF report jobs.
+
+Renders run on a small in-process thread pool, so a request only enqueues
+work. A job's id is the content address of its output: a hash of the data
+version and the report parameters. An unchanged dataset therefore maps to
+the same id, and an already rendered file is served without re-rendering.
+Because the id is derived from the data, any worker process can answer a
+status request for a finished job by looking for its file.
+
+The ``engine`` parameter picks the renderer: ``html`` (the xhtml2pdf
+template, ``sales.reports``) or ``native`` (drawn on a reportlab canvas,
+``sales.pdf_canvas``). Without reportlab the HTML engine is used.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import metrics, pdf_canvas, reports, settlement
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Bump when the report layout changes so old cached files are not reused.
+REPORT_FORMAT = 1
+
+HTML = 'html'
+NATIVE = 'native'
+# engine -> module providing write_pdf(dest)
+ENGINES = {
+    HTML: reports,
+    NATIVE: pdf_canvas,
+}
+
+_jobs = {}
+_lock = threading.Lock()
+_pool = None
+
+
+class ReportJob:
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.status = QUEUED
+        self.error = ''
+        self.created = time.time()
+
+    @property
+    def path(self):
+        return report_path(self.id)
+
+
+def report_key(params, version, date=None):
+    # The report prints the day it was made, so a new day is a new report
+    # even when the data has not changed.
+    date = (date or datetime.date.today()).isoformat()
+    payload = json.dumps({'format': REPORT_FORMAT, 'version': version, 'date': date, 'params': params},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def report_path(job_id):
+    return os.path.join(settings.SALES_REPORT_DIR, f'report_{job_id}.pdf')
+
+
+def _executor():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.SALES_REPORT_WORKERS,
+                                       thread_name_prefix='sales-report')
+        return _pool
+
+
+def _run(job):
+    job.status = RUNNING
+    partial = f'{job.path}.{threading.get_ident()}.part'
+    try:
+        close_old_connections()
+        os.makedirs(settings.SALES_REPORT_DIR, exist_ok=True)
+        # One (deferred, read-only) transaction so the whole report reads a
+        # single snapshot; it never takes the write lock, so entries can
+        # still be saved while a long report renders.
+        with transaction.atomic(), open(partial, 'wb') as output, metrics.timer('pdf_render'):
+            ENGINES[job.params['engine']].write_pdf(output)
+        os.replace(partial, job.path)
+        job.status = DONE
+        prune()
+    except Exception as e:
+        job.status = FAILED
+        job.error = e.html if isinstance(e, reports.ReportError) else str(e)
+        if os.path.exists(partial):
+            os.remove(partial)
+    finally:
+        connection.close()
+
+
+def engine_for(requested=None):
+    """The engine to use for ``requested``, falling back to SALES_REPORT_ENGINE and then HTML."""
+    engine = requested if requested in ENGINES else settings.SALES_REPORT_ENGINE
+    if engine == NATIVE and not pdf_canvas.available():
+        return HTML
+    return engine if engine in ENGINES else HTML
+
+
+def submit(params=None):
+    """Return the job for ``params`` at the current data version, enqueuing it if needed."""
+    params = dict(params or {})
+    params['engine'] = engine_for(params.get('engine'))
+    job_id = report_key(params, settlement.data_version())
+
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None and job.status in (QUEUED, RUNNING, DONE):
+            return job
+        job = ReportJob(job_id, params)
+        if os.path.exists(job.path):
+            job.status = DONE
+            _jobs[job_id] = job
+            return job
+        _jobs[job_id] = job
+
+    _executor().submit(_run, job)
+    return job
+
+
+def get(job_id):
+    """Look up a job by id, falling back to the rendered file on disk."""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None and os.path.exists(report_path(job_id)):
+        job = ReportJob(job_id, {})
+        job.status = DONE
+    return job
+
+
+def prune():
+    """Keep only the newest SALES_REPORT_CACHE_SIZE rendered reports."""
+    directory = settings.SALES_REPORT_DIR
+    files = [os.path.join(directory, f) for f in os.listdir(directory)
+             if f.startswith('report_') and f.endswith('.pdf')]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[settings.SALES_REPORT_CACHE_SIZE:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    with _lock:
+        for job_id in [j for j, job in _jobs.items() if job.status == DONE and not os.path.exists(job.path)]:
+            del _jobs[job_id]
@@ -0,0 +1,188 @@
+"""
+Running-balance ledger for the FIFO settlement.
+
+Every ItemSold and MoneyReceived row has a LedgerEntry holding its value and
+the cumulative value of its ledger up to that row in (date, id) order. Each
+party has its own running totals (``party_id`` None is the general ledger).
+Since values are never negative the cumulative column is non-decreasing, so
+"the last row whose running total fits inside X" is a single index seek on
+(kind, party, cumulative) instead of a scan.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from .models import ItemSold, LedgerEntry, MoneyReceived, SettlementState
+
+ITEM = LedgerEntry.ITEM
+MONEY = LedgerEntry.MONEY
+
+SOURCES = {
+    ITEM: (ItemSold, 'total'),
+    MONEY: (MoneyReceived, 'amount'),
+}
+
+SCALE = 1000
+BATCH_SIZE = 2000
+
+
+def to_units(value):
+    """Decimal rupees -> integer thousandths."""
+    return int((Decimal(value) * SCALE).to_integral_value())
+
+
+def from_units(units):
+    return Decimal(units) / SCALE
+
+
+def _after(date, source_id):
+    return Q(date__gt=date) | Q(date=date, source_id__gt=source_id)
+
+
+def _before(date, source_id):
+    return Q(date__lt=date) | Q(date=date, source_id__lt=source_id)
+
+
+def _shift(kind, party_id, condition, delta):
+    if delta:
+        (LedgerEntry.objects.filter(condition, kind=kind, party_id=party_id)
+         .update(cumulative=F('cumulative') + delta))
+
+
+def total(kind, party_id=None):
+    """Cumulative value of the whole ledger, in units."""
+    last = (LedgerEntry.objects.filter(kind=kind, party_id=party_id)
+            .order_by('-date', '-source_id').values_list('cumulative', flat=True).first())
+    return last or 0
+
+
+def boundary(kind, limit, party_id=None):
+    """
+    Return ((date, source_id), cumulative) of the last entry whose running
+    total is within ``limit`` units, or (None, 0) if even the first is not.
+    """
+    entry = (LedgerEntry.objects
+             .filter(kind=kind, party_id=party_id, cumulative__lte=limit)
+             .order_by('-cumulative', '-date', '-source_id')
+             .values_list('date', 'source_id', 'cumulative')
+             .first())
+    if entry is None:
+        return None, 0
+    return (entry[0], entry[1]), entry[2]
+
+
+@transaction.atomic
+def record(kind, source_id, date, value, party_id=None):
+    """Insert or update the entry for a source row and shift later totals."""
+    amount = to_units(value)
+    entry = LedgerEntry.objects.filter(kind=kind, source_id=source_id).first()
+
+    if entry is not None and entry.date == date and entry.party_id == party_id:
+        delta = amount - entry.amount
+        _shift(kind, party_id, Q(date=date, source_id__gte=source_id) | Q(date__gt=date), delta)
+        if delta:
+            LedgerEntry.objects.filter(pk=entry.pk).update(amount=amount)
+        return
+
+    if entry is not None:
+        remove(kind, source_id)
+
+    previous = (LedgerEntry.objects
+                .filter(_before(date, source_id), kind=kind, party_id=party_id)
+                .order_by('-date', '-source_id')
+                .values_list('cumulative', flat=True)
+                .first())
+    _shift(kind, party_id, _after(date, source_id), amount)
+    LedgerEntry.objects.create(
+        kind=kind, party_id=party_id, source_id=source_id, date=date,
+        amount=amount, cumulative=(previous or 0) + amount,
+    )
+
+
+@transaction.atomic
+def remove(kind, source_id):
+    entry = LedgerEntry.objects.filter(kind=kind, source_id=source_id).first()
+    if entry is None:
+        return
+    _shift(kind, entry.party_id, _after(entry.date, entry.source_id), -entry.amount)
+    entry.delete()
+
+
+@transaction.atomic
+def drop_before(date):
+    """
+    Remove the entries dated before ``date`` (rows that were archived) and
+    shift the rest down, so each ledger's running totals start from zero at
+    its first live row. Returns the number of entries removed.
+    """
+    dropped = LedgerEntry.objects.filter(date__lt=date)
+    for row in dropped.values('kind', 'party_id').annotate(amount=Sum('amount')).order_by():
+        _shift(row['kind'], row['party_id'], Q(date__gte=date), -row['amount'])
+    return dropped.delete()[0]
+
+
+def _write(kind, queryset, start=0):
+    # Entries for the source rows of ``queryset``, in (party, date, id) order;
+    # each party's running total starts from ``start``.
+    model, field = SOURCES[kind]
+    written = 0
+    party = cumulative = None
+    batch = []
+    rows = queryset.order_by('party_id', 'date', 'id').values_list('party_id', 'id', 'date', field)
+    for party_id, source_id, date, value in rows.iterator(chunk_size=BATCH_SIZE):
+        if party_id != party or cumulative is None:
+            party, cumulative = party_id, start
+        amount = to_units(value)
+        cumulative += amount
+        batch.append(LedgerEntry(kind=kind, party_id=party_id, source_id=source_id, date=date,
+                                 amount=amount, cumulative=cumulative))
+        if len(batch) >= BATCH_SIZE:
+            LedgerEntry.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    LedgerEntry.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+@transaction.atomic
+def rebuild(kind=None):
+    """Recompute the ledger from the source tables. Returns rows written."""
+    written = 0
+    for name in ([kind] if kind else SOURCES):
+        LedgerEntry.objects.filter(kind=name).delete()
+        written += _write(name, SOURCES[name][0].objects.all())
+    if kind is None:
+        SettlementState.objects.update(ledger_backfilled=True)
+    return written
+
+
+@transaction.atomic
+def rebuild_from(kind, date, party_id=None):
+    """
+    Recompute one party's entries dated ``date`` or later, continuing from
+    the running total before them (bulk inserts, e.g. imports). Returns
+    rows written.
+    """
+    LedgerEntry.objects.filter(kind=kind, party_id=party_id, date__gte=date).delete()
+    previous = (LedgerEntry.objects.filter(kind=kind, party_id=party_id, date__lt=date)
+                .order_by('-date', '-source_id').values_list('cumulative', flat=True).first())
+    model = SOURCES[kind][0]
+    return _write(kind, model.objects.filter(party_id=party_id, date__gte=date), previous or 0)
+
+
+def complete(party_id=None):
+    """Whether a party's ledger has exactly one entry per live source row."""
+    return all(LedgerEntry.objects.filter(kind=kind, party_id=party_id).count()
+               == model.objects.filter(party_id=party_id).count()
+               for kind, (model, field) in SOURCES.items())
+
+
+@transaction.atomic
+def backfill(party_id=None):
+    """Recompute one party's ledger from the source tables. Returns rows written."""
+    written = 0
+    for kind, (model, field) in SOURCES.items():
+        LedgerEntry.objects.filter(kind=kind, party_id=party_id).delete()
+        written += _write(kind, model.objects.filter(party_id=party_id))
+    return written
@@ -0,0 +1,121 @@
+"""
+Maintenance window coordination for database swaps.
+
+A restore creates ``<db>.maintenance`` next to the live database for the
+few milliseconds it takes to swap files. Every worker process checks for
+that flag in ``MaintenanceMiddleware`` and holds incoming requests until it
+disappears, instead of letting them hit a half-swapped database.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from . import backup, db_profile
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05
+
+
+class MaintenanceBusy(backup.BackupError):
+    pass
+
+
+def flag_path(live_path=None):
+    return str(live_path or backup.live_database_path()) + '.maintenance'
+
+
+def _is_stale(path):
+    try:
+        return time.time() - os.path.getmtime(path) > settings.SALES_MAINTENANCE_STALE_AFTER
+    except FileNotFoundError:
+        return False
+
+
+def active():
+    path = flag_path()
+    return os.path.exists(path) and not _is_stale(path)
+
+
+def wait_until_clear(timeout):
+    """Block up to ``timeout`` seconds for the flag to clear. True if clear."""
+    deadline = time.monotonic() + timeout
+    while active():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
+
+
+def database_identity():
+    """Changes whenever the live database file is replaced."""
+    try:
+        st = os.stat(backup.live_database_path())
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_ctime_ns
+
+
+@contextmanager
+def maintenance_window(live_path=None):
+    """Hold the maintenance flag for the duration of the block."""
+    path = flag_path(live_path)
+    if _is_stale(path):
+        # Left behind by a crashed restore.
+        os.remove(path)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise MaintenanceBusy('Another restore is already in progress')
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'{os.getpid()} {time.time()}\n')
+    try:
+        yield
+    finally:
+        os.remove(path)
+
+
+def atomic_restore(source_path, live_path=None):
+    """
+    Replace the live database with ``source_path`` without a window in
+    which it is half-written.
+
+    The backup is first copied (and quick-checked) into a temp file in the
+    live database's directory, which can take as long as it needs while the
+    site keeps serving. Only then is the maintenance flag raised, an
+    exclusive lock taken so no write transaction is in flight, the temp
+    file swapped in with ``os.replace`` and the old file's -wal/-shm files
+    deleted before anything reopens the database. On Windows the swap fails while
+    another process still has the file open; stop other workers first.
+    """
+    live_path = live_path or backup.live_database_path()
+    directory = os.path.dirname(os.path.abspath(live_path))
+    fd, staged = tempfile.mkstemp(dir=directory, prefix='.restore_', suffix='.sqlite3')
+    os.close(fd)
+    try:
+        stats = backup.online_backup(source_path, staged, pause=0)
+        started = time.perf_counter()
+        with maintenance_window(live_path):
+            connections.close_all()
+            lock = sqlite3.connect(live_path, timeout=settings.SALES_MAINTENANCE_WAIT)
+            try:
+                lock.execute('BEGIN EXCLUSIVE')
+                os.replace(staged, live_path)
+            finally:
+                lock.close()
+            # The old file's WAL would otherwise be replayed into the
+            # restored one by the next connection.
+            db_profile.remove_sidecars(live_path)
+        swap_seconds = time.perf_counter() - started
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
+
+    logger.info('Restored %s (%.1f ms swap)', stats, swap_seconds * 1000)
+    return stats, swap_seconds
@@ -0,0 +1,19 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from sales import archive
+
+
+class Command(BaseCommand):
+    help = ('Move closed and settled months out of ItemSold/MoneyReceived into the archive tables, '
+            'leaving per-month summaries behind.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=datetime.date.fromisoformat, default=None,
+                            help='Archive months before this date (YYYY-MM-DD); '
+                                 'defaults to SALES_ARCHIVE_KEEP_DAYS ago.')
+
+    def handle(self, *args, **options):
+        stats = archive.archive(options['before'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {stats}'))
@@ -0,0 +1,81 @@
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.runner import DiscoverRunner
+
+from sales import bench
+
+
+class Command(BaseCommand):
+    help = ('Benchmark settlement, dashboard, lists, PDF and backup/restore on synthetic ledgers. '
+            'Runs against a throwaway test database; the real database is never touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=['1k'], help='Ledger sizes, e.g. 1k 100k 1M.')
+        parser.add_argument('--steps', nargs='+', choices=bench.STEPS, default=list(bench.STEPS))
+        parser.add_argument('--skip', nargs='+', choices=bench.STEPS, default=[],
+                            help='Steps to leave out (e.g. pdf at 1M rows).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-memory', action='store_true',
+                            help='Skip the traced run that measures peak memory.')
+        parser.add_argument('--output', default=None,
+                            help='JSON file to write (default bench-results/<commit>-<timestamp>.json).')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [(label, bench.parse_size(label)) for label in options['sizes']]
+        except ValueError as e:
+            raise CommandError(f'Bad size: {e}')
+        steps = [step for step in options['steps'] if step not in options['skip']]
+
+        # Backup/restore need a real file, so the test database is put on disk.
+        work = tempfile.mkdtemp(prefix='sales-bench-db-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(work, 'bench.sqlite3')
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        results = {}
+        try:
+            for label, rows in sizes:
+                self.stdout.write(f'{label} ({rows} rows):')
+                results[label] = bench.run(rows, steps, options['seed'], not options['no_memory'],
+                                           log=self.stdout.write)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+            shutil.rmtree(work, ignore_errors=True)
+
+        commit = _git_commit()
+        report = {
+            'commit': commit,
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'seed': options['seed'],
+            'results': results,
+        }
+        output = options['output']
+        if output is None:
+            stamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+            output = os.path.join(settings.BASE_DIR, 'bench-results', f'{commit or "unknown"}-{stamp}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
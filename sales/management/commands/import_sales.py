@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales import importer
+
+
+class Command(BaseCommand):
+    help = 'Import historical ItemSold/MoneyReceived rows from CSV or JSONL in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSONL file.')
+        parser.add_argument('--format', choices=[importer.CSV, importer.JSONL], default=None,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--kind', choices=list(importer.KINDS), default=None,
+                            help='Kind for rows without a "kind" column.')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Skip invalid rows instead of aborting the whole import.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or importer.detect_format(options['path'])
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            try:
+                stats = importer.import_rows(importer.read_rows(stream, fmt), kind=options['kind'],
+                                             batch_size=options['batch_size'],
+                                             skip_invalid=options['skip_invalid'])
+            except importer.ImportFailed as e:
+                raise CommandError(f'Nothing imported: {e}')
+        for error in stats.errors[:20]:
+            self.stderr.write(f'Skipped {error}')
+        self.stdout.write(self.style.SUCCESS(f'Imported {stats}'))
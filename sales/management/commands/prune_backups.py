@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from sales import backup_store
+
+
+class Command(BaseCommand):
+    help = 'Delete old backup snapshots and any chunks no remaining snapshot uses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=24, help='Number of newest snapshots to keep.')
+        parser.add_argument('--keep-days', type=int, default=None,
+                            help='Also drop snapshots older than this many days.')
+
+    def handle(self, *args, **options):
+        removed, swept = backup_store.prune(options['keep'], options['keep_days'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} snapshots and {swept} unreferenced chunks'))
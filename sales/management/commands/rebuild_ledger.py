@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sales import ledger, settlement
+
+
+class Command(BaseCommand):
+    help = 'Backfill the running-balance ledger from ItemSold/MoneyReceived and re-settle.'
+
+    def handle(self, *args, **options):
+        written = ledger.rebuild()
+        flipped = settlement.settle_all(full=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ledger rebuilt: {written} entries, {flipped} flags updated'
+        ))
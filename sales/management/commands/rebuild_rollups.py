@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from sales import rollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the DailySummary rollups from ItemSold/MoneyReceived.'
+
+    def handle(self, *args, **options):
+        days = rollup.refresh_range()
+        self.stdout.write(self.style.SUCCESS(f'Rollups rebuilt: {days} days'))
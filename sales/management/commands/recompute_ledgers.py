@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from sales import settlement
+
+
+def _start_worker():
+    # Spawned workers import settings afresh; forked ones already have them
+    # and open their own connection on first use.
+    django.setup()
+
+
+def _settle(party_id, full):
+    return party_id, settlement.settle(full, party_id).rows_updated
+
+
+def _try_settle(party_id, full):
+    # A worker kept waiting past busy_timeout (another process holding the
+    # write lock) hands its ledger back instead of failing the pool.
+    try:
+        return _settle(party_id, full)
+    except OperationalError as error:
+        return party_id, str(error)
+
+
+class Command(BaseCommand):
+    help = ('Settle the ledgers with pending writes (or every ledger with --all), '
+            'one ledger per task across a process pool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Every ledger, not only the dirty ones.')
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute the boundaries from the source tables and re-check every flag.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 1 settles in this process.')
+
+    def handle(self, *args, **options):
+        party_ids = settlement.ledger_ids() if options['all'] else settlement.dirty_ledgers()
+        full = options['full']
+        workers = min(options['workers'], len(party_ids))
+        results = []
+        if workers <= 1:
+            results = [_settle(party_id, full) for party_id in party_ids]
+        else:
+            # Children must not share the parent's SQLite connection.
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as pool:
+                futures = [pool.submit(_try_settle, party_id, full) for party_id in party_ids]
+                results = [future.result() for future in as_completed(futures)]
+            # Retry the ledgers that were locked out, one at a time now that
+            # the pool is gone.
+            results = [result if isinstance(result[1], int) else _try_settle(result[0], full)
+                       for result in results]
+
+        failed = []
+        for party_id, rows in sorted(results, key=lambda result: (result[0] is not None, result[0] or 0)):
+            name = 'general' if party_id is None else f'party {party_id}'
+            if isinstance(rows, int):
+                self.stdout.write(f'  {name}: {rows} flags updated')
+            else:
+                failed.append(name)
+                self.stderr.write(f'  {name}: {rows}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Settled {len(results) - len(failed)} ledger(s) with {max(workers, 1)} worker(s)'
+        ))
+        if failed:
+            raise CommandError(f'Could not settle {", ".join(failed)}; run the command again')
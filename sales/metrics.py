@@ -0,0 +1,183 @@
+"""
+In-process performance metrics, exposed in Prometheus text format.
+
+``MetricsMiddleware`` (see ``sales.middleware``) times every request and
+counts its SQL through ``sql_wrapper``, installed on every connection when
+it opens: async views run their queries on worker threads whose
+connections the middleware never sees. Hot paths add their
+own sections with ``timer('name')``; the time is added to the section
+histogram and to the current request's breakdown, which is logged when the
+request is slower than SALES_SLOW_REQUEST_SECONDS. ``/metrics`` renders the
+registry.
+
+Metrics are kept per process; with several workers, scrape each one (or
+sum them in Prometheus).
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_registry = []
+
+# Breakdown of the request being served: {'sql_count', 'sql_seconds', 'sections'}.
+_current = contextvars.ContextVar('sales_metrics_request', default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', r'\\').replace('"', r'\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(labels.get(n, '') for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with _lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_label_text(self.labelnames, key)} {value}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with _lock:
+            self.values[key] = value
+
+    def value(self, **labels):
+        return self.values.get(tuple(labels.get(n, '') for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        with _lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_label_text(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with _lock:
+            series = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.values.get(tuple(labels.get(n, '') for n in self.labelnames))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with _lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, hits in zip(self.buckets + ('+Inf',), series[:-1]):
+                    cumulative += hits
+                    labels = _label_text(self.labelnames + ('le',), key + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _label_text(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {series[-1]:.6f}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('sales_request_seconds', 'Request latency by view.', ('view', 'method'))
+REQUEST_QUERIES = Histogram('sales_request_queries', 'SQL queries per request by view.', ('view',),
+                            buckets=COUNT_BUCKETS)
+SQL_QUERIES = Counter('sales_sql_queries_total', 'SQL queries executed, by view.', ('view',))
+SQL_SECONDS = Counter('sales_sql_seconds_total', 'Time spent in SQL, by view.', ('view',))
+SECTION_SECONDS = Histogram('sales_section_seconds', 'Time spent in instrumented sections.', ('section',))
+SETTLEMENT_ROWS = Counter('sales_settlement_rows_total', 'Rows whose closed/settled flag a settlement pass flipped.')
+SNAPSHOT_BYTES = Gauge('sales_ledger_snapshot_bytes', 'Memory held by the in-process ledger snapshot.')
+SNAPSHOT_ROWS = Gauge('sales_ledger_snapshot_rows', 'Rows in the in-process ledger snapshot, by kind.', ('kind',))
+SLOW_REQUESTS = Counter('sales_slow_requests_total', 'Requests slower than SALES_SLOW_REQUEST_SECONDS.', ('view',))
+
+
+def begin_request():
+    """Start collecting the breakdown for the current request."""
+    breakdown = {'sql_count': 0, 'sql_seconds': 0.0, 'sections': {}}
+    return breakdown, _current.set(breakdown)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """Execute wrapper adding each query to the current request's breakdown, if any."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        breakdown = _current.get()
+        if breakdown is not None:
+            breakdown['sql_count'] += 1
+            breakdown['sql_seconds'] += time.perf_counter() - started
+
+
+@contextmanager
+def timer(section):
+    """Time the block into ``sales_section_seconds{section=...}`` and the request breakdown."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SECTION_SECONDS.observe(elapsed, section=section)
+        breakdown = _current.get()
+        if breakdown is not None:
+            sections = breakdown['sections']
+            sections[section] = sections.get(section, 0.0) + elapsed
+
+
+def render():
+    """The whole registry in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        for metric in _registry:
+            metric.values.clear()
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import maintenance, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceMiddleware:
+    """
+    Hold requests while a restore swaps the database file, and drop this
+    thread's connections once the file has been replaced so the next query
+    opens the restored database rather than the old inode. Connections are
+    per thread (and persistent with CONN_MAX_AGE), so each thread tracks
+    the identity it last saw.
+
+    Works in both sync and async stacks; under ASGI the check runs on the
+    worker thread that the request's ORM calls use, since the wait blocks
+    and those are the connections to drop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.initial_identity = maintenance.database_identity()
+        self.seen = threading.local()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self._check() or self.get_response(request)
+
+    async def __acall__(self, request):
+        return await sync_to_async(self._check)() or await self.get_response(request)
+
+    def _check(self):
+        # A 503 response while a restore is still running, otherwise None.
+        if not maintenance.wait_until_clear(settings.SALES_MAINTENANCE_WAIT):
+            response = HttpResponse('Database maintenance in progress, please retry in a moment.', status=503)
+            response['Retry-After'] = '2'
+            return response
+
+        identity = maintenance.database_identity()
+        if identity != getattr(self.seen, 'identity', self.initial_identity):
+            connections.close_all()
+        self.seen.identity = identity
+        return None
+
+
+class MetricsMiddleware:
+    """
+    Record latency and SQL per view, and log a breakdown of slow requests.
+    Goes first in MIDDLEWARE so the timing covers the whole stack. Queries
+    are counted by the wrapper on every connection (see sales.metrics), so
+    the async stack needs nothing but an async path here.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        breakdown, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self._record(request, breakdown, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        breakdown, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self._record(request, breakdown, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, breakdown, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(elapsed, view=view, method=request.method)
+        metrics.REQUEST_QUERIES.observe(breakdown['sql_count'], view=view)
+        metrics.SQL_QUERIES.inc(breakdown['sql_count'], view=view)
+        metrics.SQL_SECONDS.inc(breakdown['sql_seconds'], view=view)
+
+        if elapsed >= settings.SALES_SLOW_REQUEST_SECONDS:
+            metrics.SLOW_REQUESTS.inc(view=view)
+            sections = ', '.join(f'{name} {seconds * 1000:.0f} ms'
+                                 for name, seconds in sorted(breakdown['sections'].items(), key=lambda s: -s[1]))
+            logger.warning('Slow request %s %s (%s): %.0f ms total; %d queries in %.0f ms%s',
+                           request.method, request.path, view, elapsed * 1000,
+                           breakdown['sql_count'], breakdown['sql_seconds'] * 1000,
+                           f'; {sections}' if sections else '')
@@ -1,24 +1,231 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Coalesce
+
+class Party(models.Model):
+    # A buyer with a ledger of their own. Rows without a party belong to the
+    # general ledger; each ledger is settled FIFO independently.
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = "parties"
+
+    def __str__(self):
+        return self.name
 
 class MoneyReceived(models.Model):
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.PROTECT, related_name='payments')
     date = models.DateField()
     amount = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Money Received")
 
     is_settled = models.BooleanField(default=False, verbose_name="Settled")
 
+    # Listings mix in ArchivedMoneyReceived rows (see sales.archive).
+    archived = False
+
+    class Meta:
+        indexes = [
+            # Date-range filters, the is_settled split and Sum(amount) are all
+            # answered from this index without touching the table.
+            models.Index(fields=['date', 'is_settled', 'amount'], name='money_date_settled_amt_idx'),
+            # The same, within one ledger.
+            models.Index(fields=['party', 'date', 'is_settled', 'amount'], name='money_party_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.date} - {self.amount}"
 
 class ItemSold(models.Model):
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.PROTECT, related_name='items')
     date = models.DateField()
     weight = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Weight (kg)")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Price (per unit)")
     total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Total (Rupees)", editable=False)
     is_closed = models.BooleanField(default=False, verbose_name="Closed")
 
+    # Listings mix in ArchivedItemSold rows (see sales.archive).
+    archived = False
+
+    class Meta:
+        indexes = [
+            # Date-range filters, the is_closed split and Sum(total) are all
+            # answered from this index without touching the table.
+            models.Index(fields=['date', 'is_closed', 'total'], name='item_date_closed_total_idx'),
+            # The same, within one ledger.
+            models.Index(fields=['party', 'date', 'is_closed', 'total'], name='item_party_date_idx'),
+        ]
+
+    def compute_total(self):
+        # Rounded to the column's precision: the ledger records this value,
+        # so it has to be the one that is actually stored.
+        return (Decimal(self.weight) * Decimal(self.price)).quantize(Decimal('0.01'))
+
     def save(self, *args, **kwargs):
-        self.total = self.weight * self.price
+        self.total = self.compute_total()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.date} - {self.total}"
+
+class SettlementState(models.Model):
+    # Persisted FIFO watermark, one row per ledger (party NULL is the general
+    # ledger). The "closed" boundary is the (date, id) of the last closed item and the
+    # cumulative sales up to and including it; the "settled" boundary is the
+    # same for the last settled payment. Writes mark the ledgers dirty from the
+    # earliest affected date so the next pass only re-walks from there.
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+
+    closed_item_date = models.DateField(null=True, blank=True)
+    closed_item_id = models.IntegerField(null=True, blank=True)
+    closed_items_value = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    settled_money_date = models.DateField(null=True, blank=True)
+    settled_money_id = models.IntegerField(null=True, blank=True)
+    settled_money_value = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    total_received = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    items_dirty_from = models.DateField(null=True, blank=True)
+    money_dirty_from = models.DateField(null=True, blank=True)
+
+    # Value of the ledger's archived items and payments (see sales.archive).
+    # Archived rows precede every live row, so a pass starts from these.
+    archived_items_value = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    archived_received = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    # Rows dated before this have been archived. Only the general ledger's
+    # row carries it; the cutoff applies to every ledger.
+    archived_before = models.DateField(null=True, blank=True)
+
+    # Whether the ledger's LedgerEntry rows are known to cover every live
+    # row; a pass backfills them first otherwise (databases that predate
+    # the ledger).
+    ledger_backfilled = models.BooleanField(default=False)
+
+    # Bumped whenever the ledger is marked dirty or its archived totals
+    # move. A pass computes its boundaries before taking the write lock and
+    # starts over if the revision changed in between.
+    revision = models.PositiveBigIntegerField(default=0)
+
+    # Bumped on every write; cached artifacts are keyed on it. Only the
+    # general ledger's row carries it.
+    data_version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # One row per ledger, the general one (NULL) included.
+            models.UniqueConstraint(Coalesce('party', 0), name='settlement_state_party_uniq'),
+        ]
+
+    @classmethod
+    def archive_cutoff(cls):
+        """The general row's ``archived_before`` (None before the first archive run)."""
+        return cls.objects.filter(party__isnull=True).values_list('archived_before', flat=True).first()
+
+    def __str__(self):
+        return f"Closed up to {self.closed_item_date} ({self.closed_items_value})"
+
+class LedgerEntry(models.Model):
+    # Running balance of one ledger, one row per ItemSold/MoneyReceived row.
+    # Amounts are stored as integer thousandths so that running totals are
+    # exact in SQL; `cumulative` is the sum of `amount` over every entry of
+    # the same kind and party up to and including this one in
+    # (date, source_id) order.
+    ITEM = 'item'
+    MONEY = 'money'
+    KIND_CHOICES = [(ITEM, 'Item Sold'), (MONEY, 'Money Received')]
+
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    source_id = models.IntegerField()
+    date = models.DateField()
+    amount = models.BigIntegerField()
+    cumulative = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'source_id'], name='ledger_kind_source_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'party', 'date', 'source_id'], name='ledger_party_order_idx'),
+            models.Index(fields=['kind', 'party', 'cumulative', 'date', 'source_id'], name='ledger_party_cumulative_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.source_id} @ {self.date}: {self.cumulative}"
+
+class DailySummary(models.Model):
+    # Per-date rollup of both ledgers, kept current on every write and
+    # settlement pass, so the dashboard can chart and total long ranges
+    # from a few thousand rows instead of every transaction.
+    date = models.DateField(unique=True)
+    received = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    sold = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    weight = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    open_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.date} - sold {self.sold}, received {self.received}"
+
+class ArchivedItemSold(models.Model):
+    # ItemSold rows of archived periods (see sales.archive), with their
+    # original ids. Archived items are closed by definition.
+    id = models.IntegerField(primary_key=True)
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    date = models.DateField()
+    weight = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Weight (kg)")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Price (per unit)")
+    total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Total (Rupees)")
+    is_closed = models.BooleanField(default=True, verbose_name="Closed")
+
+    archived = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'is_closed', 'total'], name='archived_item_date_idx'),
+            models.Index(fields=['party', 'date', 'is_closed', 'total'], name='archived_item_party_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.total} (archived)"
+
+class ArchivedMoneyReceived(models.Model):
+    # MoneyReceived rows of archived periods, settled by definition.
+    id = models.IntegerField(primary_key=True)
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    date = models.DateField()
+    amount = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Money Received")
+    is_settled = models.BooleanField(default=True, verbose_name="Settled")
+
+    archived = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'is_settled', 'amount'], name='archived_money_date_idx'),
+            models.Index(fields=['party', 'date', 'is_settled', 'amount'], name='archived_money_party_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.amount} (archived)"
+
+class ArchivedPeriod(models.Model):
+    # One row per ledger and archived month: what was moved out of the live
+    # tables. The settlement offsets are recomputed from these on a full pass.
+    party = models.ForeignKey(Party, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    month = models.DateField()
+    item_count = models.PositiveIntegerField(default=0)
+    weight = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    sold = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    received = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Coalesce('party', 0), 'month', name='archived_period_party_month_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} - sold {self.sold}, received {self.received}"
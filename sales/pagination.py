@@ -0,0 +1,155 @@
+"""
+Keyset (seek) pagination on (date, id).
+
+Pages are addressed by the (date, id) of the row they start after (``after``)
+or end before (``before``) rather than by an OFFSET, so page 1000 costs the
+same index seek as page 1.
+
+A listing can also be a list of querysets over consecutive date ranges,
+oldest first (live rows behind archived ones, see ``sales.archive``); a
+page then reads them in turn until it is full.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import QueryDict
+
+PAGE_PARAMS = ('after', 'before', 'per_page')
+
+
+def encode_cursor(row):
+    return f"{row.date.isoformat()}_{row.pk}"
+
+
+def decode_cursor(value):
+    try:
+        date, pk = value.split('_')
+        return datetime.date.fromisoformat(date), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def page_size(value):
+    sizes = settings.SALES_PAGE_SIZES
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return settings.SALES_DEFAULT_PAGE_SIZE
+    return value if value in sizes else settings.SALES_DEFAULT_PAGE_SIZE
+
+
+def _seek(ordering, cursor, forward):
+    # Rows strictly after the cursor in `ordering` (or before it, going back).
+    date, pk = cursor
+    date_desc, id_desc = (field.startswith('-') for field in ordering)
+    date_op = 'lt' if date_desc == forward else 'gt'
+    id_op = 'lt' if id_desc == forward else 'gt'
+    return Q(**{f'date__{date_op}': date}) | Q(date=date, **{f'id__{id_op}': pk})
+
+
+def _reverse(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    def __init__(self, rows, per_page, query, has_next, has_previous):
+        self.rows = rows
+        self.per_page = per_page
+        self.sizes = settings.SALES_PAGE_SIZES
+        self.has_next = has_next and bool(rows)
+        self.has_previous = has_previous and bool(rows)
+        self._query = query
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _link(self, **params):
+        query = self._query.copy()
+        for key in PAGE_PARAMS:
+            query.pop(key, None)
+        query.update(params)
+        return query.urlencode()
+
+    @property
+    def next_query(self):
+        return self._link(after=encode_cursor(self.rows[-1]), per_page=self.per_page)
+
+    @property
+    def previous_query(self):
+        return self._link(before=encode_cursor(self.rows[0]), per_page=self.per_page)
+
+    @property
+    def first_query(self):
+        return self._link(per_page=self.per_page)
+
+    def size_query(self, size):
+        return self._link(per_page=size)
+
+    def size_links(self):
+        return [(size, self.size_query(size)) for size in self.sizes]
+
+
+def _read(segments, ordering, cursor, forward, limit):
+    # Up to `limit` rows past the cursor, reading the segments in the
+    # direction the rows come out in.
+    if ordering[0].startswith('-') == forward:
+        segments = segments[::-1]
+    order = ordering if forward else _reverse(ordering)
+    rows = []
+    for queryset in segments:
+        if cursor is not None:
+            queryset = queryset.filter(_seek(ordering, cursor, forward))
+        rows.extend(queryset.order_by(*order)[:limit - len(rows)])
+        if len(rows) == limit:
+            break
+    return rows
+
+
+def page_query(cleaned_data, query):
+    """
+    The query string a page's links build on: the validated FilterForm
+    values in normal form, plus the cursor and page size from ``query``.
+    Cached pages are shared by every request with the same filters, so the
+    links must not carry whatever else the first requester sent.
+    """
+    params = QueryDict(mutable=True)
+    for name, value in cleaned_data.items():
+        if value is None or value == '' or value is False:
+            continue
+        if value is True:
+            value = 'on'
+        elif hasattr(value, 'pk'):
+            value = value.pk
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        params[name] = str(value)
+    for name in PAGE_PARAMS:
+        if query.get(name):
+            params[name] = query[name]
+    return params
+
+
+def paginate(queryset, ordering, params):
+    """
+    Return the KeysetPage of ``queryset`` (or of a list of querysets, oldest
+    first) selected by the ``after``/``before`` and ``per_page`` values in
+    ``params`` (usually ``request.GET``).
+    """
+    segments = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    per_page = page_size(params.get('per_page'))
+    after = decode_cursor(params.get('after'))
+    before = decode_cursor(params.get('before'))
+
+    if before is not None:
+        rows = _read(segments, ordering, before, False, per_page + 1)
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return KeysetPage(rows, per_page, params, has_next=True, has_previous=has_previous)
+
+    rows = _read(segments, ordering, after, True, per_page + 1)
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], per_page, params, has_next=has_next, has_previous=after is not None)
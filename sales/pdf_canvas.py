@@ -0,0 +1,196 @@
+"""
+Native PDF engine for the tabular report.
+
+Draws the same report as ``pdf_report.html`` (heading, the two tables with
+their total rows, the balance summary) straight onto a reportlab canvas.
+Columns have fixed widths and every row the same height, so the rows that
+fit on a page are known before anything is drawn; each page's body is then
+one text object per column. No HTML is rendered, parsed or laid out, which
+is where the HTML engine spends its time.
+
+reportlab is optional (it comes with xhtml2pdf); ``available()`` tells
+``sales.jobs`` whether to fall back to the HTML engine.
+"""
+import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.utils import formats
+
+from . import reports
+from .models import ItemSold, MoneyReceived
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+except ImportError:  # optional dependency
+    canvas = None
+    A4 = (595.27, 841.89)
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 36
+ROW_HEIGHT = 16
+PADDING = 4
+FONT = 'Helvetica'
+BOLD = 'Helvetica-Bold'
+FONT_SIZE = 9
+
+# (header, share of the table width); same columns as pdf_report.html.
+MONEY_COLUMNS = [('ID', 0.15), ('Date', 0.35), ('Money Received', 0.5)]
+ITEM_COLUMNS = [('ID', 0.1), ('Date', 0.25), ('Weight (kg)', 0.2), ('Price', 0.2), ('Total', 0.25)]
+
+CENTS = Decimal('0.01')
+
+
+def available():
+    return canvas is not None
+
+
+def _money(value):
+    # floatformat:2 rounds half up.
+    return f"Rs. {Decimal(value).quantize(CENTS, rounding=ROUND_HALF_UP)}"
+
+
+class _DateText(dict):
+    # Dates repeat across many rows; format each one once, as the template would.
+    def __missing__(self, date):
+        text = self[date] = formats.date_format(date)
+        return text
+
+
+class _Writer:
+    def __init__(self, dest):
+        self.canvas = canvas.Canvas(dest, pagesize=A4)
+        self.top = PAGE_HEIGHT - MARGIN
+        self.y = self.top
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.y = self.top
+
+    def heading(self, text, size):
+        if self.y - size * 2 - ROW_HEIGHT * 2 < MARGIN:
+            self.new_page()
+        self.y -= size * 1.5
+        self.canvas.setFont(BOLD, size)
+        self.canvas.drawCentredString(PAGE_WIDTH / 2, self.y, text)
+        self.y -= size
+
+    def text(self, text):
+        self.y -= ROW_HEIGHT
+        self.canvas.setFont(FONT, FONT_SIZE)
+        self.canvas.drawString(MARGIN, self.y, text)
+        self.y -= PADDING
+
+    def capacity(self):
+        # Body rows that fit below the current position under a header row.
+        return int((self.y - MARGIN) // ROW_HEIGHT) - 1
+
+    def block(self, columns, rows, total=None, width=None, header=True):
+        """Draw a header row, ``rows`` and an optional ("Total:", value) row."""
+        c = self.canvas
+        width = width or PAGE_WIDTH - 2 * MARGIN
+        edges = [MARGIN]
+        for _, share in columns:
+            edges.append(edges[-1] + width * share)
+        count = (1 if header else 0) + len(rows) + (1 if total else 0)
+        top, bottom = self.y, self.y - count * ROW_HEIGHT
+        first = top - ROW_HEIGHT if header else top
+        baseline = ROW_HEIGHT - PADDING - 1
+
+        c.setFillColor(colors.HexColor('#f2f2f2'))
+        if header:
+            c.rect(MARGIN, first, width, ROW_HEIGHT, fill=1, stroke=0)
+        else:
+            # Header-less tables (the summary) shade their first column instead.
+            c.rect(MARGIN, bottom, edges[1] - MARGIN, count * ROW_HEIGHT, fill=1, stroke=0)
+        if total:
+            c.setFillColor(colors.HexColor('#eeeeee'))
+            c.rect(MARGIN, bottom, width, ROW_HEIGHT, fill=1, stroke=0)
+        c.setStrokeColor(colors.HexColor('#dddddd'))
+        c.setLineWidth(0.5)
+        for index in range(count + 1):
+            c.line(MARGIN, top - index * ROW_HEIGHT, MARGIN + width, top - index * ROW_HEIGHT)
+        for edge in edges:
+            c.line(edge, top, edge, bottom)
+
+        c.setFillColor(colors.black)
+        if header:
+            c.setFont(BOLD, FONT_SIZE)
+            for (title, _), left in zip(columns, edges):
+                c.drawString(left + PADDING, top - baseline, title)
+        for column, left in enumerate(edges[:-1]):
+            text = c.beginText(left + PADDING, first - baseline)
+            text.setFont(FONT, FONT_SIZE, leading=ROW_HEIGHT)
+            for row in rows:
+                text.textLine(row[column])
+            c.drawText(text)
+        if total:
+            c.setFont(BOLD, FONT_SIZE)
+            c.drawRightString(edges[-2] - PADDING, bottom + ROW_HEIGHT - baseline, total[0])
+            c.drawString(edges[-2] + PADDING, bottom + ROW_HEIGHT - baseline, total[1])
+        self.y = bottom
+
+    def table(self, columns, rows, totals):
+        """
+        Lay ``rows`` out page by page; ``totals()`` is called once the rows
+        are exhausted and gives the value for the closing total row.
+        """
+        if self.capacity() < 2:
+            self.new_page()
+        page, capacity = [], self.capacity()
+        for row in rows:
+            if len(page) == capacity:
+                self.block(columns, page)
+                self.new_page()
+                page, capacity = [], self.capacity()
+            page.append(row)
+        if len(page) == capacity:
+            # No room left for the total row on this page.
+            self.block(columns, page)
+            self.new_page()
+            page = []
+        self.block(columns, page, total=('Total:', _money(totals())))
+        self.y -= ROW_HEIGHT
+
+    def save(self):
+        self.canvas.save()
+
+
+def _rows(querysets, fields, value_field, totals, key, format_row):
+    for batch in reports._batches(querysets, fields):
+        for row in batch:
+            totals[key] += row[value_field]
+            yield format_row(row)
+
+
+def write_pdf(dest, date=None):
+    """Draw the full report into the binary file object ``dest``."""
+    date = date or datetime.date.today()
+    dates = _DateText()
+    totals = {'total_money': Decimal(0), 'total_sales': Decimal(0)}
+    writer = _Writer(dest)
+
+    writer.heading('Sales Report', 18)
+    writer.text(f'Date: {formats.date_format(date)}')
+
+    writer.heading('Money Received', 14)
+    money = _rows(reports.history(MoneyReceived), ('id', 'date', 'amount'), 'amount', totals, 'total_money',
+                  lambda row: (str(row['id']), dates[row['date']], _money(row['amount'])))
+    writer.table(MONEY_COLUMNS, money, lambda: totals['total_money'])
+
+    writer.heading('Items Sold', 14)
+    items = _rows(reports.history(ItemSold), ('id', 'date', 'weight', 'price', 'total'), 'total', totals, 'total_sales',
+                  lambda row: (str(row['id']), dates[row['date']], str(row['weight']),
+                               _money(row['price']), _money(row['total'])))
+    writer.table(ITEM_COLUMNS, items, lambda: totals['total_sales'])
+
+    writer.heading('Net Balance Summary', 12)
+    if writer.capacity() < 3:
+        writer.new_page()
+    writer.block([('', 0.5), ('', 0.5)], [
+        ('Total Sales', _money(totals['total_sales'])),
+        ('Total Money Received', _money(totals['total_money'])),
+        ('Balance Due', _money(totals['total_sales'] - totals['total_money'])),
+    ], width=(PAGE_WIDTH - 2 * MARGIN) / 2, header=False)
+    writer.save()
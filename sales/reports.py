@@ -0,0 +1,267 @@
+"""
+Chunked PDF report generation.
+
+Instead of rendering every row into one HTML document and laying it out in
+one go, rows are streamed from the database with ``.iterator()`` and
+rendered ``CHUNK_ROWS`` at a time. The finished pages of each render are
+copied straight into the output file (``PdfStream``), so neither the HTML,
+the layout tree nor the PDF objects ever hold more than about one chunk.
+
+Every row is one line of the same height, so the pages are cut before
+anything is rendered (``_Layout``), as ``sales.pdf_canvas`` does: each
+render is a run of whole pages, and a chunk's unfinished last page waits
+for the rows of the next one. The report flows from one chunk to the next
+as if laid out in one go, with no page break between chunks or sections.
+
+The report covers the whole history, so the archived rows (see
+``sales.archive``) are read ahead of the live ones.
+"""
+import datetime
+import io
+from decimal import Decimal
+from itertools import chain, islice
+
+from django.template.loader import render_to_string
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject
+from xhtml2pdf import pisa
+
+from . import archive
+from .models import ItemSold, MoneyReceived
+
+CHUNK_ROWS = 1000
+
+TEMPLATE = 'sales/pdf_report.html'
+
+# Page height in body rows of TEMPLATE, and what each block costs in them;
+# measured against xhtml2pdf's A4 layout with a line to spare.
+PAGE_LINES = 29
+HEADER_LINES = 3  # report title and date
+HEADING_LINES = 2  # section title
+TABLE_LINES = 2  # header row and the gap below the table
+SUMMARY_LINES = 5
+
+
+class ReportError(Exception):
+    def __init__(self, html):
+        super().__init__('PDF rendering failed')
+        self.html = html
+
+
+def history(model):
+    """Querysets over every row of ``model``: the archived ones, then the live ones."""
+    return [archive.TABLES[model].objects.all(), model.objects.all()]
+
+
+def _batches(querysets, fields):
+    rows = chain.from_iterable(queryset.order_by('date', 'id').values(*fields).iterator(chunk_size=CHUNK_ROWS)
+                               for queryset in querysets)
+    while True:
+        batch = list(islice(rows, CHUNK_ROWS))
+        if not batch:
+            return
+        yield batch
+
+
+def _section(name, batches, value_field, total_key, totals, context):
+    # One-batch lookahead so the last chunk carries the total row.
+    current = next(batches, [])
+    first = True
+    while True:
+        upcoming = next(batches, None)
+        totals[total_key] += sum((row[value_field] for row in current), Decimal(0))
+        yield dict(context, section=name, rows=current, first_chunk=first,
+                   last_chunk=upcoming is None, **totals)
+        if upcoming is None:
+            return
+        current, first = upcoming, False
+
+
+def report_parts(date=None):
+    """Yield the template context for each chunk of the report, in order."""
+    base = {'date': date or datetime.date.today()}
+    totals = {'total_money': Decimal(0), 'total_sales': Decimal(0)}
+
+    money = _batches(history(MoneyReceived), ('id', 'date', 'amount'))
+    for index, context in enumerate(_section('money', money, 'amount', 'total_money', totals, base)):
+        context['show_header'] = index == 0
+        yield context
+
+    items = _batches(history(ItemSold), ('id', 'date', 'weight', 'price', 'total'))
+    yield from _section('items', items, 'total', 'total_sales', totals, base)
+
+    yield dict(base, section='summary', balance=totals['total_sales'] - totals['total_money'], **totals)
+
+
+class PdfStream:
+    """
+    Write pages of other PDFs into ``dest`` as they come.
+
+    Each page and the objects it references are copied with new object
+    numbers and written immediately; only their offsets are kept for the
+    cross-reference table. ``close`` writes the page tree and trailer.
+    """
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.start = dest.tell()
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = self.PAGES + 1
+        dest.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _allocate(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _write(self, number, obj):
+        self.offsets[number] = self.dest.tell() - self.start
+        self.dest.write(b'%d 0 obj\n' % number)
+        obj.write_to_stream(self.dest)
+        self.dest.write(b'\nendobj\n')
+
+    def add(self, reader, pages):
+        """Copy ``pages`` (pages of ``reader``) to the end of the output."""
+        # reader object number -> output object number; the reader is
+        # discarded afterwards, so its objects are renumbered in place.
+        numbers = {}
+        for page in pages:
+            numbers[page.indirect_reference.idnum] = self._allocate()
+        pending = []
+
+        def renumber(obj):
+            if isinstance(obj, IndirectObject):
+                target = obj.get_object()
+                if obj.idnum not in numbers:
+                    if isinstance(target, DictionaryObject) and target.get('/Type') == '/Page':
+                        # A page that is not copied (e.g. a link target).
+                        return NullObject()
+                    numbers[obj.idnum] = self._allocate()
+                    pending.append((numbers[obj.idnum], target))
+                return IndirectObject(numbers[obj.idnum], 0, None)
+            if isinstance(obj, DictionaryObject):
+                for key, value in list(dict.items(obj)):
+                    dict.__setitem__(obj, key, renumber(value))
+            elif isinstance(obj, ArrayObject):
+                for index, value in enumerate(list.__iter__(obj)):
+                    list.__setitem__(obj, index, renumber(value))
+            return obj
+
+        for page in pages:
+            # Inherited attributes were copied onto the page when ``reader``
+            # flattened its page tree; the page now hangs off ours.
+            dict.pop(page, '/Parent', None)
+            number = numbers[page.indirect_reference.idnum]
+            renumber(page)
+            page[NameObject('/Parent')] = IndirectObject(self.PAGES, 0, None)
+            self._write(number, page)
+            self.page_ids.append(number)
+            while pending:
+                number, obj = pending.pop()
+                self._write(number, renumber(obj))
+
+    def close(self):
+        kids = ' '.join(f'{number} 0 R' for number in self.page_ids)
+        self.offsets[self.PAGES] = self.dest.tell() - self.start
+        self.dest.write(f'{self.PAGES} 0 obj\n<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>\n'
+                        f'endobj\n'.encode())
+        self.offsets[self.CATALOG] = self.dest.tell() - self.start
+        self.dest.write(f'{self.CATALOG} 0 obj\n<< /Type /Catalog /Pages {self.PAGES} 0 R >>\nendobj\n'.encode())
+        xref = self.dest.tell() - self.start
+        self.dest.write(f'xref\n0 {self.next_id}\n0000000000 65535 f \n'.encode())
+        for number in range(1, self.next_id):
+            if number in self.offsets:
+                self.dest.write(b'%010d 00000 n \n' % self.offsets[number])
+            else:
+                self.dest.write(b'0000000000 65535 f \n')
+        self.dest.write(f'trailer\n<< /Size {self.next_id} /Root {self.CATALOG} 0 R >>\n'
+                        f'startxref\n{xref}\n%%EOF\n'.encode())
+
+
+class _Layout:
+    """
+    Cut the report parts into pages of PAGE_LINES lines. ``take`` hands
+    over the pages finished so far; the last one stays open for more rows.
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.page = []
+        self.free = PAGE_LINES
+
+    def _keep(self, lines):
+        # Start a new page unless ``lines`` fit on this one.
+        if lines > self.free:
+            self.pages.append(self.page)
+            self.page, self.free = [], PAGE_LINES
+
+    def _put(self, lines, block):
+        self._keep(lines)
+        self.free -= lines
+        self.page.append(block)
+
+    def _row(self, section, row=None, total=None):
+        table = self.page[-1] if self.page else None
+        if table is None or table['kind'] != 'table' or table['section'] != section or self.free < 1:
+            # A new table (or its continuation) with its header row.
+            self._keep(TABLE_LINES + 1)
+            table = {'kind': 'table', 'section': section, 'rows': [], 'total': None}
+            self._put(TABLE_LINES, table)
+        self.free -= 1
+        if row is not None:
+            table['rows'].append(row)
+        else:
+            table['total'] = total
+
+    def add(self, part):
+        section = part['section']
+        if section == 'summary':
+            self._put(SUMMARY_LINES, dict(part, kind='summary'))
+            return
+        if part['first_chunk']:
+            # The titles stay on the page of the section's first row.
+            header = HEADER_LINES if part.get('show_header') else 0
+            self._keep(header + HEADING_LINES + TABLE_LINES + 1)
+            if header:
+                self._put(header, dict(part, kind='header'))
+            self._put(HEADING_LINES, {'kind': 'heading', 'section': section})
+        for row in part['rows']:
+            self._row(section, row)
+        if part['last_chunk']:
+            self._row(section, total=part['total_money' if section == 'money' else 'total_sales'])
+
+    def take(self, everything=False):
+        if everything and self.page:
+            self.pages.append(self.page)
+            self.page, self.free = [], PAGE_LINES
+        pages, self.pages = self.pages, []
+        return pages
+
+
+def _render(pages):
+    html = render_to_string(TEMPLATE, {'pages': pages})
+    output = io.BytesIO()
+    if pisa.CreatePDF(html, dest=output).err:
+        raise ReportError(html)
+    reader = PdfReader(output)
+    if len(reader.pages) != len(pages):
+        # A page held more than PAGE_LINES allow for; the cut is wrong.
+        raise ReportError(html)
+    return reader
+
+
+def write_pdf(dest, date=None):
+    """Render the full report into the binary file object ``dest``."""
+    output = PdfStream(dest)
+    layout = _Layout()
+    for context in report_parts(date):
+        layout.add(context)
+        pages = layout.take()
+        if pages:
+            reader = _render(pages)
+            output.add(reader, list(reader.pages))
+    reader = _render(layout.take(everything=True))
+    output.add(reader, list(reader.pages))
+    output.close()
@@ -0,0 +1,117 @@
+"""
+Daily rollups of ItemSold/MoneyReceived.
+
+``DailySummary`` holds one row per date with activity. Rows are recomputed
+from the source tables for just the dates a write touched (and for the
+date range a settlement pass flipped), so they never drift from the data.
+Weekly and monthly series are grouped from the daily rows.
+
+Rows of archived dates (see ``sales.archive``) are no longer recomputed:
+their source rows have left the live tables and the rollups keep their
+totals.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import DailySummary, ItemSold, MoneyReceived, SettlementState
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+
+TRUNCATE = {
+    WEEK: TruncWeek,
+    MONTH: TruncMonth,
+}
+
+
+def _in_range(queryset, start=None, end=None, dates=None):
+    if dates is not None:
+        return queryset.filter(date__in=dates)
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+@transaction.atomic
+def _refresh(start=None, end=None, dates=None):
+    archived_before = SettlementState.archive_cutoff()
+    if archived_before is not None:
+        if dates is not None:
+            dates = [date for date in dates if date >= archived_before]
+        elif start is None or start < archived_before:
+            start = archived_before
+    rows = {}
+
+    def row(date):
+        if date not in rows:
+            rows[date] = DailySummary(date=date)
+        return rows[date]
+
+    items = (_in_range(ItemSold.objects.all(), start, end, dates)
+             .values('date')
+             .annotate(sold=Sum('total'), weight=Sum('weight'), item_count=Count('id'),
+                       open_value=Sum('total', filter=Q(is_closed=False)))
+             .order_by())
+    for entry in items:
+        summary = row(entry['date'])
+        summary.sold = entry['sold'] or 0
+        summary.weight = entry['weight'] or 0
+        summary.item_count = entry['item_count']
+        summary.open_value = entry['open_value'] or 0
+
+    money = (_in_range(MoneyReceived.objects.all(), start, end, dates)
+             .values('date').annotate(received=Sum('amount')).order_by())
+    for entry in money:
+        row(entry['date']).received = entry['received'] or 0
+
+    _in_range(DailySummary.objects.all(), start, end, dates).delete()
+    DailySummary.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def refresh_dates(dates):
+    """Recompute the rollup rows for the given dates."""
+    dates = sorted(set(d for d in dates if d is not None))
+    if dates:
+        _refresh(dates=dates)
+
+
+def refresh_range(start=None, end=None):
+    """Recompute every rollup row between ``start`` and ``end`` (inclusive, open-ended if None)."""
+    return _refresh(start=start, end=end)
+
+
+def totals(start=None, end=None, due_before=None):
+    """Sums over the rollup range, plus the open/sold values up to ``due_before``."""
+    sums = {
+        'total_received': Sum('received'),
+        'total_sold': Sum('sold'),
+        'total_weight': Sum('weight'),
+        'total_items': Sum('item_count'),
+        'total_open': Sum('open_value'),
+    }
+    if due_before is not None:
+        due = Q(date__lte=due_before)
+        sums['due_sold'] = Sum('sold', filter=due)
+        sums['due_open'] = Sum('open_value', filter=due)
+    result = _in_range(DailySummary.objects.all(), start, end).aggregate(**sums)
+    return {key: value or Decimal(0) for key, value in result.items()}
+
+
+def series(start=None, end=None, period=DAY):
+    """Return [(bucket_date, received, sold), ...] ordered by date."""
+    queryset = _in_range(DailySummary.objects.all(), start, end)
+    if period == DAY:
+        return list(queryset.order_by('date').values_list('date', 'received', 'sold'))
+    return list(queryset
+                .annotate(bucket=TRUNCATE[period]('date'))
+                .values('bucket')
+                .annotate(total_received=Sum('received'), total_sold=Sum('sold'))
+                .order_by('bucket')
+                .values_list('bucket', 'total_received', 'total_sold'))
@@ -0,0 +1,108 @@
+"""
+Debounced settlement for the interactive write path.
+
+Settling on every save makes a clerk entering fifty rows pay for fifty
+passes. Inside ``deferred()`` (the entry form posts and the deletes) the
+signal handlers still record the ledger entry and mark the ledger dirty
+from the earliest affected date, but leave the pass to this scheduler: the
+first write arms a timer, and every write within SALES_SETTLEMENT_DEBOUNCE
+seconds joins the same background pass, which catches up every dirty
+ledger. Passes never overlap; writes that land while one runs arm the next.
+
+Pages show a "settlement pending" badge while ledgers are dirty instead of
+waiting, and checking for it arms a pass if none is (e.g. after a restart). Reads that hand out the flags (exports, the items API) call
+``flush()`` to settle first. Outside ``deferred()`` (imports, management
+commands, the shell) a write still settles its ledger immediately.
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import settlement
+
+_deferring = contextvars.ContextVar('sales_settlement_deferred', default=False)
+
+# _timer_lock guards the armed timer; _pass_lock keeps passes from overlapping.
+_timer_lock = threading.Lock()
+_pass_lock = threading.Lock()
+_timer = None
+
+
+@contextmanager
+def deferred():
+    """Leave the settlement of the writes in this block to the scheduler."""
+    token = _deferring.set(settings.SALES_SETTLEMENT_DEBOUNCE > 0)
+    try:
+        yield
+    finally:
+        _deferring.reset(token)
+
+
+def settle(party_id=None):
+    """Settle ``party_id``'s ledger now, or schedule a pass inside ``deferred()``."""
+    if not _deferring.get():
+        return settlement.settle(party_id=party_id)
+    # Armed once the write has committed, so the pass can see it.
+    transaction.on_commit(_arm)
+    return None
+
+
+def _arm():
+    global _timer
+    with _timer_lock:
+        if _timer is not None:
+            # Coalesced into the pass that is already armed.
+            return
+        _timer = threading.Timer(settings.SALES_SETTLEMENT_DEBOUNCE, _background)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _background():
+    global _timer
+    with _timer_lock:
+        _timer = None
+    close_old_connections()
+    try:
+        run_pass()
+    finally:
+        # Timer threads are not reused; don't leave the connection behind.
+        connection.close()
+
+
+def run_pass():
+    """Catch up every dirty ledger; returns the number of flags flipped."""
+    with _pass_lock:
+        dirty = settlement.dirty_ledgers()
+        if not dirty:
+            return 0
+        # Each pass bumps the data version, so pages cached while the
+        # ledgers were dirty (with the pending badge) are dropped.
+        return sum(settlement.settle(party_id=party_id).rows_updated for party_id in dirty)
+
+
+def flush():
+    """Run the pending pass now rather than when the timer fires."""
+    global _timer
+    with _timer_lock:
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    return run_pass()
+
+
+def pending():
+    """
+    Whether any ledger has writes that no pass has caught up with yet. If
+    so, a pass is scheduled unless one is already armed: the timer lives
+    only in the process that took the write, so a restart within the
+    debounce window would otherwise leave the ledgers dirty until the next
+    write.
+    """
+    if not settlement.dirty_ledgers():
+        return False
+    transaction.on_commit(_arm)
+    return True
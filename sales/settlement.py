@@ -0,0 +1,304 @@
+"""
+Incremental FIFO settlement.
+
+Items are closed in (date, id) order while the running total of sales fits
+inside the total money received. Money is settled in (date, id) order while
+its running total fits inside the value of the closed items. Both "closed"
+and "settled" rows therefore form a prefix of their table, so all we need to
+persist is where each prefix ends (see ``SettlementState``).
+
+Every party has a ledger of its own (``party_id`` None is the general
+ledger) with its own watermark, so a pass only reads and updates one
+party's rows. ``settle_dirty`` catches up every ledger with pending writes;
+``manage.py recompute_ledgers`` does the same across a process pool.
+
+The boundaries themselves are index seeks on the running-balance ledger
+(see ``sales.ledger``). A pass then flips the flags with one UPDATE per
+direction, limited to rows from the earliest of the old boundary, the new
+boundary and the earliest dirty date. A full pass computes the boundaries
+from the source columns instead (``sales.vector``). The boundaries are read
+without SQLite's write lock; only the flag and watermark updates take it,
+and a pass whose ledger was written to in between starts over.
+
+Archived rows (see ``sales.archive``) precede every live row of their
+ledger and are all closed/settled, so a pass only sees them as the archived
+totals kept on the state; the live running totals continue from there.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from . import ledger, metrics, rollup, vector
+from .models import ArchivedPeriod, ItemSold, MoneyReceived, Party, SettlementState
+
+ITEMS = 'items'
+MONEY = 'money'
+
+
+def get_state(party_id=None):
+    state, created = SettlementState.objects.get_or_create(party_id=party_id)
+    if created:
+        # First run against an existing database: establish the watermark.
+        settle(full=True, party_id=party_id)
+        state.refresh_from_db()
+    return state
+
+
+def ledger_ids():
+    """The general ledger (None) followed by every party's id."""
+    return [None] + list(Party.objects.order_by('id').values_list('id', flat=True))
+
+
+def dirty_ledgers():
+    """Ledgers with writes that the last pass has not caught up with."""
+    return list(SettlementState.objects
+                .filter(Q(items_dirty_from__isnull=False) | Q(money_dirty_from__isnull=False))
+                .order_by('id').values_list('party_id', flat=True))
+
+
+def _after(key):
+    date, pk = key
+    return Q(date__gt=date) | Q(date=date, id__gt=pk)
+
+
+def _upto(key):
+    date, pk = key
+    return Q(date__lt=date) | Q(date=date, id__lte=pk)
+
+
+def _apply(queryset, flag, cursor, since):
+    # One UPDATE per direction, limited to the region the pass could affect.
+    if since is not None:
+        queryset = queryset.filter(date__gte=since)
+    if cursor is None:
+        flipped_on = 0
+        flipped_off = queryset.filter(**{flag: True}).update(**{flag: False})
+    else:
+        flipped_on = queryset.filter(_upto(cursor), **{flag: False}).update(**{flag: True})
+        flipped_off = queryset.filter(_after(cursor), **{flag: True}).update(**{flag: False})
+    return flipped_on + flipped_off
+
+
+def _since(old_cursor, new_cursor, dirty_from):
+    if old_cursor is None or new_cursor is None:
+        return None
+    dates = [old_cursor[0], new_cursor[0]]
+    if dirty_from is not None:
+        dates.append(dirty_from)
+    return min(dates)
+
+
+def _archived_totals(party_id):
+    sums = ArchivedPeriod.objects.filter(party_id=party_id).aggregate(sold=Sum('sold'), received=Sum('received'))
+    return sums['sold'] or Decimal(0), sums['received'] or Decimal(0)
+
+
+def mark_dirty(ledger_name, date, party_id=None):
+    """Record that ``ledger_name`` (ITEMS or MONEY) of a party changed on or after ``date``."""
+    field = 'items_dirty_from' if ledger_name == ITEMS else 'money_dirty_from'
+    state = get_state(party_id)
+    current = getattr(state, field)
+    if current is None or date < current:
+        setattr(state, field, date)
+    state.revision += 1
+    if party_id is None:
+        state.data_version += 1
+        state.save(update_fields=[field, 'revision', 'data_version'])
+        return
+    state.save(update_fields=[field, 'revision'])
+    # The data version is global; it lives on the general ledger's row.
+    general = get_state()
+    general.data_version += 1
+    general.save(update_fields=['data_version'])
+
+
+def data_version():
+    return get_state().data_version
+
+
+def bump_version(after=0):
+    """
+    Move the data version past both its current value and ``after``.
+
+    A restored file carries the version it was backed up at, which may
+    already have been used for different data; passing the pre-restore
+    version keeps cache keys from colliding.
+    """
+    state = get_state()
+    state.data_version = max(state.data_version, after) + 1
+    state.save(update_fields=['data_version'])
+    return state.data_version
+
+
+def settle(full=False, party_id=None):
+    """
+    Bring ``is_closed``/``is_settled`` of one ledger up to date and return
+    its state.
+
+    With ``full=True`` the boundaries are recomputed from the source tables
+    (see ``sales.vector``) and every row's flag is checked rather than only
+    the region between the old and new boundaries (used after a restore).
+    """
+    with metrics.timer('settlement'):
+        state = _settle(full, party_id)
+    metrics.SETTLEMENT_ROWS.inc(state.rows_updated)
+    return state
+
+
+def settle_all(full=False):
+    """Settle every ledger; returns the number of flags flipped."""
+    return sum(settle(full, party_id).rows_updated for party_id in ledger_ids())
+
+
+def settle_dirty():
+    """Settle the ledgers with pending writes; returns the number of flags flipped."""
+    return sum(settle(party_id=party_id).rows_updated for party_id in dirty_ledgers())
+
+
+@contextmanager
+def _write_transaction():
+    # On SQLite a deferred transaction that has read cannot take the write
+    # lock once another writer (a recompute_ledgers worker, the scheduler's
+    # pass) has committed, and fails without waiting on busy_timeout.
+    # BEGIN IMMEDIATE takes the lock up front instead; other transactions
+    # keep their default, deferred mode so read-only ones never hold it.
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic():
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
+
+
+# Passes that find their ledger written to between computing the boundaries
+# and taking the write lock start over; the last attempt holds the lock
+# throughout.
+ATTEMPTS = 3
+
+STATE_FIELDS = [
+    'closed_item_date', 'closed_item_id', 'closed_items_value',
+    'settled_money_date', 'settled_money_id', 'settled_money_value',
+    'total_received', 'items_dirty_from', 'money_dirty_from',
+    'archived_items_value', 'archived_received',
+]
+
+
+class _Stale(Exception):
+    pass
+
+
+def _settle(full, party_id):
+    state = get_state(party_id)
+    if not state.ledger_backfilled:
+        _backfill(party_id)
+    if connection.in_atomic_block:
+        # Part of the caller's transaction; nothing can land in between.
+        return _write(_read(full, party_id))
+    for _ in range(ATTEMPTS - 1):
+        # WAL readers see one snapshot and never block writers, so the
+        # boundaries of several ledgers are computed side by side; only
+        # the flag and watermark updates below take turns.
+        with transaction.atomic():
+            plan = _read(full, party_id)
+        try:
+            with _write_transaction():
+                return _write(plan)
+        except _Stale:
+            pass
+    with _write_transaction():
+        return _write(_read(full, party_id))
+
+
+def _backfill(party_id):
+    # A database from before the ledger (or its first write since): the
+    # incremental passes seek on entries that may not exist yet.
+    with _write_transaction():
+        if not ledger.complete(party_id):
+            ledger.backfill(party_id)
+        SettlementState.objects.filter(party_id=party_id).update(ledger_backfilled=True)
+
+
+def _read(full, party_id):
+    """Compute the new boundaries of a ledger; reads only."""
+    state = SettlementState.objects.get(party_id=party_id)
+
+    old_item = old_money = None
+    if not full and state.closed_item_id is not None:
+        old_item = (state.closed_item_date, state.closed_item_id)
+    if not full and state.settled_money_id is not None:
+        old_money = (state.settled_money_date, state.settled_money_id)
+
+    if full:
+        state.archived_items_value, state.archived_received = _archived_totals(party_id)
+    archived_sold = ledger.to_units(state.archived_items_value)
+    archived_received = ledger.to_units(state.archived_received)
+
+    if full:
+        # Recomputed from the source tables rather than the ledger.
+        found = vector.boundaries(party_id, archived_sold, archived_received)
+        received = found['received']
+        new_item, closed_value = found['item'], found['closed_value']
+        new_money, settled_value = found['money'], found['settled_value']
+    else:
+        # Running totals of the live rows continue from the archived ones.
+        received = archived_received + ledger.total(ledger.MONEY, party_id)
+        new_item, live_closed = ledger.boundary(ledger.ITEM, received - archived_sold, party_id)
+        closed_value = archived_sold + live_closed
+        new_money, live_settled = ledger.boundary(ledger.MONEY, closed_value - archived_received, party_id)
+        settled_value = archived_received + live_settled
+
+    return {
+        'state': state, 'full': full,
+        'old_item': old_item, 'new_item': new_item, 'closed_value': closed_value,
+        'old_money': old_money, 'new_money': new_money, 'settled_value': settled_value,
+        'received': received,
+    }
+
+
+def _write(plan):
+    """Flip the flags and move the watermark to the boundaries ``_read`` found."""
+    state, full = plan['state'], plan['full']
+    revision = SettlementState.objects.filter(pk=state.pk).values_list('revision', flat=True).get()
+    if revision != state.revision:
+        raise _Stale
+    old_item, new_item = plan['old_item'], plan['new_item']
+    old_money, new_money = plan['old_money'], plan['new_money']
+    party_id = state.party_id
+
+    since = None if full else _since(old_item, new_item, state.items_dirty_from)
+    rows = _apply(ItemSold.objects.filter(party_id=party_id), 'is_closed', new_item, since)
+    if rows:
+        # Flags only flip between the old and new boundaries; refresh the
+        # open value of the daily rollups covering that span.
+        until = max(old_item[0], new_item[0]) if old_item and new_item else None
+        rollup.refresh_range(since, until)
+    rows += _apply(MoneyReceived.objects.filter(party_id=party_id), 'is_settled', new_money,
+                   None if full else _since(old_money, new_money, state.money_dirty_from))
+
+    state.closed_item_date, state.closed_item_id = new_item or (None, None)
+    state.closed_items_value = ledger.from_units(plan['closed_value'])
+    state.settled_money_date, state.settled_money_id = new_money or (None, None)
+    state.settled_money_value = ledger.from_units(plan['settled_value'])
+    state.total_received = ledger.from_units(plan['received'])
+    state.items_dirty_from = None
+    state.money_dirty_from = None
+    # Only the pass's own fields: the general row's data version moves with
+    # every write, whatever the ledger.
+    state.save(update_fields=STATE_FIELDS)
+    # The write that marked the ledger dirty has bumped the version already,
+    # but a page read in between may have cached the old flags under it.
+    # Bumping again in the pass's own transaction means no version is ever
+    # paired with flags older than it.
+    bump_version()
+
+    state.rows_updated = rows
+    return state
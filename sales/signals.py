@@ -0,0 +1,71 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import db_profile, ledger, metrics, rollup, scheduler, settlement, snapshot
+from .models import ItemSold, MoneyReceived
+
+# sender -> (settlement ledger, ledger kind, value field)
+LEDGERS = {
+    ItemSold: (settlement.ITEMS, ledger.ITEM, 'total'),
+    MoneyReceived: (settlement.MONEY, ledger.MONEY, 'amount'),
+}
+
+
+@receiver(pre_save, sender=ItemSold)
+@receiver(pre_save, sender=MoneyReceived)
+def remember_previous_date(sender, instance, raw=False, **kwargs):
+    # Back-dating a row affects the ledger from the earlier of the two dates;
+    # moving it to another party affects both parties' ledgers.
+    instance._previous_date = instance._previous_party_id = None
+    if instance.pk and not raw:
+        previous = sender.objects.filter(pk=instance.pk).values_list('date', 'party_id').first()
+        if previous is not None:
+            instance._previous_date, instance._previous_party_id = previous
+
+
+@receiver(post_save, sender=ItemSold)
+@receiver(post_save, sender=MoneyReceived)
+def settle_after_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    snapshot.invalidate()
+    name, kind, field = LEDGERS[sender]
+    party_id = instance.party_id
+    ledger.record(kind, instance.pk, instance.date, getattr(instance, field), party_id)
+
+    date = instance.date
+    previous = getattr(instance, '_previous_date', None)
+    previous_party_id = getattr(instance, '_previous_party_id', None)
+    if previous is not None and previous_party_id != party_id:
+        # Moved out of another party's ledger; settle that one too.
+        settlement.mark_dirty(name, previous, previous_party_id)
+        scheduler.settle(party_id=previous_party_id)
+    elif previous is not None and previous < date:
+        date = previous
+    settlement.mark_dirty(name, date, party_id)
+    # Immediately, or in a debounced pass for the interactive write path.
+    scheduler.settle(party_id=party_id)
+    # After settling, so the touched dates pick up the final flags (a
+    # deferred pass refreshes the dates whose flags it flips).
+    rollup.refresh_dates([instance.date, previous])
+
+
+@receiver(post_delete, sender=ItemSold)
+@receiver(post_delete, sender=MoneyReceived)
+def settle_after_delete(sender, instance, **kwargs):
+    snapshot.invalidate()
+    name, kind, field = LEDGERS[sender]
+    ledger.remove(kind, instance.pk)
+    settlement.mark_dirty(name, instance.date, instance.party_id)
+    scheduler.settle(party_id=instance.party_id)
+    rollup.refresh_dates([instance.date])
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    db_profile.apply_profile(connection)
+    # Counts the queries of whichever request is current (see sales.metrics).
+    # Reconnects fire this again on the same wrapper; install it once.
+    if metrics.sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.sql_wrapper)
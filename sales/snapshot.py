@@ -0,0 +1,209 @@
+"""
+In-process, read-optimized snapshot of the ledgers.
+
+Totals and chart series under party or amount filters used to aggregate
+the raw rows in SQL and, for the lists, build model instances with Decimal
+fields, when all they need is a date, a value and a flag per row. The
+snapshot keeps those columns in compact arrays instead: dates as ordinals,
+values as integer ledger units (see ``sales.ledger``), closed/settled flags
+as a bitset, plus prefix sums of the values and of the open values. Rows
+are sorted by (date, id), so a date range is two binary searches and its
+total a subtraction; amount filters scan only the slice in range.
+
+There is one table per kind for all ledgers together and one per party.
+The archived rows (see ``sales.archive``) come first, so ranges reaching
+back past the archive cutoff include them. The snapshot is built once per
+data version and shared by every request of the worker process; writes
+(through the model signals) and restores drop it, and a version change
+made by another process is noticed on the next read. ``stats()`` reports
+its size, also exported as ``sales_ledger_snapshot_bytes``.
+"""
+import bisect
+import datetime
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+from . import ledger, metrics, reports, settlement, vector
+from .models import ItemSold, MoneyReceived
+
+# kind -> (model, value field, closed/settled flag)
+KINDS = {
+    ledger.ITEM: (ItemSold, 'total', 'is_closed'),
+    ledger.MONEY: (MoneyReceived, 'amount', 'is_settled'),
+}
+
+BATCH_SIZE = 5000
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class _Table:
+    """One kind of row for one ledger (or all of them), in (date, id) order."""
+
+    def __init__(self):
+        self.dates = array('l')
+        self.units = array('q')
+        self.done = bytearray()
+        # cumulative[i] is the value of rows [0, i); open_cumulative likewise
+        # for rows that are not closed/settled.
+        self.cumulative = array('q', [0])
+        self.open_cumulative = array('q', [0])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def append(self, ordinal, units, done):
+        index = len(self.dates)
+        self.dates.append(ordinal)
+        self.units.append(units)
+        if index % 8 == 0:
+            self.done.append(0)
+        if done:
+            self.done[index >> 3] |= 1 << (index & 7)
+        self.cumulative.append(self.cumulative[-1] + units)
+        self.open_cumulative.append(self.open_cumulative[-1] + (0 if done else units))
+
+    def is_done(self, index):
+        return bool(self.done[index >> 3] & (1 << (index & 7)))
+
+    def bounds(self, start=None, end=None):
+        """Slice [lo, hi) of the rows dated within start..end (inclusive)."""
+        lo = bisect.bisect_left(self.dates, start.toordinal()) if start else 0
+        hi = bisect.bisect_right(self.dates, end.toordinal()) if end else len(self.dates)
+        return lo, max(lo, hi)
+
+    def sums(self, lo, hi, low=None, high=None):
+        """(total, open) units of rows lo..hi whose value is within low..high."""
+        if low is None and high is None:
+            return (self.cumulative[hi] - self.cumulative[lo],
+                    self.open_cumulative[hi] - self.open_cumulative[lo])
+        total = still_open = 0
+        for index in range(lo, hi):
+            value = self.units[index]
+            if (low is None or value >= low) and (high is None or value <= high):
+                total += value
+                if not self.is_done(index):
+                    still_open += value
+        return total, still_open
+
+    def nbytes(self):
+        columns = (self.dates, self.units, self.cumulative, self.open_cumulative)
+        return sum(column.itemsize * len(column) for column in columns) + len(self.done)
+
+
+_EMPTY = _Table()
+
+
+def _amount_bounds(cleaned_data):
+    # The FilterForm amount range in units; falsy values mean no bound, as
+    # in dashboard.filtered_querysets.
+    low, high = cleaned_data.get('min_amount'), cleaned_data.get('max_amount')
+    return (ledger.to_units(low) if low else None), (ledger.to_units(high) if high else None)
+
+
+class LedgerSnapshot:
+    def __init__(self, version):
+        self.version = version
+        # (kind, party_id) -> _Table; party_id None holds every ledger's rows.
+        self.tables = {}
+        self.build_seconds = 0.0
+
+    def table(self, kind, party=None):
+        return self.tables.get((kind, party.pk if party else None), _EMPTY)
+
+    def sums(self, kind, cleaned_data, until=None):
+        """
+        (total, open) value, as Decimals, of the ``kind`` rows matching the
+        FilterForm values, optionally only those dated up to ``until``.
+        """
+        table = self.table(kind, cleaned_data.get('party'))
+        end = cleaned_data.get('end_date')
+        if until is not None and (end is None or until < end):
+            end = until
+        lo, hi = table.bounds(cleaned_data.get('start_date'), end)
+        total, still_open = table.sums(lo, hi, *_amount_bounds(cleaned_data))
+        return ledger.from_units(total), ledger.from_units(still_open)
+
+    def daily_rows(self, cleaned_data):
+        """[(date, received, sold), ...] per date, like ``dashboard.daily_rows``."""
+        low, high = _amount_bounds(cleaned_data)
+        days = {}
+        for position, kind in enumerate((ledger.MONEY, ledger.ITEM)):
+            table = self.table(kind, cleaned_data.get('party'))
+            lo, hi = table.bounds(cleaned_data.get('start_date'), cleaned_data.get('end_date'))
+            for ordinal, value in zip(table.dates[lo:hi], table.units[lo:hi]):
+                if (low is None or value >= low) and (high is None or value <= high):
+                    day = days.setdefault(ordinal, [0, 0])
+                    day[position] += value
+        return [(datetime.date.fromordinal(ordinal), ledger.from_units(received), ledger.from_units(sold))
+                for ordinal, (received, sold) in sorted(days.items())]
+
+    def nbytes(self):
+        return sum(table.nbytes() for table in self.tables.values())
+
+
+def _build(version):
+    started = time.perf_counter()
+    snapshot = LedgerSnapshot(version)
+    for kind, (model, field, flag) in KINDS.items():
+        everything = snapshot.tables[(kind, None)] = _Table()
+        for queryset in reports.history(model):
+            rows = (queryset.order_by('date', 'id')
+                    .values_list('party_id', 'date', vector.units(model, field), flag)
+                    .iterator(chunk_size=BATCH_SIZE))
+            for party_id, date, units, done in rows:
+                ordinal = date.toordinal()
+                everything.append(ordinal, units, done)
+                if party_id is not None:
+                    party = snapshot.tables.get((kind, party_id))
+                    if party is None:
+                        party = snapshot.tables[(kind, party_id)] = _Table()
+                    party.append(ordinal, units, done)
+        metrics.SNAPSHOT_ROWS.set(len(everything), kind=kind)
+    snapshot.build_seconds = time.perf_counter() - started
+    metrics.SNAPSHOT_BYTES.set(snapshot.nbytes())
+    return snapshot
+
+
+def enabled():
+    return settings.SALES_LEDGER_SNAPSHOT
+
+
+def current(version=None):
+    """The snapshot of data ``version`` (default: the current one), built on first use."""
+    global _snapshot
+    if version is None:
+        version = settlement.data_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _lock:
+        # Another request may have built it while this one waited.
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _build(version)
+        return _snapshot
+
+
+def invalidate():
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    metrics.SNAPSHOT_BYTES.set(0)
+
+
+def stats():
+    """Size of this process's snapshot (None fields when none is built)."""
+    snapshot = _snapshot
+    if snapshot is None:
+        return {'version': None, 'items': 0, 'money': 0, 'bytes': 0, 'build_seconds': None}
+    return {
+        'version': snapshot.version,
+        'items': len(snapshot.table(ledger.ITEM)),
+        'money': len(snapshot.table(ledger.MONEY)),
+        'bytes': snapshot.nbytes(),
+        'build_seconds': round(snapshot.build_seconds, 4),
+    }
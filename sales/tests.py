@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from pypdf import PdfReader
+
+from . import (api, archive, async_views, backup, backup_store, bench, dashboard, db_profile, export, importer, jobs,
+               ledger, maintenance, metrics, pdf_canvas, reports, rollup, scheduler, settlement, snapshot, vector,
+               view_cache)
+from .forms import ItemSoldForm
+from .middleware import MaintenanceMiddleware, MetricsMiddleware
+from .models import (ArchivedItemSold, ArchivedMoneyReceived, ArchivedPeriod, DailySummary, ItemSold, LedgerEntry,
+                     MoneyReceived, Party, SettlementState)
+
+
+def reference_status(party=None):
+    # The original full-recompute rules, used as the oracle for the engine.
+    # Archived rows come first in their ledger.
+    items = [item for model in (ArchivedItemSold, ItemSold)
+             for item in model.objects.filter(party=party).order_by('date', 'id')]
+    money = [entry for model in (ArchivedMoneyReceived, MoneyReceived)
+             for entry in model.objects.filter(party=party).order_by('date', 'id')]
+    total_received = sum((m.amount for m in money), Decimal(0))
+    cumulative = closed_value = Decimal(0)
+    closed = set()
+    for item in items:
+        cumulative += item.total
+        if cumulative <= total_received:
+            closed.add(item.pk)
+            closed_value += item.total
+    cumulative = Decimal(0)
+    settled = set()
+    for entry in money:
+        cumulative += entry.amount
+        if cumulative <= closed_value:
+            settled.add(entry.pk)
+    return closed, settled, closed_value
+
+
+class SettlementTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+
+    def assertConsistent(self):
+        closed, settled, closed_value = reference_status()
+        self.assertEqual(set(ItemSold.objects.filter(is_closed=True).values_list('pk', flat=True)), closed)
+        self.assertEqual(set(MoneyReceived.objects.filter(is_settled=True).values_list('pk', flat=True)), settled)
+        self.assertEqual(settlement.get_state().closed_items_value, closed_value)
+        self.assertLedgerMatchesSource()
+
+    def assertLedgerMatchesSource(self):
+        for kind, (model, field) in ledger.SOURCES.items():
+            expected = []
+            cumulative = 0
+            for pk, value in model.objects.order_by('date', 'id').values_list('pk', field):
+                cumulative += ledger.to_units(value)
+                expected.append((pk, cumulative))
+            actual = list(LedgerEntry.objects.filter(kind=kind).order_by('date', 'source_id')
+                          .values_list('source_id', 'cumulative'))
+            self.assertEqual(actual, expected, kind)
+
+    def test_fifo_closing_and_settling(self):
+        day = datetime.date(2026, 1, 1)
+        first = ItemSold.objects.create(date=day, weight=1, price=1000)
+        second = ItemSold.objects.create(date=day + datetime.timedelta(days=1), weight=1, price=1000)
+        MoneyReceived.objects.create(date=day, amount=1500)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.is_closed)
+        self.assertFalse(second.is_closed)
+        self.assertFalse(MoneyReceived.objects.get().is_settled)
+        self.assertConsistent()
+
+    def test_random_writes_match_full_recompute(self):
+        rng = random.Random(7)
+        start = datetime.date(2025, 1, 1)
+        for step in range(120):
+            day = start + datetime.timedelta(days=rng.randint(0, 60))
+            action = rng.random()
+            if action < 0.4:
+                ItemSold.objects.create(date=day, weight=Decimal(rng.randint(1, 20)), price=Decimal(rng.randint(10, 90)))
+            elif action < 0.75:
+                MoneyReceived.objects.create(date=day, amount=Decimal(rng.randint(10, 900)))
+            elif action < 0.9:
+                model = rng.choice([ItemSold, MoneyReceived])
+                row = model.objects.order_by('?').first()
+                if row:
+                    row.date = day  # back-date or move forward
+                    row.save()
+            else:
+                model = rng.choice([ItemSold, MoneyReceived])
+                row = model.objects.order_by('?').first()
+                if row:
+                    row.delete()
+            self.assertConsistent()
+
+    def test_page_views_do_not_write(self):
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=10)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 2), amount=5)
+        for name in ('sales:index', 'sales:item_sold', 'sales:money_received'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse(name), {'due_days': 0})
+            writes = [q['sql'] for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+            self.assertEqual(writes, [], name)
+
+    def test_rebuild_ledger_backfills_existing_rows(self):
+        ItemSold.objects.create(date=datetime.date(2026, 1, 2), weight=2, price=50)
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=30)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 3), amount=Decimal('30.5'))
+        LedgerEntry.objects.all().delete()
+
+        call_command('rebuild_ledger', stdout=io.StringIO())
+
+        self.assertConsistent()
+        self.assertEqual(ledger.boundary(ledger.ITEM, ledger.to_units(30))[1], ledger.to_units(30))
+
+    def test_ledger_records_the_stored_total(self):
+        item = ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=Decimal('1.005'), price=3)
+        item.refresh_from_db()
+        self.assertEqual(item.total, Decimal('3.02'))
+        self.assertEqual(LedgerEntry.objects.get(kind=ledger.ITEM, source_id=item.pk).amount, 3020)
+
+    def test_first_pass_backfills_a_missing_ledger(self):
+        # A database from before the ledger: rows and flags but no entries.
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=30)
+        ItemSold.objects.create(date=datetime.date(2026, 1, 2), weight=1, price=40)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 3), amount=50)
+        LedgerEntry.objects.all().delete()
+        SettlementState.objects.update(ledger_backfilled=False)
+
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 4), amount=5)
+
+        self.assertConsistent()
+        self.assertTrue(ItemSold.objects.get(price=30).is_closed)
+
+
+class SettlementLockTests(TransactionTestCase):
+    def test_only_settlement_takes_the_write_lock_up_front(self):
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=10)
+        with CaptureQueriesContext(connection) as queries:
+            settlement.settle()
+        sql = [q['sql'] for q in queries]
+        self.assertIn('BEGIN IMMEDIATE', sql)
+        # The boundaries are sought before the lock is taken.
+        first_seek = next(i for i, q in enumerate(sql) if 'sales_ledgerentry' in q)
+        self.assertLess(first_seek, sql.index('BEGIN IMMEDIATE'))
+        # Read-only transactions (e.g. a report render) stay deferred.
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                ItemSold.objects.count()
+        self.assertNotIn('BEGIN IMMEDIATE', [q['sql'] for q in queries])
+
+    def test_pass_starts_over_after_a_write_between_read_and_lock(self):
+        day = datetime.date(2026, 1, 1)
+        ItemSold.objects.create(date=day, weight=1, price=10)
+        read = settlement._read
+        plans = []
+
+        def read_then_write(full, party_id):
+            plans.append(read(full, party_id))
+            if len(plans) == 1:
+                # Another process posts a payment once the boundaries are
+                # known, and leaves its settlement to this pass.
+                with mock.patch.object(scheduler, 'settle'):
+                    MoneyReceived.objects.create(date=day, amount=10)
+            return plans[-1]
+
+        with mock.patch.object(settlement, '_read', read_then_write):
+            state = settlement.settle()
+        self.assertEqual(len(plans), 2)
+        self.assertEqual(state.total_received, 10)
+        self.assertTrue(ItemSold.objects.get().is_closed)
+        self.assertEqual(settlement.dirty_ledgers(), [])
+
+
+class RecomputeWorkersTests(TransactionTestCase):
+    def setUp(self):
+        self.day = datetime.date(2026, 1, 1)
+        self.parties = [Party.objects.create(name=name) for name in ('Alice', 'Bob', 'Carol')]
+        for party in [None] + self.parties:
+            for price in (100, 250, 40):
+                ItemSold.objects.create(party=party, date=self.day, weight=1, price=price)
+            MoneyReceived.objects.create(party=party, date=self.day, amount=300)
+        ItemSold.objects.update(is_closed=False)
+        for party in [None] + self.parties:
+            settlement.mark_dirty(settlement.ITEMS, self.day, party and party.pk)
+
+    @contextmanager
+    def file_database(self):
+        # Forked workers cannot reach the in-memory test database; run the
+        # command against a copy of it in a file.
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            target = sqlite3.connect(path)
+            connection.ensure_connection()
+            connection.connection.backup(target)
+            target.close()
+            memory, name = connection.connection, connection.settings_dict['NAME']
+            connection.connection = None
+            connection.settings_dict['NAME'] = path
+            try:
+                yield
+            finally:
+                connection.close()
+                connection.settings_dict['NAME'] = name
+                connection.connection = memory
+
+    def assert_settled(self, parties):
+        for party in parties:
+            closed, settled, _ = reference_status(party)
+            self.assertEqual(set(ItemSold.objects.filter(party=party, is_closed=True).values_list('pk', flat=True)), closed)
+            self.assertEqual(set(MoneyReceived.objects.filter(party=party, is_settled=True).values_list('pk', flat=True)), settled)
+
+    def test_workers_settle_ledgers_side_by_side(self):
+        out = io.StringIO()
+        with self.file_database():
+            call_command('recompute_ledgers', workers=3, stdout=out)
+            self.assert_settled([None] + self.parties)
+            self.assertEqual(settlement.dirty_ledgers(), [])
+        self.assertIn('Settled 4 ledger(s) with 3 worker(s)', out.getvalue())
+
+    def test_locked_workers_are_retried_or_reported(self):
+        parent = os.getpid()
+        alice, bob = self.parties[:2]
+        settle = settlement.settle
+
+        def locked(full=False, party_id=None):
+            # Bob is locked out in his worker only; Alice everywhere.
+            if party_id == alice.pk or (party_id == bob.pk and os.getpid() != parent):
+                raise OperationalError('database is locked')
+            return settle(full, party_id)
+
+        out, err = io.StringIO(), io.StringIO()
+        with self.file_database(), mock.patch.object(settlement, 'settle', locked):
+            with self.assertRaisesMessage(CommandError, 'party %d' % alice.pk):
+                call_command('recompute_ledgers', workers=2, stdout=out, stderr=err)
+            self.assert_settled([None, bob, self.parties[2]])
+            self.assertEqual(settlement.dirty_ledgers(), [alice.pk])
+        self.assertIn('Settled 3 ledger(s)', out.getvalue())
+        self.assertIn('database is locked', err.getvalue())
+
+
+class VectorBoundaryTests(TestCase):
+    def setUp(self):
+        rng = random.Random(11)
+        start = datetime.date(2025, 6, 1)
+        for _ in range(60):
+            day = start + datetime.timedelta(days=rng.randint(0, 40))
+            ItemSold.objects.create(date=day, weight=Decimal(rng.randint(1, 9999)) / 1000, price=Decimal(rng.randint(1, 9999)) / 100)
+        for _ in range(25):
+            day = start + datetime.timedelta(days=rng.randint(0, 40))
+            MoneyReceived.objects.create(date=day, amount=Decimal(rng.randint(1, 999999)) / 1000)
+
+    def test_numpy_python_and_ledger_agree(self):
+        found = vector.boundaries()
+        with mock.patch.object(vector, 'np', None):
+            self.assertEqual(vector.boundaries(), found)
+
+        received = ledger.total(ledger.MONEY)
+        self.assertEqual(found['received'], received)
+        self.assertEqual((found['item'], found['closed_value']), ledger.boundary(ledger.ITEM, received))
+        self.assertEqual((found['money'], found['settled_value']), ledger.boundary(ledger.MONEY, found['closed_value']))
+
+    def test_full_settle_does_not_need_the_ledger(self):
+        LedgerEntry.objects.all().delete()
+        ItemSold.objects.update(is_closed=False)
+        settlement.settle(full=True)
+        closed, settled, closed_value = reference_status()
+        self.assertEqual(set(ItemSold.objects.filter(is_closed=True).values_list('pk', flat=True)), closed)
+        self.assertEqual(set(MoneyReceived.objects.filter(is_settled=True).values_list('pk', flat=True)), settled)
+        self.assertEqual(settlement.get_state().closed_items_value, closed_value)
+
+
+class PartyLedgerTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        self.day = datetime.date(2026, 1, 1)
+        self.alice = Party.objects.create(name='Alice')
+        self.bob = Party.objects.create(name='Bob')
+
+    def flags(self, model, flag):
+        return set(model.objects.filter(**{flag: True}).values_list('pk', flat=True))
+
+    def test_ledgers_settle_independently(self):
+        alice_item = ItemSold.objects.create(party=self.alice, date=self.day, weight=1, price=100)
+        bob_item = ItemSold.objects.create(party=self.bob, date=self.day, weight=1, price=100)
+        general_item = ItemSold.objects.create(date=self.day, weight=1, price=100)
+        payment = MoneyReceived.objects.create(party=self.alice, date=self.day, amount=150)
+        self.assertEqual(self.flags(ItemSold, 'is_closed'), {alice_item.pk})
+        self.assertEqual(self.flags(MoneyReceived, 'is_settled'), set())
+        self.assertEqual(settlement.get_state(self.alice.pk).total_received, 150)
+        self.assertEqual(settlement.get_state(self.bob.pk).total_received, 0)
+
+        # Bob's payment does not touch Alice's ledger.
+        MoneyReceived.objects.create(party=self.bob, date=self.day, amount=100)
+        self.assertEqual(self.flags(ItemSold, 'is_closed'), {alice_item.pk, bob_item.pk})
+        self.assertFalse(ItemSold.objects.get(pk=general_item.pk).is_closed)
+
+        # Moving the payment to the general ledger re-settles both ledgers.
+        payment.party = None
+        payment.save()
+        self.assertEqual(self.flags(ItemSold, 'is_closed'), {bob_item.pk, general_item.pk})
+        self.assertEqual(ledger.total(ledger.MONEY, self.alice.pk), 0)
+        self.assertEqual(ledger.total(ledger.MONEY), ledger.to_units(150))
+
+    def test_rebuild_and_vector_are_per_party(self):
+        for index in range(12):
+            party = (self.alice, self.bob, None)[index % 3]
+            ItemSold.objects.create(party=party, date=self.day + datetime.timedelta(days=index), weight=1, price=10 + index)
+            MoneyReceived.objects.create(party=party, date=self.day + datetime.timedelta(days=index), amount=12)
+        recorded = sorted(LedgerEntry.objects.values_list('kind', 'source_id', 'party', 'cumulative'))
+        ledger.rebuild()
+        self.assertEqual(sorted(LedgerEntry.objects.values_list('kind', 'source_id', 'party', 'cumulative')), recorded)
+
+        for party_id in settlement.ledger_ids():
+            found = vector.boundaries(party_id)
+            received = ledger.total(ledger.MONEY, party_id)
+            self.assertEqual(found['received'], received)
+            self.assertEqual((found['item'], found['closed_value']), ledger.boundary(ledger.ITEM, received, party_id))
+
+    def test_recompute_ledgers_settles_only_dirty_ledgers(self):
+        ItemSold.objects.create(party=self.alice, date=self.day, weight=1, price=100)
+        MoneyReceived.objects.create(party=self.alice, date=self.day, amount=100)
+        ItemSold.objects.update(is_closed=False)
+        settlement.mark_dirty(settlement.ITEMS, self.day, self.alice.pk)
+        self.assertEqual(settlement.dirty_ledgers(), [self.alice.pk])
+
+        version = settlement.data_version()
+        out = io.StringIO()
+        call_command('recompute_ledgers', workers=1, stdout=out)
+        self.assertIn('Settled 1 ledger(s)', out.getvalue())
+        self.assertTrue(ItemSold.objects.get().is_closed)
+        self.assertEqual(settlement.dirty_ledgers(), [])
+        self.assertGreater(settlement.data_version(), version)
+        self.assertEqual(SettlementState.objects.filter(party__isnull=True).count(), 1)
+
+    def test_dashboard_is_scoped_to_the_party(self):
+        ItemSold.objects.create(party=self.alice, date=self.day, weight=1, price=100)
+        ItemSold.objects.create(party=self.bob, date=self.day, weight=1, price=300)
+        MoneyReceived.objects.create(party=self.bob, date=self.day, amount=500)
+
+        response = self.client.get(reverse('sales:index'), {'party': self.bob.pk, 'due_days': 1})
+        self.assertEqual(response.context['total_sold'], 300)
+        self.assertEqual(response.context['unused_money'], 200)
+        self.assertEqual(response.context['filtered_total'], 0)
+
+        response = self.client.get(reverse('sales:index'), {'due_days': 1})
+        self.assertEqual(response.context['total_sold'], 400)
+        self.assertEqual(response.context['filtered_total'], 100)
+        self.assertEqual(response.context['filtered_balance'], 100 - 200)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        self.alice = Party.objects.create(name='Alice')
+        start = datetime.date(2025, 1, 1)
+        # Four months of paid-up history per ledger, then an open tail.
+        for day in range(150):
+            date = start + datetime.timedelta(days=day)
+            for party in (None, self.alice):
+                ItemSold.objects.create(party=party, date=date, weight=1, price=10 + day % 7)
+                if day % 5 == 4 and day < 120:
+                    MoneyReceived.objects.create(party=party, date=date, amount=70)
+
+    def assert_settled_as_reference(self):
+        for party in (None, self.alice):
+            closed, settled, closed_value = reference_status(party)
+            live_closed = set(ItemSold.objects.filter(party=party, is_closed=True).values_list('pk', flat=True))
+            live_settled = set(MoneyReceived.objects.filter(party=party, is_settled=True).values_list('pk', flat=True))
+            self.assertEqual(live_closed, closed - set(ArchivedItemSold.objects.values_list('pk', flat=True)))
+            self.assertEqual(live_settled, settled - set(ArchivedMoneyReceived.objects.values_list('pk', flat=True)))
+            self.assertEqual(settlement.get_state(party and party.pk).closed_items_value, closed_value)
+
+    def test_archived_history_keeps_settlement_exact(self):
+        before = {party: settlement.get_state(party).closed_items_value for party in (None, self.alice.pk)}
+        stats = archive.archive(datetime.date(2026, 1, 1))
+        # Limited by the first open item, rounded down to its month.
+        self.assertEqual(stats.before, archive.cutoff())
+        self.assertEqual(stats.before.day, 1)
+        self.assertLess(stats.before, ItemSold.objects.filter(is_closed=False).earliest('date').date)
+        self.assertEqual(ArchivedItemSold.objects.count(), stats.items)
+        self.assertFalse(ItemSold.objects.filter(date__lt=stats.before).exists())
+        self.assertFalse(LedgerEntry.objects.filter(date__lt=stats.before).exists())
+        self.assertEqual(ArchivedPeriod.objects.aggregate(s=Sum('item_count'))['s'], stats.items)
+        for party_id, value in before.items():
+            self.assertEqual(settlement.get_state(party_id).closed_items_value, value)
+        self.assertEqual(str(archive.archive(datetime.date(2026, 1, 1))), 'nothing to archive')
+
+        # New money keeps closing items from where the archive left off,
+        # incrementally and in a full pass alike.
+        MoneyReceived.objects.create(date=datetime.date(2025, 6, 1), amount=500)
+        MoneyReceived.objects.create(party=self.alice, date=datetime.date(2025, 6, 1), amount=900)
+        self.assert_settled_as_reference()
+        settlement.settle_all(full=True)
+        self.assert_settled_as_reference()
+        ledger.rebuild()
+        for party_id in settlement.ledger_ids():
+            self.assertEqual(settlement.settle(party_id=party_id).rows_updated, 0)
+
+    def test_pages_read_the_archive_only_when_needed(self):
+        totals = {'sold': ItemSold.objects.aggregate(s=Sum('total'))['s'],
+                  'received': MoneyReceived.objects.aggregate(s=Sum('amount'))['s']}
+        stats = archive.archive(datetime.date(2026, 1, 1))
+
+        for params in ({}, {'min_amount': 1}, {'party': self.alice.pk, 'end_date': '2025-12-31'}):
+            context = self.client.get(reverse('sales:index'), params).context
+            if 'party' not in params:
+                self.assertEqual((context['total_sold'], context['total_received']),
+                                 (totals['sold'], totals['received']))
+
+        response = self.client.get(reverse('sales:item_sold'), {'per_page': 200})
+        self.assertEqual(response.context['total_sold'], totals['sold'])
+        rows = list(response.context['page'])
+        self.assertTrue(rows[-1].archived)
+        self.assertEqual(rows, sorted(rows, key=lambda row: (row.date, -row.pk), reverse=True))
+        # Walking back from the oldest live row continues into the archive.
+        last_live = ItemSold.objects.order_by('date', '-id').first()
+        older = self.client.get(reverse('sales:item_sold'), {'after': f'{last_live.date.isoformat()}_{last_live.pk}'})
+        self.assertTrue(older.context['page'].rows)
+        self.assertTrue(all(row.archived for row in older.context['page']))
+        first = older.context['page'].rows[0]
+        newer = self.client.get(reverse('sales:item_sold'), {'before': f'{first.date.isoformat()}_{first.pk}'})
+        self.assertEqual(list(newer.context['page'])[-1], last_live)
+
+        live_only = {'start_date': stats.before.isoformat()}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('sales:money_received'), live_only)
+        self.assertFalse(any('sales_archived' in query['sql'] for query in queries))
+
+        lines = b''.join(self.client.get(reverse('sales:export_items')).streaming_content).decode().splitlines()
+        self.assertEqual(len(lines) - 1, ItemSold.objects.count() + stats.items)
+        # The PDF report covers the whole history.
+        dates = [row['date'] for batch in reports._batches(reports.history(ItemSold), ('date',)) for row in batch]
+        self.assertEqual(len(dates), len(lines) - 1)
+        self.assertEqual(dates, sorted(dates))
+
+    async def test_async_pages_include_the_archive(self):
+        await sync_to_async(archive.archive)(datetime.date(2026, 1, 1))
+        total = await sync_to_async(lambda: sum(model.objects.aggregate(s=Sum('total'))['s']
+                                                for model in (ArchivedItemSold, ItemSold)))()
+        response = await self.async_client.get(reverse('sales_async:item_sold'))
+        self.assertEqual(response.context['total_sold'], total)
+        response = await self.async_client.get(reverse('sales_async:index'), {'min_amount': 1, 'due_days': 30,
+                                                                              'show_closed': 'on'})
+        self.assertEqual(response.context['total_sold'], total)
+        self.assertTrue(response.context['filtered_items'][0].archived)
+
+    def test_archived_dates_are_frozen(self):
+        stats = archive.archive(datetime.date(2026, 1, 1))
+        old_day = stats.before - datetime.timedelta(days=3)
+        summary = DailySummary.objects.get(date=old_day)
+        rollup.refresh_range()
+        self.assertEqual(DailySummary.objects.get(date=old_day).sold, summary.sold)
+
+        form = ItemSoldForm(data={'date': old_day, 'weight': 1, 'price': 10})
+        self.assertIn('date', form.errors)
+        self.assertTrue(ItemSoldForm(data={'date': stats.before, 'weight': 1, 'price': 10}).is_valid())
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 1), amount=250)
+
+    def test_form_posts_are_settled_in_one_deferred_pass(self):
+        for day in range(1, 4):
+            response = self.client.post(reverse('sales:item_sold'), {'date': f'2026-01-0{day}', 'weight': 1, 'price': 100})
+            self.assertEqual(response.status_code, 302)
+        self.assertFalse(ItemSold.objects.filter(is_closed=True).exists())
+        self.assertTrue(self.client.get(reverse('sales:index')).context['settlement_pending'])
+        self.assertContains(self.client.get(reverse('sales:item_sold')), 'Settlement pending')
+
+        with mock.patch.object(settlement, 'settle', wraps=settlement.settle) as settle:
+            self.assertEqual(scheduler.flush(), 2)
+        self.assertEqual(settle.call_count, 1)
+        closed, settled, _ = reference_status()
+        self.assertEqual(set(ItemSold.objects.filter(is_closed=True).values_list('pk', flat=True)), closed)
+        self.assertFalse(self.client.get(reverse('sales:index')).context['settlement_pending'])
+        self.assertEqual(scheduler.flush(), 0)
+
+        # Deleting through the view is deferred too; the export settles first.
+        item = ItemSold.objects.filter(is_closed=True).first()
+        self.client.get(reverse('sales:delete_item', args=[item.pk]))
+        self.assertTrue(scheduler.pending())
+        lines = b''.join(self.client.get(reverse('sales:export_items')).streaming_content).decode().splitlines()
+        self.assertFalse(scheduler.pending())
+        self.assertEqual([line.split(',')[-1] for line in lines[1:]], ['True', 'True'])
+
+    def test_writes_within_the_window_share_one_timer(self):
+        with mock.patch.object(scheduler.threading, 'Timer') as timer:
+            with self.captureOnCommitCallbacks(execute=True):
+                with scheduler.deferred():
+                    for day in range(1, 4):
+                        ItemSold.objects.create(date=datetime.date(2026, 1, day), weight=1, price=100)
+        timer.assert_called_once_with(settings.SALES_SETTLEMENT_DEBOUNCE, scheduler._background)
+        scheduler.flush()
+        timer.return_value.cancel.assert_called_once()
+        # Outside deferred(), a write settles on the spot.
+        ItemSold.objects.create(date=datetime.date(2026, 1, 4), weight=1, price=10)
+        self.assertFalse(scheduler.pending())
+
+    def test_dirty_ledgers_left_by_another_process_get_a_pass(self):
+        # Marked dirty, but the timer that was to settle it is gone.
+        settlement.mark_dirty(settlement.ITEMS, datetime.date(2026, 1, 1))
+        with mock.patch.object(scheduler.threading, 'Timer') as timer:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(self.client.get(reverse('sales:index')).context['settlement_pending'])
+        timer.assert_called_once_with(settings.SALES_SETTLEMENT_DEBOUNCE, scheduler._background)
+        scheduler.flush()
+        self.assertFalse(scheduler.pending())
+
+
+class IndexUsageTests(TestCase):
+    # Keeps the dashboard/list query shapes on the composite indexes. If a
+    # query change makes SQLite fall back to a table scan, these fail.
+
+    def plan_for(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        sql = queries[-1]['sql']
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, run, index):
+        plan = self.plan_for(run)
+        self.assertTrue(any(index in step for step in plan), plan)
+        for step in plan:
+            if step.startswith('SCAN sales_'):
+                self.assertIn('USING', step, plan)
+
+    def test_item_sold_queries(self):
+        start, end = datetime.date(2026, 1, 1), datetime.date(2026, 3, 31)
+        items = ItemSold.objects.filter(date__gte=start, date__lte=end)
+        index = 'item_date_closed_total_idx'
+        self.assertUsesIndex(lambda: items.aggregate(Sum('total')), index)
+        self.assertUsesIndex(lambda: items.filter(is_closed=False).aggregate(Sum('total')), index)
+        self.assertUsesIndex(lambda: items.filter(total__gte=100).aggregate(Sum('total')), index)
+        self.assertUsesIndex(lambda: list(items.order_by('-date', 'id')[:50]), index)
+
+    def test_party_queries(self):
+        party = Party.objects.create(name='Alice')
+        items = ItemSold.objects.filter(party=party, date__gte=datetime.date(2026, 1, 1))
+        self.assertUsesIndex(lambda: items.filter(is_closed=False).aggregate(Sum('total')), 'item_party_date_idx')
+        money = MoneyReceived.objects.filter(party=party, date__gte=datetime.date(2026, 1, 1))
+        self.assertUsesIndex(lambda: money.aggregate(Sum('amount')), 'money_party_date_idx')
+
+    def test_money_received_queries(self):
+        start, end = datetime.date(2026, 1, 1), datetime.date(2026, 3, 31)
+        money = MoneyReceived.objects.filter(date__gte=start, date__lte=end)
+        index = 'money_date_settled_amt_idx'
+        self.assertUsesIndex(lambda: money.aggregate(Sum('amount')), index)
+        self.assertUsesIndex(lambda: money.filter(is_settled=False).aggregate(Sum('amount')), index)
+        self.assertUsesIndex(lambda: list(money.order_by('-date', '-id')[:50]), index)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        today = datetime.date.today()
+        for days_ago, weight, price in [(40, 2, 500), (30, 1, 700), (20, 3, 100), (2, 1, 250)]:
+            ItemSold.objects.create(date=today - datetime.timedelta(days=days_ago), weight=weight, price=price)
+        for days_ago, amount in [(35, 900), (20, 400), (2, 50)]:
+            MoneyReceived.objects.create(date=today - datetime.timedelta(days=days_ago), amount=amount)
+        settlement.get_state()
+
+    def test_summary_matches_per_table_aggregates(self):
+        response = self.client.get(reverse('sales:index'), {'due_days': 15})
+        context = response.context
+        cutoff = datetime.date.today() - datetime.timedelta(days=15)
+        open_due = ItemSold.objects.filter(date__lte=cutoff, is_closed=False)
+        state = settlement.get_state()
+
+        self.assertEqual(context['total_received'], MoneyReceived.objects.aggregate(s=Sum('amount'))['s'])
+        self.assertEqual(context['total_sold'], ItemSold.objects.aggregate(s=Sum('total'))['s'])
+        self.assertEqual(context['filtered_total'], open_due.aggregate(s=Sum('total'))['s'])
+        self.assertEqual(context['unused_money'], Decimal(1350) - state.closed_items_value)
+        self.assertEqual(context['filtered_balance'], context['filtered_total'] - context['unused_money'])
+        self.assertEqual(list(context['filtered_items']), list(open_due.order_by('date')))
+
+    def test_chart_series_are_merged_by_date(self):
+        labels, received, sold = dashboard.daily_series(MoneyReceived.objects.all(), ItemSold.objects.all())
+        self.assertEqual(labels, sorted(labels))
+        self.assertEqual(len(labels), 5)
+        day = (datetime.date.today() - datetime.timedelta(days=20)).strftime('%Y-%m-%d')
+        position = labels.index(day)
+        self.assertEqual((received[position], sold[position]), (400.0, 300.0))
+
+    def test_query_count_is_fixed(self):
+        # Date-only filters: watermark + rollup totals + due items + unused
+        # money + the pending-settlement check + the party choices
+        with self.assertNumQueries(6):
+            self.client.get(reverse('sales:index'), {'due_days': 15})
+        with self.assertNumQueries(4):
+            self.client.get(reverse('sales:index'))
+        for _ in range(20):
+            ItemSold.objects.create(date=datetime.date.today(), weight=1, price=1)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('sales:index'), {'due_days': 15, 'start_date': '2020-01-01'})
+        # Amount filters: the totals come from the ledger snapshot, built
+        # once per data version
+        snapshot.current()
+        with self.assertNumQueries(5):
+            self.client.get(reverse('sales:index'), {'due_days': 15, 'min_amount': 1})
+
+    def test_chart_url_keeps_every_filter(self):
+        response = self.client.get(reverse('sales:index'), {'start_date': '2026-01-01', 'end_date': '2026-02-01'})
+        match = re.search(r'<script id="chart-url" type="application/json">(.*?)</script>', response.content.decode())
+        url = json.loads(match.group(1))
+        self.assertEqual(url, reverse('sales:api_chart') + '?start_date=2026-01-01&end_date=2026-02-01')
+        self.assertEqual(QueryDict(url.split('?')[1]).getlist('end_date'), ['2026-02-01'])
+
+    def test_amount_filters_use_raw_rows(self):
+        response = self.client.get(reverse('sales:index'), {'min_amount': 600})
+        self.assertEqual(response.context['total_sold'], 1700)
+        self.assertEqual(response.context['total_received'], 900)
+        chart = self.client.get(reverse('sales:api_chart'), {'min_amount': 600}).json()
+        self.assertEqual(len(chart['labels']), 3)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.party = Party.objects.create(name='Acme')
+        rng = random.Random(5)
+        start = datetime.date(2024, 1, 1)
+        for n in range(60):
+            party = self.party if n % 3 == 0 else None
+            ItemSold.objects.create(date=start + datetime.timedelta(days=rng.randint(0, 40)), party=party,
+                                    weight=Decimal(rng.randint(1, 4000)) / 1000, price=rng.choice([45, 90, 120]))
+            if n % 2 == 0:
+                MoneyReceived.objects.create(date=start + datetime.timedelta(days=rng.randint(0, 40)), party=party,
+                                             amount=Decimal(rng.randint(1000, 150000)) / 1000)
+        settlement.settle_all()
+
+    def test_sums_match_the_orm(self):
+        filters = [{}, {'party': self.party}, {'start_date': datetime.date(2024, 1, 10)},
+                   {'start_date': datetime.date(2024, 1, 5), 'end_date': datetime.date(2024, 1, 20), 'min_amount': 50},
+                   {'party': self.party, 'max_amount': Decimal('150.5')}]
+        current = snapshot.current()
+        for cleaned_data in filters:
+            for kind, (model, field, flag) in snapshot.KINDS.items():
+                rows = dashboard.filtered_querysets(dict(cleaned_data))[kind == ledger.ITEM]
+                expected = (rows.aggregate(s=Sum(field))['s'] or 0,
+                            rows.filter(**{flag: False}).aggregate(s=Sum(field))['s'] or 0)
+                self.assertEqual(current.sums(kind, cleaned_data), expected, (kind, cleaned_data))
+            money, items = dashboard.filtered_querysets(dict(cleaned_data))
+            # SQLite sums the daily values as floats.
+            expected = [(day, round(float(received), 3), round(float(sold), 3))
+                        for day, received, sold in dashboard.daily_rows(money, items)]
+            actual = [(day, float(received), float(sold)) for day, received, sold in current.daily_rows(cleaned_data)]
+            self.assertEqual(actual, expected, cleaned_data)
+
+    def test_rebuilt_after_a_write(self):
+        before = snapshot.current()
+        self.assertGreater(snapshot.stats()['bytes'], 0)
+        self.assertIs(snapshot.current(), before)
+        ItemSold.objects.create(date=datetime.date(2024, 3, 1), weight=1, price=10)
+        after = snapshot.current()
+        self.assertIsNot(after, before)
+        self.assertEqual(after.sums(ledger.ITEM, {'start_date': datetime.date(2024, 3, 1)})[0], 10)
+        self.assertEqual(snapshot.stats()['items'], 61)
+
+    def test_lists_use_it_only_for_row_filters(self):
+        view_cache.clear()
+        snapshot.invalidate()
+        response = self.client.get(reverse('sales:item_sold'), {'start_date': '2024-01-10'})
+        self.assertIsNone(snapshot.stats()['version'])
+        expected = ItemSold.objects.filter(date__gte=datetime.date(2024, 1, 10)).aggregate(s=Sum('total'))['s']
+        self.assertEqual(response.context['total_sold'], expected)
+
+        response = self.client.get(reverse('sales:item_sold'), {'party': self.party.pk})
+        self.assertEqual(snapshot.stats()['version'], settlement.data_version())
+        self.assertEqual(response.context['total_sold'],
+                         ItemSold.objects.filter(party=self.party).aggregate(s=Sum('total'))['s'])
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime.date(2024, 1, 1)
+        for n in range(400):
+            ItemSold.objects.create(date=start + datetime.timedelta(days=n), weight=1, price=10)
+        MoneyReceived.objects.create(date=start, amount=25)
+
+    def setUp(self):
+        view_cache.clear()
+        snapshot.invalidate()
+
+    def test_chart_is_bucketed_by_range(self):
+        url = reverse('sales:api_chart')
+        short = self.client.get(url, {'end_date': '2024-01-31'}).json()
+        self.assertEqual((short['period'], len(short['labels'])), ('day', 31))
+        whole = self.client.get(url).json()
+        self.assertEqual(whole['period'], 'week')
+        self.assertLessEqual(len(whole['labels']), 120)
+        self.assertEqual(sum(whole['sold']), 4000.0)
+        # Amount filters bucket the raw rows the same way.
+        filtered = self.client.get(url, {'min_amount': 1}).json()
+        self.assertEqual(filtered, whole)
+        monthly = self.client.get(url, {'period': 'month'}).json()
+        self.assertEqual(monthly['labels'][:2], ['2024-01-01', '2024-02-01'])
+
+    def test_etag_revalidation(self):
+        url = reverse('sales:api_summary')
+        response = self.client.get(url)
+        self.assertEqual(Decimal(response.json()['total_sold']), 4000)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        MoneyReceived.objects.create(date=datetime.date(2024, 2, 1), amount=5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_items_are_columnar_and_paginated(self):
+        data = self.client.get(reverse('sales:api_items'), {'per_page': 25, 'start_date': '2025-01-01'}).json()
+        self.assertEqual(len(data['id']), 25)
+        self.assertEqual(data['date'][0], '2025-02-03')
+        self.assertEqual(set(data), set(api.ITEM_COLUMNS) | {'next', 'previous'})
+        following = self.client.get(reverse('sales:api_items') + '?' + data['next']).json()
+        self.assertEqual(len(following['id']), 9)
+        self.assertIsNone(following['next'])
+
+
+class ViewCacheTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=100)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 2), amount=40)
+
+    def test_repeat_view_is_one_query_until_data_changes(self):
+        self.client.get(reverse('sales:index'))
+        # The version lookup, plus the party choices in the filter form.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('sales:index'))
+        self.assertEqual(response.context['total_sold'], 100)
+        self.assertEqual(view_cache.stats()['hits'], 1)
+
+        ItemSold.objects.create(date=datetime.date(2026, 1, 3), weight=1, price=50)
+        response = self.client.get(reverse('sales:index'))
+        self.assertEqual(response.context['total_sold'], 150)
+        self.assertEqual(view_cache.stats()['misses'], 2)
+
+    def test_list_pages_are_cached_per_filter_and_page(self):
+        url = reverse('sales:item_sold')
+        self.client.get(url, {'min_amount': '10'})
+        # The version lookup, plus the party choices of the two forms.
+        with self.assertNumQueries(3):
+            self.client.get(url, {'min_amount': '10.00'})
+        self.client.get(url, {'min_amount': '10', 'per_page': 25})
+        self.assertEqual(view_cache.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3})
+
+    def test_equivalent_filters_share_a_key(self):
+        self.assertEqual(
+            view_cache.cache_key('index', {'min_amount': Decimal('10'), 'end_date': None}, 3),
+            view_cache.cache_key('index', {'min_amount': Decimal('10.00')}, 3),
+        )
+        self.assertNotEqual(view_cache.cache_key('index', {}, 3), view_cache.cache_key('index', {}, 4))
+
+    def test_cached_page_links_carry_only_the_filters(self):
+        url = reverse('sales:item_sold')
+        ItemSold.objects.create(date=datetime.date(2026, 1, 4), weight=1, price=60)
+        with self.settings(SALES_PAGE_SIZES=[1], SALES_DEFAULT_PAGE_SIZE=1):
+            self.client.get(url, {'min_amount': '10.00', 'utm_source': 'mail'})
+            page = self.client.get(url, {'min_amount': '10'}).context['page']
+        self.assertEqual(view_cache.stats()['hits'], 1)
+        self.assertEqual(set(QueryDict(page.next_query)), {'min_amount', 'after', 'per_page'})
+
+    def test_settling_moves_the_version_past_pages_cached_while_dirty(self):
+        settlement.mark_dirty(settlement.ITEMS, datetime.date(2026, 1, 1))
+        dirty_version = settlement.data_version()
+        settlement.settle()
+        self.assertGreater(settlement.data_version(), dirty_version)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        for days_ago, price in [(40, 500), (30, 700), (2, 250)]:
+            ItemSold.objects.create(date=today - datetime.timedelta(days=days_ago), weight=1, price=price)
+        MoneyReceived.objects.create(date=today - datetime.timedelta(days=35), amount=900)
+
+    def setUp(self):
+        view_cache.clear()
+        snapshot.invalidate()
+
+    async def test_async_pages_match_sync_pages(self):
+        keys = ['total_received', 'total_sold', 'balance', 'filtered_total', 'filtered_balance', 'unused_money']
+        for query in ({'due_days': 15}, {'due_days': 15, 'min_amount': 300}):
+            sync = await sync_to_async(self.client.get)(reverse('sales:index'), query)
+            # Both share the 'index' cache entry; make the async path compute its own.
+            view_cache.clear()
+            response = await self.async_client.get(reverse('sales_async:index'), query)
+            self.assertEqual({k: response.context[k] for k in keys}, {k: sync.context[k] for k in keys})
+            self.assertEqual(response.context['filtered_items'], sync.context['filtered_items'])
+
+        response = await self.async_client.get(reverse('sales_async:item_sold'), {'per_page': 25})
+        self.assertEqual((response.context['total_sold'], response.context['open_sales']), (1450, 950))
+        self.assertEqual(len(response.context['items']), 3)
+        response = await self.async_client.get(reverse('sales_async:money_received'))
+        self.assertEqual(response.context['total_received'], 900)
+
+    async def test_async_form_post_saves_and_settles(self):
+        response = await self.async_client.post(reverse('sales_async:money_received'),
+                                                {'date': '2026-01-01', 'amount': '300'})
+        self.assertEqual(response.status_code, 302)
+        # Settlement is left to the scheduler's pass.
+        response = await self.async_client.get(reverse('sales_async:money_received'))
+        self.assertTrue(response.context['settlement_pending'])
+        await sync_to_async(scheduler.flush)()
+        state = await sync_to_async(settlement.get_state)()
+        self.assertEqual(state.total_received, 1200)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        view_cache.clear()
+
+    def test_requests_sql_and_settlement_are_exported(self):
+        ItemSold.objects.create(date=datetime.date(2026, 1, 1), weight=1, price=10)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 2), amount=10)
+        self.assertEqual(metrics.SETTLEMENT_ROWS.value(), 2)  # one item closed, one payment settled
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('sales:index'), {'due_days': 0})
+        self.assertEqual(metrics.REQUEST_SECONDS.count(view='sales:index', method='GET'), 1)
+        self.assertEqual(metrics.SQL_QUERIES.value(view='sales:index'), len(queries))
+        self.assertEqual(metrics.SECTION_SECONDS.count(section='dashboard_summary'), 1)
+
+        text = self.client.get(reverse('sales:metrics')).content.decode()
+        self.assertIn('# TYPE sales_request_seconds histogram', text)
+        self.assertIn('sales_request_seconds_count{view="sales:index",method="GET"} 1', text)
+        self.assertIn('sales_request_queries_bucket{view="sales:index",le="5"} 1', text)
+        self.assertIn('sales_settlement_rows_total 2', text)
+
+    def test_slow_requests_are_logged_with_breakdown(self):
+        with self.settings(SALES_SLOW_REQUEST_SECONDS=0):
+            with self.assertLogs('sales.middleware', 'WARNING') as logs:
+                self.client.get(reverse('sales:item_sold'))
+        self.assertIn('sales:item_sold', logs.output[0])
+        self.assertIn('queries in', logs.output[0])
+        self.assertIn('list_query', logs.output[0])
+
+    async def test_async_stack_stays_async(self):
+        for middleware in (MetricsMiddleware, MaintenanceMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(async_views.index)))
+        await self.async_client.get(reverse('sales_async:item_sold'))
+        self.assertEqual(metrics.REQUEST_SECONDS.count(view='sales_async:item_sold', method='GET'), 1)
+        self.assertGreater(metrics.SQL_QUERIES.value(view='sales_async:item_sold'), 0)
+
+
+class RollupTests(TestCase):
+    def assertRollupMatchesSource(self):
+        expected = {}
+        for date, total, weight, closed in ItemSold.objects.values_list('date', 'total', 'weight', 'is_closed'):
+            row = expected.setdefault(date, [Decimal(0), Decimal(0), Decimal(0), 0, Decimal(0)])
+            row[1] += total
+            row[2] += weight
+            row[3] += 1
+            row[4] += 0 if closed else total
+        for date, amount in MoneyReceived.objects.values_list('date', 'amount'):
+            expected.setdefault(date, [Decimal(0), Decimal(0), Decimal(0), 0, Decimal(0)])[0] += amount
+        actual = {
+            s.date: [s.received, s.sold, s.weight, s.item_count, s.open_value]
+            for s in DailySummary.objects.all()
+        }
+        self.assertEqual(actual, expected)
+
+    def test_rollups_follow_writes_and_settlement(self):
+        rng = random.Random(3)
+        start = datetime.date(2025, 6, 1)
+        for _ in range(60):
+            day = start + datetime.timedelta(days=rng.randint(0, 40))
+            choice = rng.random()
+            if choice < 0.45:
+                ItemSold.objects.create(date=day, weight=rng.randint(1, 9), price=rng.randint(5, 50))
+            elif choice < 0.8:
+                MoneyReceived.objects.create(date=day, amount=rng.randint(10, 400))
+            else:
+                row = rng.choice([ItemSold, MoneyReceived]).objects.order_by('?').first()
+                if row and choice < 0.9:
+                    row.date = day
+                    row.save()
+                elif row:
+                    row.delete()
+            self.assertRollupMatchesSource()
+
+        DailySummary.objects.all().delete()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertRollupMatchesSource()
+
+    def test_weekly_and_monthly_series(self):
+        ItemSold.objects.create(date=datetime.date(2026, 1, 5), weight=1, price=10)
+        ItemSold.objects.create(date=datetime.date(2026, 1, 7), weight=1, price=20)
+        ItemSold.objects.create(date=datetime.date(2026, 2, 2), weight=1, price=40)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 6), amount=5)
+
+        weekly = rollup.series(period=rollup.WEEK)
+        self.assertEqual([(d, r, s) for d, r, s in weekly],
+                         [(datetime.date(2026, 1, 5), 5, 30), (datetime.date(2026, 2, 2), 0, 40)])
+        monthly = rollup.series(period=rollup.MONTH)
+        self.assertEqual([s for _, _, s in monthly], [30, 40])
+
+
+class ImportTests(TestCase):
+    CSV = (
+        'kind,date,weight,price,amount\n'
+        'item,2026-01-03,2,100,\n'
+        'money,2026-01-01,,,150\n'
+        'item,2026-01-01,1,50,\n'
+        'money,2026-01-02,,,70\n'
+        'item,2026-01-02,1.5,40,\n'
+    )
+
+    def import_file(self, content, suffix='.csv', *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_sales', f.name, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_import_derives_ledger_rollups_and_flags_once(self):
+        version = settlement.data_version()
+        with CaptureQueriesContext(connection) as queries:
+            output = self.import_file(self.CSV, '.csv', '--batch-size', '2')
+        self.assertIn('3 items, 2 receipts', output)
+        self.assertIn('rows/s', output)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "sales_itemsold"')]
+        self.assertEqual(len(inserts), 2)
+
+        self.assertEqual(ItemSold.objects.get(date=datetime.date(2026, 1, 2)).total, 60)
+        closed, settled, closed_value = reference_status()
+        self.assertEqual(set(ItemSold.objects.filter(is_closed=True).values_list('pk', flat=True)), closed)
+        self.assertEqual(set(MoneyReceived.objects.filter(is_settled=True).values_list('pk', flat=True)), settled)
+        self.assertEqual(LedgerEntry.objects.count(), 5)
+        self.assertEqual(rollup.totals()['total_sold'], 310)
+        self.assertEqual(rollup.totals()['total_open'],
+                         ItemSold.objects.filter(is_closed=False).aggregate(s=Sum('total'))['s'])
+        self.assertGreater(settlement.data_version(), version)
+
+    def test_import_rewrites_the_ledger_only_from_its_first_date(self):
+        for day in range(1, 6):
+            ItemSold.objects.create(date=datetime.date(2025, 12, day), weight=1, price=10)
+        earlier = list(LedgerEntry.objects.order_by('pk').values_list('pk', 'cumulative'))
+
+        self.import_file(self.CSV, '.csv')
+
+        self.assertEqual(list(LedgerEntry.objects.filter(date__lt=datetime.date(2026, 1, 1))
+                              .order_by('pk').values_list('pk', 'cumulative')), earlier)
+        self.assertEqual(ledger.total(ledger.ITEM), ledger.to_units(50 + 310))
+        self.assertTrue(ledger.complete())
+
+    def test_invalid_row_aborts_whole_import(self):
+        content = self.CSV + 'item,not-a-date,1,1,\n'
+        with self.assertRaisesMessage(CommandError, 'line 7'):
+            self.import_file(content)
+        self.assertFalse(ItemSold.objects.exists())
+
+        output = self.import_file(content, '.csv', '--skip-invalid')
+        self.assertIn('1 skipped', output)
+        self.assertEqual(ItemSold.objects.count(), 3)
+
+    def test_upload_view_accepts_jsonl(self):
+        lines = [{'date': '2026-02-01', 'amount': 10}, {'date': '2026-02-02', 'amount': '2.5'}]
+        upload = SimpleUploadedFile('receipts.jsonl', '\n'.join(json.dumps(l) for l in lines).encode())
+        response = self.client.post(reverse('sales:import_data'), {'file': upload, 'kind': 'money'})
+        self.assertEqual(response.context['stats'].money, 2)
+        self.assertEqual(MoneyReceived.objects.aggregate(s=Sum('amount'))['s'], Decimal('12.5'))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        for day, price in [(1, 10), (2, 700), (3, 20)]:
+            ItemSold.objects.create(date=datetime.date(2026, 3, day), weight=1, price=price)
+        MoneyReceived.objects.create(date=datetime.date(2026, 3, 1), amount=15)
+
+    def test_csv_is_streamed_with_list_filters(self):
+        response = self.client.get(reverse('sales:export_items'), {'max_amount': 100, 'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="items_sold_', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['Date', 'Weight (kg)', 'Price (per unit)', 'Total (Rupees)', 'Closed'])
+        self.assertEqual([(row[0], row[3], row[4]) for row in rows[1:]],
+                         [('2026-03-01', '10.00', 'True'), ('2026-03-03', '20.00', 'False')])
+
+        money = self.client.get(reverse('sales:export_money'))
+        self.assertEqual(b''.join(money.streaming_content).decode().splitlines()[1], '2026-03-01,15.000,False')
+
+    @skipIf(export.openpyxl is None, 'openpyxl is not installed')
+    def test_xlsx_export(self):
+        response = self.client.get(reverse('sales:export_items'), {'format': 'xlsx', 'start_date': '2026-03-02'})
+        workbook = export.openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.values)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][3], 700)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        view_cache.clear()
+        start = datetime.date(2026, 1, 1)
+        for n in range(23):
+            # Several rows share a date so the id tie-break is exercised.
+            ItemSold.objects.create(date=start + datetime.timedelta(days=n // 3), weight=1, price=n + 1)
+        self.expected = list(ItemSold.objects.order_by('-date', 'id').values_list('pk', flat=True))
+
+    def get_page(self, query):
+        with self.settings(SALES_PAGE_SIZES=[5, 50], SALES_DEFAULT_PAGE_SIZE=5):
+            return self.client.get(reverse('sales:item_sold'), QueryDict(query)).context['page']
+
+    def test_forward_and_backward_cover_every_row_once(self):
+        page = self.get_page('')
+        self.assertFalse(page.has_previous)
+        forward = [row.pk for row in page]
+        while page.has_next:
+            page = self.get_page(page.next_query)
+            forward.extend(row.pk for row in page)
+        self.assertEqual(forward, self.expected)
+
+        backward = [row.pk for row in page]
+        while page.has_previous:
+            page = self.get_page(page.previous_query)
+            backward[:0] = [row.pk for row in page]
+        self.assertEqual(backward, self.expected)
+
+    def test_page_size_is_limited_to_configured_sizes(self):
+        self.assertEqual(len(self.get_page('per_page=50')), 23)
+        self.assertEqual(len(self.get_page('per_page=7')), 5)
+
+    def test_totals_cover_whole_filtered_set(self):
+        with self.settings(SALES_PAGE_SIZES=[5], SALES_DEFAULT_PAGE_SIZE=5):
+            response = self.client.get(reverse('sales:item_sold'))
+        self.assertEqual(len(response.context['page']), 5)
+        self.assertEqual(response.context['total_sold'], sum(range(1, 24)))
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class PdfReportTests(TestCase):
+    def setUp(self):
+        report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(report_dir.cleanup)
+        override = self.settings(SALES_REPORT_DIR=report_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(jobs, '_executor', return_value=InlineExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(jobs._jobs.clear)
+        # The worker closes its connection when done; keep the test's open.
+        patcher = mock.patch.object(jobs, 'connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for n in range(7):
+            ItemSold.objects.create(date=datetime.date(2026, 1, 1 + n), weight=1, price=10)
+        MoneyReceived.objects.create(date=datetime.date(2026, 1, 1), amount=25)
+
+    def test_report_is_rendered_in_chunks(self):
+        with mock.patch.object(reports, 'CHUNK_ROWS', 3):
+            parts = list(reports.report_parts())
+            response = self.client.get(reverse('sales:pdf_report'))
+
+        self.assertEqual([(p['section'], len(p.get('rows', []))) for p in parts],
+                         [('money', 1), ('items', 3), ('items', 3), ('items', 1), ('summary', 0)])
+        self.assertEqual(parts[-1]['balance'], Decimal(45))
+        self.assertTrue(parts[-2]['last_chunk'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('Net Balance Summary', pdf.pages[-1].extract_text())
+
+    def test_chunks_flow_like_one_render(self):
+        for n in range(80):
+            ItemSold.objects.create(date=datetime.date(2026, 2, 1), weight=1, price=3)
+
+        def page_texts(chunk_rows):
+            output = io.BytesIO()
+            with mock.patch.object(reports, 'CHUNK_ROWS', chunk_rows):
+                reports.write_pdf(output)
+            return [page.extract_text() for page in PdfReader(io.BytesIO(output.getvalue())).pages]
+
+        # No page break between chunks or sections: the same pages as a
+        # single render, streamed out chunk by chunk.
+        whole = page_texts(1000)
+        self.assertGreater(len(whole), 2)
+        self.assertEqual(page_texts(20), whole)
+
+    def test_pages_that_overflow_their_cut_fail(self):
+        for n in range(80):
+            ItemSold.objects.create(date=datetime.date(2026, 2, 1), weight=1, price=3)
+        with mock.patch.object(reports, 'PAGE_LINES', 200):
+            with self.assertRaises(reports.ReportError):
+                reports.write_pdf(io.BytesIO())
+
+    def test_unchanged_data_is_served_from_cache(self):
+        with mock.patch.object(reports, 'write_pdf', wraps=reports.write_pdf) as write_pdf:
+            first = jobs.submit()
+            second = jobs.submit()
+            self.assertEqual(first.id, second.id)
+            self.assertEqual(write_pdf.call_count, 1)
+
+            status = self.client.get(reverse('sales:report_status', args=[first.id])).json()
+            self.assertEqual(status['status'], jobs.DONE)
+            download = self.client.get(status['download_url'])
+            self.assertEqual(download['Content-Type'], 'application/pdf')
+
+            MoneyReceived.objects.create(date=datetime.date(2026, 2, 1), amount=5)
+            third = jobs.submit()
+            self.assertNotEqual(third.id, first.id)
+            self.assertEqual(write_pdf.call_count, 2)
+
+    def test_report_is_made_again_on_a_new_day(self):
+        today = datetime.date(2026, 3, 1)
+        self.assertEqual(jobs.report_key({}, 7, today), jobs.report_key({}, 7, today))
+        self.assertNotEqual(jobs.report_key({}, 7, today), jobs.report_key({}, 7, today + datetime.timedelta(days=1)))
+
+    def pdf_text(self, render):
+        output = io.BytesIO()
+        render(output)
+        pdf = PdfReader(io.BytesIO(output.getvalue()))
+        return len(pdf.pages), '\n'.join(page.extract_text() for page in pdf.pages)
+
+    def test_native_engine_draws_the_same_report(self):
+        for n in range(150):
+            ItemSold.objects.create(date=datetime.date(2026, 2, 1), weight='1.25', price='3.33')
+        _, html = self.pdf_text(reports.write_pdf)
+        pages, native = self.pdf_text(pdf_canvas.write_pdf)
+        self.assertGreater(pages, 3)
+        for text in ('Sales Report', 'Money Received', 'Items Sold', 'Net Balance Summary',
+                     'Rs. 4.16', 'Rs. 694.00', 'Rs. 25.00', 'Rs. 669.00', 'Feb. 1, 2026'):
+            self.assertIn(text, html)
+            self.assertIn(text, native)
+        ids = ItemSold.objects.values_list('id', flat=True)
+        self.assertEqual(sum(native.split().count(str(pk)) > 0 for pk in ids), len(ids))
+
+    def test_engine_is_chosen_per_request(self):
+        with mock.patch.object(pdf_canvas, 'write_pdf', wraps=pdf_canvas.write_pdf) as native:
+            response = self.client.get(reverse('sales:pdf_report'), {'engine': 'native'})
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(native.call_count, 1)
+        self.assertNotEqual(jobs.submit({'engine': 'native'}).id, jobs.submit().id)
+        self.assertEqual(jobs.engine_for('bogus'), jobs.HTML)
+        with mock.patch.object(pdf_canvas, 'canvas', None):
+            self.assertEqual(jobs.engine_for(jobs.NATIVE), jobs.HTML)
+
+
+class BenchTests(TestCase):
+    def test_synthetic_ledger_has_an_open_tail(self):
+        self.assertEqual([bench.parse_size(v) for v in ('1k', '100k', '1M', '250')], [1000, 100000, 1000000, 250])
+        bench.generate(400, seed=1)
+        self.assertEqual((ItemSold.objects.count(), MoneyReceived.objects.count()), (300, 100))
+        self.assertEqual(LedgerEntry.objects.count(), 400)
+
+        result = bench.measure(lambda: settlement.settle(full=True))
+        self.assertGreater(result['queries'], 0)
+        self.assertIsNotNone(result['peak_kb'])
+        closed, settled, _ = reference_status()
+        self.assertEqual(set(ItemSold.objects.filter(is_closed=True).values_list('pk', flat=True)), closed)
+        self.assertTrue(closed and ItemSold.objects.filter(is_closed=False).exists())
+
+
+class OnlineBackupTests(TestCase):
+    def test_stepped_copy_is_checked_and_measured(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'live.sqlite3')
+            conn = sqlite3.connect(source)
+            conn.execute('CREATE TABLE t (v TEXT)')
+            conn.executemany('INSERT INTO t VALUES (?)', [('x' * 500,)] * 200)
+            conn.commit()
+            conn.close()
+
+            dest = os.path.join(directory, 'copy.sqlite3')
+            stats = backup.online_backup(source, dest, pages=5, pause=0)
+
+            self.assertEqual(stats.bytes, os.path.getsize(source))
+            self.assertGreater(stats.pages, 5)
+            self.assertGreaterEqual(stats.throughput, 0)
+            conn = sqlite3.connect(dest)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 200)
+            conn.close()
+
+    def test_corrupt_copy_is_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'live.sqlite3')
+            sqlite3.connect(source).close()
+            dest = os.path.join(directory, 'copy.sqlite3')
+            with mock.patch.object(backup, 'quick_check', return_value='*** in database main ***'):
+                with self.assertRaises(backup.BackupError):
+                    backup.online_backup(source, dest)
+            self.assertFalse(os.path.exists(dest))
+
+
+class SqliteProfileTests(TestCase):
+    def wal_database(self, path, value):
+        # A WAL database whose latest commit is still only in the -wal file.
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA wal_autocheckpoint = 0')
+        conn.execute('CREATE TABLE t (v TEXT)')
+        conn.execute('INSERT INTO t VALUES (?)', (value,))
+        conn.commit()
+        return conn
+
+    def test_pragmas_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], settings.SALES_SQLITE_PRAGMAS['cache_size'])
+
+    def test_backup_of_wal_database_is_self_contained(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'live.sqlite3')
+            writer = self.wal_database(source, 'in wal')
+            dest = os.path.join(directory, 'copy.sqlite3')
+            backup.online_backup(source, dest, pause=0)
+            writer.close()
+
+            self.assertEqual(os.listdir(directory).count('copy.sqlite3-wal'), 0)
+            conn = sqlite3.connect(dest)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            self.assertEqual(conn.execute('SELECT v FROM t').fetchone()[0], 'in wal')
+            conn.close()
+
+    def test_restore_drops_old_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            live = os.path.join(directory, 'live.sqlite3')
+            source = os.path.join(directory, 'backup.sqlite3')
+            old = self.wal_database(live, 'live')
+            conn = sqlite3.connect(source)
+            conn.execute('CREATE TABLE t (v TEXT)')
+            conn.execute('INSERT INTO t VALUES (?)', ('restored',))
+            conn.commit()
+            conn.close()
+
+            maintenance.atomic_restore(source, live)
+            self.assertFalse(any(os.path.exists(p) for p in db_profile.sidecar_paths(live)))
+            conn = sqlite3.connect(live)
+            self.assertEqual(conn.execute('SELECT v FROM t').fetchone()[0], 'restored')
+            conn.close()
+            old.close()
+
+
+class BackupStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = self.settings(SALES_BACKUP_STORE=os.path.join(self.directory, 'store'),
+                                 SALES_BACKUP_CHUNK_SIZE=4096)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.source = os.path.join(self.directory, 'live.sqlite3')
+        conn = sqlite3.connect(self.source)
+        conn.execute('CREATE TABLE t (v TEXT)')
+        conn.executemany('INSERT INTO t VALUES (?)', [(f'{n:05d}' * 100,) for n in range(300)])
+        conn.commit()
+        conn.close()
+
+    def test_unchanged_chunks_are_stored_once_and_snapshots_restore(self):
+        first = backup_store.create_snapshot('one', self.source)
+        conn = sqlite3.connect(self.source)
+        conn.execute("UPDATE t SET v = 'changed' WHERE rowid = 1")
+        conn.commit()
+        conn.close()
+        second = backup_store.create_snapshot('two', self.source)
+
+        self.assertGreater(first['stored_bytes'], 0)
+        self.assertLess(second['stored_bytes'], first['stored_bytes'] / 4)
+
+        rebuilt = os.path.join(self.directory, 'rebuilt.sqlite3')
+        backup_store.materialize('one', rebuilt)
+        conn = sqlite3.connect(rebuilt)
+        self.assertEqual(conn.execute('SELECT v FROM t WHERE rowid = 1').fetchone()[0], '00000' * 100)
+        conn.close()
+
+    def test_prune_removes_old_snapshots_and_orphan_chunks(self):
+        backup_store.create_snapshot('one', self.source)
+        conn = sqlite3.connect(self.source)
+        conn.execute("DELETE FROM t")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        backup_store.create_snapshot('two', self.source)
+
+        with mock.patch.object(backup_store, 'GC_GRACE_SECONDS', -60):
+            removed, swept = backup_store.prune(keep=1)
+
+        self.assertEqual(removed, 1)
+        self.assertGreater(swept, 0)
+        self.assertEqual([m['name'] for m in backup_store.list_snapshots()], ['two'])
+        backup_store.materialize('two', os.path.join(self.directory, 'rebuilt.sqlite3'))
+
+
+class AtomicRestoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.live = os.path.join(directory.name, 'live.sqlite3')
+        self.source = os.path.join(directory.name, 'backup.sqlite3')
+        for path, value in ((self.live, 'live'), (self.source, 'restored')):
+            conn = sqlite3.connect(path)
+            conn.execute('CREATE TABLE t (v TEXT)')
+            conn.execute('INSERT INTO t VALUES (?)', (value,))
+            conn.commit()
+            conn.close()
+
+    def test_file_is_swapped_and_flag_released(self):
+        stats, swap_seconds = maintenance.atomic_restore(self.source, self.live)
+
+        conn = sqlite3.connect(self.live)
+        self.assertEqual(conn.execute('SELECT v FROM t').fetchone()[0], 'restored')
+        conn.close()
+        self.assertFalse(os.path.exists(maintenance.flag_path(self.live)))
+        self.assertEqual(stats.bytes, os.path.getsize(self.live))
+        self.assertEqual([f for f in os.listdir(os.path.dirname(self.live)) if f.startswith('.restore_')], [])
+
+    def test_concurrent_restore_is_refused(self):
+        with maintenance.maintenance_window(self.live):
+            with self.assertRaises(maintenance.MaintenanceBusy):
+                maintenance.atomic_restore(self.source, self.live)
+        conn = sqlite3.connect(self.live)
+        self.assertEqual(conn.execute('SELECT v FROM t').fetchone()[0], 'live')
+        conn.close()
+
+    def test_requests_are_held_during_maintenance(self):
+        with self.settings(SALES_MAINTENANCE_WAIT=0):
+            with mock.patch.object(maintenance, 'active', return_value=True):
+                response = self.client.get(reverse('sales:index'))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '2')
+            self.assertEqual(self.client.get(reverse('sales:index')).status_code, 200)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'sales'
 
@@ -7,9 +7,19 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('money-received/', views.money_received, name='money_received'),
     path('item-sold/', views.item_sold, name='item_sold'),
+    path('money-received/export/', views.export_money, name='export_money'),
+    path('item-sold/export/', views.export_items, name='export_items'),
     path('delete-money/<int:pk>/', views.delete_money, name='delete_money'),
     path('delete-item/<int:pk>/', views.delete_item, name='delete_item'),
+    path('import/', views.import_data, name='import_data'),
     path('pdf-report/', views.pdf_report, name='pdf_report'),
+    path('pdf-report/<str:job_id>/status/', views.report_status, name='report_status'),
+    path('pdf-report/<str:job_id>/download/', views.report_download, name='report_download'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('api/chart/', api.chart, name='api_chart'),
+    path('api/summary/', api.summary, name='api_summary'),
+    path('api/items/', api.items, name='api_items'),
     path('backup/', views.backup_database, name='backup_database'),
     path('backups/', views.backup_list, name='backup_list'),
     path('restore/<str:filename>/', views.restore_backup, name='restore_backup'),
@@ -0,0 +1,91 @@
+"""
+Whole-table FIFO boundaries computed from the source columns.
+
+The incremental settlement seeks the boundaries in the running-balance
+ledger. A full pass instead recomputes them straight from ItemSold and
+MoneyReceived, so it does not trust a ledger that may be stale (e.g. in a
+restored file). Values are loaded as integer thousandths (the ledger's
+fixed-point units, exact for every DecimalField in the app), running totals
+are a ``cumsum`` and each boundary is a ``searchsorted`` on it.
+
+NumPy is optional. Without it the same computation runs in pure Python
+(``itertools.accumulate`` + ``bisect``), which also serves as the oracle in
+the tests.
+"""
+import bisect
+import itertools
+
+from django.db.models import BigIntegerField, F, Value
+from django.db.models.functions import Cast, Round
+
+from . import ledger
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+
+def units(model, field):
+    """``field`` of ``model`` as integer ledger units, computed in SQL."""
+    # Rounded to the field's decimal places first, as the ORM reads it back.
+    places = model._meta.get_field(field).decimal_places
+    return Cast(Round(Round(F(field), places) * Value(ledger.SCALE)), output_field=BigIntegerField())
+
+
+def _columns(kind, party_id=None):
+    """(ids, units) of ``kind`` in (date, id) order; the scaling happens in SQL."""
+    model, field = ledger.SOURCES[kind]
+    rows = model.objects.filter(party_id=party_id).order_by('date', 'id').values_list('id', units(model, field))
+    if np is not None:
+        data = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+        return data[:, 0], data[:, 1]
+    ids, values = [], []
+    for source_id, amount in rows.iterator(chunk_size=ledger.BATCH_SIZE):
+        ids.append(source_id)
+        values.append(amount)
+    return ids, values
+
+
+def _prefix(values, limit):
+    """(count, total) of the longest prefix of ``values`` whose sum is <= ``limit``."""
+    if np is not None:
+        cumulative = np.cumsum(values, dtype=np.int64)
+        count = int(np.searchsorted(cumulative, limit, side='right'))
+        return count, int(cumulative[count - 1]) if count else 0
+    cumulative = list(itertools.accumulate(values))
+    count = bisect.bisect_right(cumulative, limit)
+    return count, cumulative[count - 1] if count else 0
+
+
+def _cursor(kind, ids, count):
+    if not count:
+        return None
+    model = ledger.SOURCES[kind][0]
+    source_id = int(ids[count - 1])
+    return model.objects.filter(pk=source_id).values_list('date', flat=True).get(), source_id
+
+
+def boundaries(party_id=None, archived_sold=0, archived_received=0):
+    """
+    Return {'received', 'item', 'closed_value', 'money', 'settled_value'}
+    for one party's ledger: totals in units and the (date, id) cursors of the
+    last closed item and last settled payment (None when nothing qualifies).
+    The totals include the ledger's archived items and payments, given in
+    units, which precede every live row.
+    """
+    item_ids, item_units = _columns(ledger.ITEM, party_id)
+    money_ids, money_units = _columns(ledger.MONEY, party_id)
+    received = archived_received + (int(money_units.sum()) if np is not None else sum(money_units))
+
+    closed_count, live_closed = _prefix(item_units, received - archived_sold)
+    closed_value = archived_sold + live_closed
+    settled_count, live_settled = _prefix(money_units, closed_value - archived_received)
+    settled_value = archived_received + live_settled
+    return {
+        'received': received,
+        'item': _cursor(ledger.ITEM, item_ids, closed_count),
+        'closed_value': closed_value,
+        'money': _cursor(ledger.MONEY, money_ids, settled_count),
+        'settled_value': settled_value,
+    }
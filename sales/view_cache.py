@@ -0,0 +1,98 @@
+"""
+Per-data-version cache for computed view data.
+
+Dashboard and list pages are pure functions of the filter parameters and
+the data, so their computed context (totals, series, page rows) is cached
+under a key made of the view name, the normalized filter values and the
+current ``SettlementState.data_version``. Every write bumps the version,
+so entries never need explicit invalidation: stale ones are simply never
+asked for again and age out of the LRU. Rendered HTML is not cached
+because it carries per-request CSRF tokens.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Model
+
+HIT = 'hit'
+MISS = 'miss'
+
+_counters = {HIT: 0, MISS: 0}
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.SALES_VIEW_CACHE_ALIAS]
+
+
+def _normalize(value):
+    if isinstance(value, decimal.Decimal):
+        # 10, 10.0 and 10.00 are the same filter.
+        return format(value.normalize(), 'f')
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Model):
+        return value.pk
+    return value
+
+
+def cache_key(view_name, params, version):
+    """Key for ``view_name`` with ``params`` at data ``version``; empty filters are dropped."""
+    normalized = {key: _normalize(value) for key, value in params.items() if value not in (None, '')}
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:32]
+    return f'sales:{view_name}:v{version}:{digest}'
+
+
+def _count(outcome):
+    with _lock:
+        _counters[outcome] += 1
+
+
+def cached(view_name, params, version, build):
+    """Return the cached result of ``build()`` for this key, computing it on a miss."""
+    if not settings.SALES_VIEW_CACHE_TIMEOUT:
+        return build()
+    key = cache_key(view_name, params, version)
+    result = _cache().get(key)
+    if result is not None:
+        _count(HIT)
+        return result
+    _count(MISS)
+    result = build()
+    _cache().set(key, result, settings.SALES_VIEW_CACHE_TIMEOUT)
+    return result
+
+
+async def acached(view_name, params, version, build):
+    """``cached`` for async views; ``build`` is a coroutine function."""
+    if not settings.SALES_VIEW_CACHE_TIMEOUT:
+        return await build()
+    key = cache_key(view_name, params, version)
+    result = await _cache().aget(key)
+    if result is not None:
+        _count(HIT)
+        return result
+    _count(MISS)
+    result = await build()
+    await _cache().aset(key, result, settings.SALES_VIEW_CACHE_TIMEOUT)
+    return result
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    with _lock:
+        hits, misses = _counters[HIT], _counters[MISS]
+    lookups = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0}
+
+
+def clear():
+    _cache().clear()
+    with _lock:
+        _counters[HIT] = _counters[MISS] = 0
@@ -1,348 +1,275 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from .models import MoneyReceived, ItemSold
-from .forms import MoneyReceivedForm, ItemSoldForm, FilterForm
+from .forms import MoneyReceivedForm, ItemSoldForm, FilterForm, ImportForm
+from . import (backup_store, dashboard, export, importer, jobs, ledger, maintenance, metrics, scheduler, settlement,
+               snapshot, view_cache)
+from .pagination import PAGE_PARAMS, page_query, paginate
 from django.db.models import Sum
-from django.template.loader import render_to_string
-from django.http import HttpResponse
-from xhtml2pdf import pisa
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.urls import reverse
 import datetime
+import logging
 
-import json
-from django.core.serializers.json import DjangoJSONEncoder
-import shutil
 import os
+import tempfile
 import time
-from django.db import connections
 from django.conf import settings
 from django.contrib import messages
 
-def calculate_status():
-    # 1. Reset everything to False first (simplest way to ensure consistency on re-calc)
-    # Be careful with performance on large datasets, but for small scale this is fine.
-    # Ideally only re-calc from last changes, but for now full re-calc ensures correctness.
-    
-    # Get all items ordered by date
-    all_items = ItemSold.objects.all().order_by('date')
-    all_money = MoneyReceived.objects.all().order_by('date')
-    
-    total_money_received = all_money.aggregate(Sum('amount'))['amount__sum'] or 0
-    
-    # Mark Items as Closed based on Total Money
-    cumulative_sales = 0
-    closed_items_value = 0
-    
-    for item in all_items:
-        cumulative_sales += item.total
-        if cumulative_sales <= total_money_received:
-            if not item.is_closed:
-                item.is_closed = True
-                item.save()
-            closed_items_value += item.total
-        else:
-            if item.is_closed:
-                item.is_closed = False
-                item.save()
-                
-    # Mark Money as Settled based on Closed Items Value
-    # (Money is "settled" if it has been "used up" by closed items)
-    cumulative_money = 0
-    for money in all_money:
-        cumulative_money += money.amount
-        if cumulative_money <= closed_items_value:
-             if not money.is_settled:
-                money.is_settled = True
-                money.save()
-        else:
-            if money.is_settled:
-                money.is_settled = False
-                money.save()
-    
-    return closed_items_value
+logger = logging.getLogger(__name__)
 
 def index(request):
-    # Recalculate status before showing dashboard
-    closed_items_val = calculate_status()
-    
     # Filter Form
     filter_form = FilterForm(request.GET or None)
-    
-    # Base QuerySets (for charts and summary)
-    money_qs = MoneyReceived.objects.all()
-    sold_qs = ItemSold.objects.all()
-    
-    filtered_items = None
-    filtered_total = 0
-    filtered_balance = 0
-    unused_money = 0 # Initialize unused_money
-    
-    show_closed = False
-    
-    if filter_form.is_valid():
-        start_date = filter_form.cleaned_data.get('start_date')
-        end_date = filter_form.cleaned_data.get('end_date')
-        min_amount = filter_form.cleaned_data.get('min_amount')
-        max_amount = filter_form.cleaned_data.get('max_amount')
-        due_days = filter_form.cleaned_data.get('due_days')
-        show_closed = filter_form.cleaned_data.get('show_closed')
-        
-        # Apply filters to Base QS
-        if start_date:
-            money_qs = money_qs.filter(date__gte=start_date)
-            sold_qs = sold_qs.filter(date__gte=start_date)
-        if end_date:
-            money_qs = money_qs.filter(date__lte=end_date)
-            sold_qs = sold_qs.filter(date__lte=end_date)
-            
-        if min_amount:
-            # For Money, it's 'amount'. For Sold, it's 'total' (usually what user cares about for range)
-            money_qs = money_qs.filter(amount__gte=min_amount)
-            sold_qs = sold_qs.filter(total__gte=min_amount)
-        if max_amount:
-            money_qs = money_qs.filter(amount__lte=max_amount)
-            sold_qs = sold_qs.filter(total__lte=max_amount)
-            
-        # Specific Logic for "Items List" on Dashboard
-        # Now we use 'due_days' OR just general list view if we want.
-        # But per original logic, filtered_items was specifically for "Due > X Days".
-        # Let's keep that but respect 'show_closed'.
-        
-        if due_days:
-            cutoff_date = datetime.date.today() - datetime.timedelta(days=due_days)
-            # If checked, we specifically want to SHOW these items in a list
-            
-            # Start with base likely filtered by date/amount
-            filtered_items = sold_qs.filter(date__lte=cutoff_date).order_by('date')
-            
-            # Application of show_closed toggle
-            if not show_closed:
-                filtered_items = filtered_items.filter(is_closed=False)
-                
-            filtered_total = filtered_items.aggregate(Sum('total'))['total__sum'] or 0
-            
-            # For Net Due Calculation: ALWAYS use Open Items sum, regardless of what we show/hide.
-            # We want "Net Due" to represent what is truly outstanding.
-            outstanding_items_qs = sold_qs.filter(date__lte=cutoff_date, is_closed=False)
-            outstanding_items_total = outstanding_items_qs.aggregate(Sum('total'))['total__sum'] or 0
-            
-            # Calculate Total Received (Global) to determine Unused Money
-            # Unused Money = Global Money - Value of Closed Items
-            # This represents the "Advance/Balance" available to pay off these open items.
-            global_total_received = MoneyReceived.objects.aggregate(Sum('amount'))['amount__sum'] or 0
-            
-            # We need the value of closed items. calculate_status returns it.
-            
-            unused_money = global_total_received - closed_items_val
-            
-            # NET DUE = Outstanding Open Items - Unused Money
-            filtered_balance = outstanding_items_total - unused_money
-
-
-            
-    # Summary Cards (Filtered)
-    total_received = money_qs.aggregate(Sum('amount'))['amount__sum'] or 0
-    total_sold = sold_qs.aggregate(Sum('total'))['total__sum'] or 0
-    balance = total_sold - total_received
-    
-    # Chart Data - Aggregate by Date (Filtered)
-    daily_received = money_qs.values('date').annotate(total=Sum('amount')).order_by('date')
-    daily_sold = sold_qs.values('date').annotate(total=Sum('total')).order_by('date')
-    
-    # Process into a dictionary {date: {received: 0, sold: 0}} to align dates
-    data_map = {}
-    
-    for entry in daily_received:
-        d = entry['date'].strftime('%Y-%m-%d')
-        if d not in data_map: data_map[d] = {'received': 0, 'sold': 0}
-        data_map[d]['received'] = float(entry['total'])
-
-    for entry in daily_sold:
-        d = entry['date'].strftime('%Y-%m-%d')
-        if d not in data_map: data_map[d] = {'received': 0, 'sold': 0}
-        data_map[d]['sold'] = float(entry['total'])
-    
-    # Sort by date
-    sorted_dates = sorted(data_map.keys())
-    
-    chart_labels = sorted_dates
-    chart_received = [data_map[d]['received'] for d in sorted_dates]
-    chart_sold = [data_map[d]['sold'] for d in sorted_dates]
-
-    context = {
-        'total_received': total_received,
-        'total_sold': total_sold,
-        'balance': balance,
-        'chart_labels': json.dumps(chart_labels, cls=DjangoJSONEncoder),
-        'chart_received': json.dumps(chart_received, cls=DjangoJSONEncoder),
-        'chart_sold': json.dumps(chart_sold, cls=DjangoJSONEncoder),
-        'filter_form': filter_form,
-        'filtered_items': filtered_items, # Pass the list if "Due" was checked
-        'filtered_total': filtered_total,
-        'filtered_balance': filtered_balance,
-        'unused_money': unused_money,
-    }
-    return render(request, 'sales/index.html', context)
+    cleaned_data = filter_form.cleaned_data if filter_form.is_valid() else {}
+
+    # Cards and due items come from the summary service in a
+    # fixed number of queries; flags are already settled on write. The
+    # optional party filter scopes everything to one buyer's ledger. The result
+    # is cached per data version, so repeat views cost one query. The due
+    # cutoff moves with the calendar, hence today's date in the key. Writes
+    # not yet caught up by the settlement scheduler show as pending.
+    state = settlement.get_state()
+    with metrics.timer('dashboard_summary'):
+        summary = view_cache.cached(
+            'index', dict(cleaned_data, today=datetime.date.today()), state.data_version,
+            lambda: dict(dashboard.build_summary(cleaned_data, state.data_version),
+                         settlement_pending=scheduler.pending()),
+        )
+
+    context = dict(summary)
+    context['filter_form'] = filter_form
+    context['chart_url'] = chart_url(request)
+    with metrics.timer('render'):
+        return render(request, 'sales/index.html', context)
+
+def chart_url(request):
+    # The chart is fetched from /api/chart/ once the page has loaded, with
+    # the page's filters. Emitted with json_script, not inside the <script>
+    # where autoescaping would turn '&' into '&amp;'.
+    query = request.GET.urlencode()
+    return reverse('sales:api_chart') + (f'?{query}' if query else '')
 
 def money_received(request):
-    calculate_status()
     if request.method == 'POST':
         form = MoneyReceivedForm(request.POST)
         if form.is_valid():
-            form.save()
+            # Settled by the scheduler's next pass rather than on this request.
+            with scheduler.deferred():
+                form.save()
             return redirect('sales:money_received')
     else:
         form = MoneyReceivedForm(initial={'date': datetime.date.today()})
     
-    entries = MoneyReceived.objects.all().order_by('-date', '-id')
-    
-    # Filter
     filter_form = FilterForm(request.GET or None)
-    if filter_form.is_valid():
-        start_date = filter_form.cleaned_data.get('start_date')
-        end_date = filter_form.cleaned_data.get('end_date')
-        min_amount = filter_form.cleaned_data.get('min_amount')
-        max_amount = filter_form.cleaned_data.get('max_amount')
-        
-        if start_date:
-            entries = entries.filter(date__gte=start_date)
-        if end_date:
-            entries = entries.filter(date__lte=end_date)
-        if min_amount:
-            entries = entries.filter(amount__gte=min_amount)
-        if max_amount:
-            entries = entries.filter(amount__lte=max_amount)
-    
-    total_received = entries.aggregate(Sum('amount'))['amount__sum'] or 0
-    unsettled_money = entries.filter(is_settled=False).aggregate(Sum('amount'))['amount__sum'] or 0
-    
+    cleaned_data = filter_form.cleaned_data if filter_form.is_valid() else {}
+
+    version = settlement.data_version()
+
+    def build():
+        # Same rows as the export, archived ones included only when the
+        # date range reaches back into the archive. Totals cover the whole
+        # filtered set; only one page of rows is rendered.
+        entries = export.filtered(ledger.MONEY, cleaned_data)
+        total, still_open = list_totals(ledger.MONEY, cleaned_data, entries, version)
+        return {
+            'total_received': total,
+            'unsettled_money': still_open,
+            'page': paginate(entries, ('-date', '-id'), page_query(cleaned_data, request.GET)),
+            'settlement_pending': scheduler.pending(),
+        }
+
+    with metrics.timer('list_query'):
+        listing = view_cache.cached('money_received', _listing_params(filter_form, request.GET), version, build)
+
     return render(request, 'sales/money_received.html', {
         'form': form,
-        'entries': entries,
-        'total_received': total_received,
-        'unsettled_money': unsettled_money,
+        'entries': listing['page'],
+        'page': listing['page'],
+        'total_received': listing['total_received'],
+        'unsettled_money': listing['unsettled_money'],
+        'settlement_pending': listing['settlement_pending'],
         'filter_form': filter_form
     })
 
 def item_sold(request):
-    calculate_status()
     if request.method == 'POST':
         form = ItemSoldForm(request.POST)
         if form.is_valid():
-            form.save()
+            with scheduler.deferred():
+                form.save()
             return redirect('sales:item_sold')
     else:
         form = ItemSoldForm(initial={'date': datetime.date.today()})
     
-    items = ItemSold.objects.all().order_by('-date', 'id')
-    
-    # Filter
     filter_form = FilterForm(request.GET or None)
-    if filter_form.is_valid():
-        start_date = filter_form.cleaned_data.get('start_date')
-        end_date = filter_form.cleaned_data.get('end_date')
-        min_amount = filter_form.cleaned_data.get('min_amount')
-        max_amount = filter_form.cleaned_data.get('max_amount')
-        # We also support due_days here if user wants to see it on generic list
-        due_days = filter_form.cleaned_data.get('due_days')
-        show_closed = filter_form.cleaned_data.get('show_closed') # Add checking show_closed
-
-        if start_date:
-            items = items.filter(date__gte=start_date)
-        if end_date:
-            items = items.filter(date__lte=end_date)
-        if min_amount:
-            items = items.filter(total__gte=min_amount)
-        if max_amount:
-            items = items.filter(total__lte=max_amount)
-            
-        if due_days:
-            cutoff_date = datetime.date.today() - datetime.timedelta(days=due_days)
-            items = items.filter(date__lte=cutoff_date)
-            
-        if show_closed is False: # If not explictly True (and if field exists)
-             # Actually, simpler: if not filter_form.cleaned_data.get('show_closed'):
-             pass
-             # We haven't implemented filtering logic based on show_closed in item_sold VIEW yet, 
-             # but user just asked for AMOUNT. 
-             # Let's add the Amount calculation first.
-    
-    total_sold = items.aggregate(Sum('total'))['total__sum'] or 0
-    open_sales = items.filter(is_closed=False).aggregate(Sum('total'))['total__sum'] or 0
-    
+    cleaned_data = filter_form.cleaned_data if filter_form.is_valid() else {}
+
+    version = settlement.data_version()
+
+    def build():
+        # As for money_received; the due_days filter applies here too.
+        items = export.filtered(ledger.ITEM, cleaned_data)
+        total, still_open = list_totals(ledger.ITEM, cleaned_data, items, version)
+        return {
+            'total_sold': total,
+            'open_sales': still_open,
+            'page': paginate(items, ('-date', 'id'), page_query(cleaned_data, request.GET)),
+            'settlement_pending': scheduler.pending(),
+        }
+
+    with metrics.timer('list_query'):
+        listing = view_cache.cached('item_sold', _listing_params(filter_form, request.GET), version, build)
+
     return render(request, 'sales/item_sold.html', {
         'form': form,
-        'items': items,
-        'total_sold': total_sold,
-        'open_sales': open_sales,
+        'items': listing['page'],
+        'page': listing['page'],
+        'total_sold': listing['total_sold'],
+        'open_sales': listing['open_sales'],
+        'settlement_pending': listing['settlement_pending'],
         'filter_form': filter_form
     })
 
+# kind -> (value field, closed/settled flag)
+LIST_VALUES = {
+    ledger.ITEM: ('total', 'is_closed'),
+    ledger.MONEY: ('amount', 'is_settled'),
+}
+
+def list_totals(kind, cleaned_data, segments, version):
+    """(total, open) value of a list page's filtered rows."""
+    if snapshot.enabled() and dashboard.row_filtered(cleaned_data):
+        # Binary search and prefix sums on the in-memory snapshot; date-only
+        # filters are indexed SQL sums and need no rebuild after a write.
+        until = export.due_before(cleaned_data) if kind == ledger.ITEM else None
+        return snapshot.current(version).sums(kind, cleaned_data, until)
+    field, flag = LIST_VALUES[kind]
+    total = sum(queryset.aggregate(s=Sum(field))['s'] or 0 for queryset in segments)
+    # Archived rows are all closed/settled; only the live segment can be open.
+    still_open = segments[-1].filter(**{flag: False}).aggregate(s=Sum(field))['s'] or 0
+    return total, still_open
+
+def _listing_params(filter_form, query):
+    # Cache key for a list page: the valid filters, the page cursor and size.
+    params = dict(filter_form.cleaned_data) if filter_form.is_valid() else {}
+    params.update({name: query.get(name) for name in PAGE_PARAMS})
+    params['today'] = datetime.date.today()
+    return params
+
+def export_money(request):
+    return _export(request, ledger.MONEY)
+
+def export_items(request):
+    return _export(request, ledger.ITEM)
+
+def _export(request, kind):
+    # Same filters as the list pages; ?format=xlsx needs openpyxl.
+    filter_form = FilterForm(request.GET or None)
+    cleaned_data = filter_form.cleaned_data if filter_form.is_valid() else {}
+    fmt = export.XLSX if request.GET.get('format') == export.XLSX else export.CSV
+    return export.response(kind, cleaned_data, fmt)
+
+def cache_stats(request):
+    return JsonResponse(dict(view_cache.stats(), snapshot=snapshot.stats()))
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def delete_money(request, pk):
     entry = get_object_or_404(MoneyReceived, pk=pk)
-    entry.delete()
+    with scheduler.deferred():
+        entry.delete()
     return redirect('sales:money_received')
 
 def delete_item(request, pk):
     item = get_object_or_404(ItemSold, pk=pk)
-    item.delete()
+    with scheduler.deferred():
+        item.delete()
     return redirect('sales:item_sold')
 
+def import_data(request):
+    stats = None
+    error = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            # Parsed as a stream; large uploads are never read into memory whole.
+            rows = importer.read_rows(importer.open_upload(upload), importer.detect_format(upload.name))
+            try:
+                stats = importer.import_rows(rows, kind=form.cleaned_data['kind'] or None,
+                                             skip_invalid=form.cleaned_data['skip_invalid'])
+                logger.info('Imported %s: %s', upload.name, stats)
+            except importer.ImportFailed as e:
+                error = e
+    else:
+        form = ImportForm()
+    return render(request, 'sales/import.html', {'form': form, 'stats': stats, 'error': error})
+
 def pdf_report(request):
-    money_entries = MoneyReceived.objects.all().order_by('date')
-    item_entries = ItemSold.objects.all().order_by('date')
-    
-    total_money = money_entries.aggregate(Sum('amount'))['amount__sum'] or 0
-    total_sales = item_entries.aggregate(Sum('total'))['total__sum'] or 0
-    balance = total_sales - total_money
-    
-    html_string = render_to_string('sales/pdf_report.html', {
-        'money_entries': money_entries,
-        'item_entries': item_entries,
-        'total_money': total_money,
-        'total_sales': total_sales,
-        'balance': balance,
-        'date': datetime.date.today()
-    })
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'inline; filename="sales_report.pdf"'
-    
-    pisa_status = pisa.CreatePDF(html_string, dest=response)
-    
-    if pisa_status.err:
-        return HttpResponse('We had some errors <pre>' + html_string + '</pre>')
-    return response
+    # Rendering happens on the report worker pool; an unchanged dataset is
+    # served straight from the cached file. ?engine=native draws the report
+    # without the HTML template.
+    job = jobs.submit({'engine': request.GET.get('engine')})
+    if job.status == jobs.DONE:
+        return _report_file(job)
+    return render(request, 'sales/report_pending.html', {'job': job})
+
+def report_status(request, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return JsonResponse({'id': job_id, 'status': 'unknown'}, status=404)
+    data = {'id': job.id, 'status': job.status}
+    if job.status == jobs.DONE:
+        data['download_url'] = reverse('sales:report_download', args=[job.id])
+    if job.status == jobs.FAILED:
+        data['error'] = job.error
+    return JsonResponse(data)
+
+def report_download(request, job_id):
+    job = jobs.get(job_id)
+    if job is None or job.status != jobs.DONE:
+        raise Http404('Report not ready')
+    return _report_file(job)
+
+def _report_file(job):
+    try:
+        output = open(job.path, 'rb')
+    except FileNotFoundError:
+        # Pruned between the status check and the download.
+        raise Http404('Report expired')
+    return FileResponse(output, content_type='application/pdf', filename='sales_report.pdf', as_attachment=False)
 
 def backup_database(request):
     try:
         # Source path
         db_path = os.path.join(settings.BASE_DIR, 'db.sqlite3')
-        
-        # Backup directory
-        backup_dir = os.path.join(settings.BASE_DIR, 'backup')
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-            
-        # Timestamped filename
+
+        # Timestamped snapshot name
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        backup_filename = f"db_backup_{timestamp}.sqlite3"
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
+        snapshot_name = f"db_backup_{timestamp}"
+
         if os.path.exists(db_path):
-            shutil.copy2(db_path, backup_path)
-            # messages.success(request, f"Database backed up: {backup_filename}")
+            # Only chunks that changed since the last snapshot are stored.
+            manifest = backup_store.create_snapshot(snapshot_name, db_path)
+            print(f"Backup created: {snapshot_name} ({manifest['size'] / 1024:.2f} KB, "
+                  f"{manifest['stored_bytes'] / 1024:.2f} KB new)")
+            # messages.success(request, f"Database backed up: {snapshot_name}")
         else:
             # messages.error(request, "Database file not found!")
             pass
-            
+
     except Exception as e:
         # messages.error(request, f"Backup failed: {str(e)}")
         print(f"Backup Error: {e}")
-        
+
     return redirect(request.META.get('HTTP_REFERER', 'sales:index'))
 
 def backup_list(request):
     backup_dir = os.path.join(settings.BASE_DIR, 'backup')
     backups = []
+    # Full-copy backups from before the snapshot store.
     if os.path.exists(backup_dir):
         for f in os.listdir(backup_dir):
             if f.endswith('.sqlite3'):
@@ -354,44 +281,65 @@ def backup_list(request):
                     'size': f"{size:.2f} KB",
                     'date': datetime.datetime.fromtimestamp(mtime)
                 })
-    
+
+    for manifest in backup_store.list_snapshots():
+        backups.append({
+            'filename': manifest['name'] + backup_store.SNAPSHOT_SUFFIX,
+            'size': f"{manifest['size'] / 1024:.2f} KB ({manifest['stored_bytes'] / 1024:.2f} KB new)",
+            'date': datetime.datetime.fromisoformat(manifest['created'])
+        })
+
     # Sort by date descending (newest first)
     backups.sort(key=lambda x: x['date'], reverse=True)
-    
+
     return render(request, 'sales/backup_list.html', {'backups': backups})
 
 def restore_backup(request, filename):
     if request.method != 'POST':
         # Safety check: Only allow POST for restore actions
         return redirect('sales:backup_list')
-        
+
+    rebuilt_path = None
     try:
         source_path = os.path.join(settings.BASE_DIR, 'backup', filename)
         dest_path = os.path.join(settings.BASE_DIR, 'db.sqlite3')
-        
+
+        if filename.endswith(backup_store.SNAPSHOT_SUFFIX):
+            # Rebuild the snapshot from its chunks before touching the live DB.
+            name = filename[:-len(backup_store.SNAPSHOT_SUFFIX)]
+            fd, rebuilt_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix='.sqlite3')
+            os.close(fd)
+            source_path = backup_store.materialize(name, rebuilt_path)
+
         if not os.path.exists(source_path):
             # messages.error(request, 'Backup file not found')
             return redirect('sales:backup_list')
-            
+
         # 1. SAFETY BACKUP of current state
         if os.path.exists(dest_path):
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            safety_filename = f"SAFETY_BACKUP_BEFORE_RESTORE_{timestamp}.sqlite3"
-            safety_path = os.path.join(settings.BASE_DIR, 'backup', safety_filename)
-            shutil.copy2(dest_path, safety_path)
-            print(f"Safety backup created: {safety_filename}")
-            
-        # 2. Close connections to release lock
-        connections.close_all()
-        
-        # 3. Restore
-        shutil.copy2(source_path, dest_path)
-        print(f"Restored from: {filename}")
-        
+            safety_name = f"SAFETY_BACKUP_BEFORE_RESTORE_{timestamp}"
+            backup_store.create_snapshot(safety_name, dest_path)
+            print(f"Safety backup created: {safety_name}")
+
+        # 2. Stage, verify and atomically swap the file in. Requests that
+        #    arrive during the swap are held by MaintenanceMiddleware.
+        version_before = settlement.data_version()
+        stats, swap_seconds = maintenance.atomic_restore(source_path, dest_path)
+        snapshot.invalidate()
+        print(f"Restored from: {filename} ({stats}, swap {swap_seconds * 1000:.1f} ms)")
+
+        # 3. The restored file carries its own watermark; re-walk from scratch.
+        settlement.settle_all(full=True)
+        settlement.bump_version(after=version_before)
+
         # messages.success(request, 'Database restored successfully.')
-        
+
     except Exception as e:
         print(f"Restore Failed: {e}")
         # messages.error(request, f"Restore failed: {e}")
-        
+    finally:
+        if rebuilt_path and os.path.exists(rebuilt_path):
+            os.remove(rebuilt_path)
+
     return redirect('sales:index')